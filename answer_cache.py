@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+# --- CONFIGURATION ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+# How often (seconds) the catalog version is re-read from Qdrant
+CATALOG_VERSION_POLL = float(os.getenv("CATALOG_VERSION_POLL", "5"))
+
+
+class SemanticAnswerCache:
+    """
+    Caches final agent answers keyed by the question's embedding.
+
+    A lookup returns the stored answer of the most similar cached question if
+    its cosine similarity is at least `threshold`, the entry is younger than
+    `ttl`, and the product catalog has not changed since it was stored.
+    `catalog_version` returns the current version (e.g. product_payload.catalog_version
+    for the cache's shop in the products collection); it is polled at most every `version_poll`
+    seconds. Vectors are kept as one float32 matrix so a lookup is a single
+    matrix-vector product.
+    """
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        catalog_version: Optional[Callable[[], float]] = None,
+        version_poll: float = CATALOG_VERSION_POLL,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.catalog_version = catalog_version
+        self.version_poll = version_poll
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._answers: List[str] = []
+        self._questions: List[str] = []
+        self._created: List[float] = []
+        self._catalog_version: Optional[float] = None
+        self._catalog_version = self._read_catalog_version()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _read_catalog_version(self) -> Optional[float]:
+        self._version_checked = time.monotonic()
+        if self.catalog_version is None:
+            return None
+        try:
+            return self.catalog_version()
+        except Exception as e:
+            print(f"⚠️ Could not read the catalog version: {e}")
+            return self._catalog_version
+
+    def _check_catalog(self) -> None:
+        """Drops every entry once ingestion has touched the catalog."""
+        if time.monotonic() - self._version_checked < self.version_poll:
+            return
+        version = self._read_catalog_version()
+        if version != self._catalog_version:
+            self._catalog_version = version
+            self._clear()
+
+    def _clear(self) -> None:
+        self._vectors = None
+        self._answers, self._questions, self._created = [], [], []
+
+    def _keep(self, mask: np.ndarray) -> None:
+        self._vectors = self._vectors[mask] if mask.any() else None
+        self._answers = [a for a, k in zip(self._answers, mask) if k]
+        self._questions = [q for q, k in zip(self._questions, mask) if k]
+        self._created = [c for c, k in zip(self._created, mask) if k]
+
+    def lookup(self, vector) -> Optional[Tuple[str, float]]:
+        """Returns (answer, similarity) on a hit, else None."""
+        with self._lock:
+            self._check_catalog()
+            if self._vectors is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            expired = np.array([now - c > self.ttl for c in self._created])
+            if expired.any():
+                self._keep(~expired)
+                if self._vectors is None:
+                    self.misses += 1
+                    return None
+            scores = self._vectors @ self._normalize(vector)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self.hits += 1
+                return self._answers[best], float(scores[best])
+            self.misses += 1
+            return None
+
+    def store(self, question: str, vector, answer: str) -> None:
+        with self._lock:
+            self._check_catalog()
+            row = self._normalize(vector)[None, :]
+            self._vectors = row if self._vectors is None else np.vstack([self._vectors, row])
+            self._answers.append(answer)
+            self._questions.append(question)
+            self._created.append(time.time())
+            if len(self._answers) > self.max_entries:
+                # Oldest entries go first
+                mask = np.zeros(len(self._answers), dtype=bool)
+                mask[-self.max_entries:] = True
+                self._keep(mask)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._answers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
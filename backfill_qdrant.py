@@ -1,15 +1,25 @@
+import argparse
 import os
 import requests
 from bs4 import BeautifulSoup
 from openai import OpenAI
-from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
 from dotenv import load_dotenv
+from embedding_batcher import EmbeddingBatcher, openai_embed_fn
+from embedding_cache import get_default_cache
+from qdrant_writer import BatchedQdrantWriter, make_qdrant_client
+from product_payload import (
+    CONTENT_HASH_FIELD, content_hash, split_unchanged, patch_payloads,
+    build_product_payload, ensure_payload_indexes, bump_catalog_version
+)
+from hybrid_search import require_sparse_vectors, product_vectors
+from collection_config import create_products_collection
+from shop_registry import ShopCredentials, default_shop_id, get_shop_registry
 
 load_dotenv()
 
 # --- CONFIG ---
-SHOPIFY_STORE_URL = os.getenv("SHOPIFY_STORE_URL")
-SHOPIFY_ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN")
+# Shop domains and Admin API tokens come from the shop registry (shops file or SHOPIFY_* env)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
 
@@ -18,15 +28,15 @@ PAGE_LIMIT = 250
 
 # --- CLIENTS ---
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
-qdrant = QdrantClient(url=QDRANT_URL)
+qdrant = make_qdrant_client(QDRANT_URL)
+embedding_batcher = EmbeddingBatcher(openai_embed_fn(openai_client), cache=get_default_cache())
 
-headers = {
-    "X-Shopify-Access-Token": SHOPIFY_ACCESS_TOKEN
-}
-
-def fetch_all_products():
+def fetch_all_products(shop: ShopCredentials):
     products = []
-    url = f"https://{SHOPIFY_STORE_URL}/admin/api/2024-10/products.json?limit={PAGE_LIMIT}"
+    headers = {
+        "X-Shopify-Access-Token": shop.access_token
+    }
+    url = f"https://{shop.shop_id}/admin/api/2024-10/products.json?limit={PAGE_LIMIT}"
 
     while url:
         resp = requests.get(url, headers=headers)
@@ -42,57 +52,114 @@ def fetch_all_products():
 
     return products
 
-def main():
-    products = fetch_all_products()
-    print(f"📦 Found {len(products)} products in Shopify")
-
-    for p in products:
-        product_id = p["id"]
-        title = p.get("title", "")
-        vendor = p.get("vendor", "")
-        tags = p.get("tags", "")
-        handle = p.get("handle", "")
-
-        raw_html = p.get("body_html") or ""
-        soup = BeautifulSoup(raw_html, "html.parser")
-        clean_description = soup.get_text(separator=" ")
-
-        variants = p.get("variants", [])
-        price = variants[0]["price"] if variants else "0.00"
-
-        text_to_embed = (
-            f"Product: {title}. "
-            f"Vendor: {vendor}. "
-            f"Tags: {tags}. "
-            f"Description: {clean_description}"
-        )
-
-        embedding = openai_client.embeddings.create(
-            input=text_to_embed,
-            model="text-embedding-3-small"
-        ).data[0].embedding
-
-        payload = {
-            "title": title,
-            "vendor": vendor,
-            "price": price,
-            "handle": handle,
-            "tags": tags,
-            "description": clean_description
-        }
-
-        qdrant.upsert(
-            collection_name=COLLECTION_NAME,
-            points=[{
-                "id": product_id,
-                "vector": embedding,
-                "payload": payload
-            }]
-        )
-
-        print(f"✅ Backfilled product {product_id}")
-
-    print("🎉 Backfill completed successfully")
+def build_product_record(p, shop_id=None):
+    """
+    Returns (product_id, text_to_embed, payload) for a REST product.
+    """
+    product_id = p["id"]
+    title = p.get("title", "")
+    vendor = p.get("vendor", "")
+    tags = p.get("tags", "")
+    handle = p.get("handle", "")
+
+    raw_html = p.get("body_html") or ""
+    soup = BeautifulSoup(raw_html, "html.parser")
+    clean_description = soup.get_text(separator=" ")
+
+    variants = p.get("variants", [])
+
+    text_to_embed = (
+        f"Product: {title}. "
+        f"Vendor: {vendor}. "
+        f"Tags: {tags}. "
+        f"Description: {clean_description}"
+    )
+
+    payload = build_product_payload(
+        title=title,
+        vendor=vendor,
+        product_type=p.get("product_type", ""),
+        tags=tags,
+        handle=handle,
+        description=clean_description,
+        variants=variants,
+        options=p.get("options"),
+        shop_id=shop_id
+    )
+    payload[CONTENT_HASH_FIELD] = content_hash(text_to_embed)
+    return product_id, text_to_embed, payload
+
+def main(force: bool = False, shop_id: str = None):
+    """
+    Backfills every product of one shop (default: SHOPIFY_STORE_URL). Products
+    whose embedded text is unchanged since the last run only get their payload
+    patched, unless `force` is set.
+    """
+    shop = get_shop_registry().get(shop_id or default_shop_id())
+    if shop is None or not shop.access_token:
+        raise SystemExit(f"❌ No credentials for shop {shop_id or default_shop_id()!r}")
+    products = fetch_all_products(shop)
+    print(f"📦 Found {len(products)} products in Shopify ({shop.shop_id})")
+
+    # Embed a few full batches at a time so memory stays bounded on big catalogs
+    chunk_size = embedding_batcher.batch_size * embedding_batcher.max_concurrency
+
+    if qdrant.collection_exists(COLLECTION_NAME):
+        require_sparse_vectors(qdrant, COLLECTION_NAME)
+    else:
+        create_products_collection(qdrant, COLLECTION_NAME)
+        force = True
+    ensure_payload_indexes(qdrant, COLLECTION_NAME)
+
+    skipped = 0
+    with BatchedQdrantWriter(qdrant, COLLECTION_NAME) as writer:
+        for start in range(0, len(products), chunk_size):
+            records = [build_product_record(p, shop.shop_id) for p in products[start:start + chunk_size]]
+            if force:
+                changed, unchanged = records, []
+            else:
+                changed, unchanged = split_unchanged(qdrant, COLLECTION_NAME, records)
+                patch_payloads(qdrant, COLLECTION_NAME, unchanged)
+                skipped += len(unchanged)
+            records = changed
+            embeddings = embedding_batcher.embed([text for _, text, _ in records])
+
+            for (product_id, text, payload), embedding in zip(records, embeddings):
+                writer.add(PointStruct(id=product_id, vector=product_vectors(embedding, text), payload=payload))
+
+            print(f"✅ Backfilled products {start + 1}-{start + len(changed) + len(unchanged)}")
+
+    bump_catalog_version(qdrant, COLLECTION_NAME, [shop.shop_id])
+    print(
+        f"🎉 Backfill completed successfully: {writer.points_written} points in "
+        f"{writer.batches_written} batches ({writer.throughput:.0f} points/s while uploading), "
+        f"{skipped} unchanged products only had their payload patched"
+    )
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Backfill all Shopify products into Qdrant")
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Re-embed and rewrite every product, e.g. to add sparse vectors to existing points"
+    )
+    parser.add_argument("--shop", help="Shop domain to backfill (default: SHOPIFY_STORE_URL)")
+    parser.add_argument("--all-shops", action="store_true", help="Backfill every shop in the shop registry")
+    args = parser.parse_args()
+    if args.all_shops:
+        registry = get_shop_registry()
+        failed = []
+        for registered_shop in registry.shop_ids():
+            shop = registry.get(registered_shop)
+            if shop is None or not shop.access_token:
+                print(f"⚠️ Skipping {registered_shop}: no access token")
+                continue
+            try:
+                main(force=args.force, shop_id=registered_shop)
+            except Exception as e:
+                # One broken shop must not stop the others
+                print(f"❌ Backfill failed for {registered_shop}: {e}")
+                failed.append(registered_shop)
+        if failed:
+            raise SystemExit(f"❌ Backfill failed for {len(failed)} shop(s): {', '.join(failed)}")
+    else:
+        main(force=args.force, shop_id=args.shop)
@@ -0,0 +1,207 @@
+"""
+Tokens and latency of the agent loop for shopper questions with constraints
+("red jacket under $150 in stock"): filtering in Qdrant (the search tool's
+filter arguments) vs. the old three-step flow, where the model searched
+without filters, then called the removed `filter_products` tool with the
+whole product list as its argument, then answered.
+
+    python -m benchmarks.agent_tokens --llm-latency-ms 600 --output-token-ms 20
+
+The LLM is a scripted stand-in that replays the tool calls of each flow, so
+no OpenAI key is needed. Prompt sizes come from the agent's own estimate
+(`prompt_tokens` in the state); output tokens are estimated from the tool
+call arguments and answer the model has to generate. Each call takes
+--llm-latency-ms plus --output-token-ms per output token, which is where
+echoing a product list back costs time. Products live in an in-process
+QdrantClient(":memory:") with hash_embed_fn vectors.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import time
+import warnings
+
+# langgraph_agent builds its OpenAI clients at import; nothing is sent to them here
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+warnings.filterwarnings("ignore", message="Failed to obtain server version")
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import tool
+from qdrant_client import QdrantClient
+
+import langgraph_agent as agent
+from collection_config import create_products_collection
+from embedding_batcher import estimate_tokens, hash_embed_fn
+from tool_serialization import extract_product_ids
+from benchmarks.stand_ins import SerializedClient, catalog_points, stand_in_embedders, synthetic_products
+
+SHOP = "bench-store.myshopify.com"
+ANSWER = "Here are the products that match what you're looking for."
+
+# (question, search filters the model should pass)
+QUESTIONS = [
+    ("red jacket under $150 that I can buy now", {"color": "red", "product_type": "jacket", "max_price": 150, "in_stock": True}),
+    ("black sneakers from acme", {"color": "black", "product_type": "Sneakers", "vendor": "acme"}),
+    ("blue headphones between $50 and $200", {"color": "blue", "product_type": "headphones", "min_price": 50, "max_price": 200}),
+    ("in-stock green backpack", {"color": "green", "product_type": "backpack", "in_stock": True}),
+]
+# The only constraints the old filter_products tool accepted
+LEGACY_FILTER_ARGS = ("min_price", "max_price", "color")
+
+
+@tool
+def filter_products(
+    products: list,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    color: str | None = None
+) -> list:
+    """
+    Filter a list of products based on price range and color.
+
+    The tool the agent used before filters moved into the search, kept here
+    (same arguments and behaviour) as the benchmark baseline.
+    """
+    filtered = []
+    for p in products:
+        price = float(p["price"])
+        if min_price is not None and price < min_price:
+            continue
+        if max_price is not None and price > max_price:
+            continue
+        tags = p.get("tags") or []
+        if isinstance(tags, list):
+            tags = ", ".join(tags)
+        if color and color.lower() not in tags.lower():
+            continue
+        filtered.append(p)
+    return filtered
+
+
+def table_to_products(content: str) -> list:
+    """The product dicts a search ToolMessage shows, i.e. what the model echoes back."""
+    table = json.loads(content)
+    prefix = table.get("url_prefix", "")
+    products = [dict(zip(table["columns"], row)) for row in table.get("rows", [])]
+    for product in products:
+        if "url" in product:
+            product["url"] = prefix + product["url"]
+    return products
+
+
+class ScriptedModel:
+    """
+    Stand-in for `model_with_tools`. Per turn it plays `flow`:
+      filtered  search with filters -> answer
+      legacy    search without filters -> filter_products(products=<the
+                search results>, ...) -> answer
+    Each call sleeps `latency` plus `output_token_latency` per output token.
+    """
+    def __init__(self, latency: float, output_token_latency: float):
+        self.latency = latency
+        self.output_token_latency = output_token_latency
+        self.flow = "filtered"
+        self.search_args = {}
+        self.filter_args = {}
+        self.output_tokens = 0
+
+    def respond(self, messages) -> AIMessage:
+        last = messages[-1]
+        if not isinstance(last, ToolMessage):
+            return AIMessage(content="", tool_calls=[
+                {"name": "search_products_qdrant", "args": self.search_args, "id": "call_search"}
+            ])
+        if self.flow == "legacy" and last.tool_call_id == "call_search":
+            args = {"products": table_to_products(last.content), **self.filter_args}
+            return AIMessage(content="", tool_calls=[{"name": "filter_products", "args": args, "id": "call_filter"}])
+        return AIMessage(content=ANSWER)
+
+    def invoke(self, messages):
+        response = self.respond(messages)
+        generated = response.content + "".join(json.dumps(c["args"]) for c in response.tool_calls)
+        tokens = estimate_tokens(generated)
+        self.output_tokens += tokens
+        time.sleep(self.latency + tokens * self.output_token_latency)
+        return response
+
+
+def load_catalog(client: QdrantClient, count: int) -> None:
+    create_products_collection(client, agent.COLLECTION_NAME)
+    client.upsert(agent.COLLECTION_NAME, points=catalog_points(synthetic_products(count), hash_embed_fn(), SHOP))
+
+
+def matches(payload: dict, filters: dict) -> bool:
+    """Whether a product meets every constraint of the question."""
+    if "color" in filters and filters["color"] not in payload["options"]:
+        return False
+    if "product_type" in filters and payload["product_type"].lower() != filters["product_type"].lower():
+        return False
+    if "vendor" in filters and payload["vendor"].lower() != filters["vendor"].lower():
+        return False
+    if filters.get("in_stock") and not payload["in_stock"]:
+        return False
+    if "min_price" in filters and payload["max_price"] < filters["min_price"]:
+        return False
+    return "max_price" not in filters or payload["price"] <= filters["max_price"]
+
+
+def run_flow(model: ScriptedModel, flow: str, limit: int, unfiltered_limit: int, payloads: dict) -> dict:
+    llm_calls, tokens, latencies, shown, relevant = 0, 0, [], 0, 0
+    model.flow, model.output_tokens = flow, 0
+    for question, filters in QUESTIONS:
+        if flow == "filtered":
+            model.search_args = {"query": question, "limit": limit, **filters}
+        else:
+            # Nothing pushed down: fetch extra so enough matches survive filter_products
+            model.search_args = {"query": question, "limit": unfiltered_limit}
+            model.filter_args = {k: v for k, v in filters.items() if k in LEGACY_FILTER_ARGS}
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            state = agent.agent.invoke({"messages": [HumanMessage(content=question)], "shop_id": SHOP})
+        latencies.append(time.perf_counter() - start)
+        llm_calls += state["llm_calls"]
+        tokens += sum(state["prompt_tokens"])
+        # The products the answer is based on: the last tool result of the turn
+        final_tool = [m for m in state["messages"] if isinstance(m, ToolMessage)][-1]
+        ids = extract_product_ids(final_tool.content)
+        shown += len(ids)
+        relevant += sum(matches(payloads[int(pid)], filters) for pid in ids)
+    return {
+        "llm_calls": llm_calls / len(QUESTIONS),
+        "prompt_tokens": tokens / len(QUESTIONS),
+        "output_tokens": model.output_tokens / len(QUESTIONS),
+        "latency": statistics.mean(latencies),
+        "precision": relevant / shown if shown else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agent tokens and latency: filters in Qdrant vs. the filter_products round-trip")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=5, help="Results the filtered search asks for")
+    parser.add_argument("--unfiltered-limit", type=int, default=20, help="Results the unfiltered search asks for")
+    parser.add_argument("--llm-latency-ms", type=float, default=600.0, help="Fixed cost of one LLM call")
+    parser.add_argument("--output-token-ms", type=float, default=20.0, help="Generation time per output token")
+    parser.add_argument("--embed-latency-ms", type=float, default=50.0)
+    parser.add_argument("--qdrant-latency-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    client = QdrantClient(":memory:")
+    load_catalog(client, args.products)
+    payloads = {p.id: p.payload for p in client.scroll(agent.COLLECTION_NAME, limit=args.products)[0]}
+    agent.qdrant = SerializedClient(client, args.qdrant_latency_ms / 1000)
+    agent.embedding_batcher, _ = stand_in_embedders(args.embed_latency_ms / 1000)
+    model = ScriptedModel(args.llm_latency_ms / 1000, args.output_token_ms / 1000)
+    agent.model_with_tools = model
+    agent.tools_by_name[filter_products.name] = filter_products
+
+    print(f"{len(QUESTIONS)} questions, {args.products} products, LLM {args.llm_latency_ms:g}ms per call "
+          f"+ {args.output_token_ms:g}ms per output token")
+    for label, flow in (("filter_products", "legacy"), ("filters in Qdrant", "filtered")):
+        stats = run_flow(model, flow, args.limit, args.unfiltered_limit, payloads)
+        print(f"{label:<18} {stats['llm_calls']:.1f} LLM calls  ~{stats['prompt_tokens']:6.0f} prompt tokens  "
+              f"~{stats['output_tokens']:5.0f} output tokens  {stats['latency'] * 1000:7.0f}ms per question  "
+              f"{stats['precision']:6.1%} of shown products match")
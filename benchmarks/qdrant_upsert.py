@@ -0,0 +1,79 @@
+"""
+Qdrant write throughput: one upsert per product (the old backfill loop) vs.
+BatchedQdrantWriter, on synthetic products with random embeddings.
+
+    python -m benchmarks.qdrant_upsert                           # in-process QdrantClient(":memory:")
+    python -m benchmarks.qdrant_upsert --url http://localhost:6333
+    QDRANT_PREFER_GRPC=true python -m benchmarks.qdrant_upsert --url http://localhost:6333
+
+Each run writes into a throwaway collection that is deleted afterwards.
+":memory:" has no network round-trip, so it mostly shows per-call overhead;
+a local server is the representative run.
+"""
+import argparse
+import random
+import time
+import uuid
+
+from qdrant_client.models import PointStruct
+
+from collection_config import EMBEDDING_DIMENSIONS, create_products_collection
+from hybrid_search import product_vectors
+from qdrant_writer import (
+    QDRANT_UPSERT_BATCH_SIZE, QDRANT_UPSERT_PARALLEL, BatchedQdrantWriter, is_local_client, make_qdrant_client
+)
+
+
+def synthetic_points(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    points = []
+    for i in range(count):
+        text = f"Product: Item {i}. Description: synthetic product number {i} in colour {rng.choice(['red', 'blue'])}"
+        vector = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+        points.append(PointStruct(id=i + 1, vector=product_vectors(vector, text), payload={"title": f"Item {i}"}))
+    return points
+
+
+def per_point(client, collection: str, points) -> float:
+    start = time.perf_counter()
+    for point in points:
+        client.upsert(collection_name=collection, points=[point])
+    return time.perf_counter() - start
+
+
+def batched(client, collection: str, points, batch_size: int, parallel: int) -> float:
+    start = time.perf_counter()
+    with BatchedQdrantWriter(client, collection, batch_size=batch_size, parallel=parallel) as writer:
+        writer.extend(points)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-point vs batched Qdrant upserts")
+    parser.add_argument("--url", default=":memory:")
+    parser.add_argument("--points", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=QDRANT_UPSERT_BATCH_SIZE)
+    parser.add_argument("--parallel", type=int, default=QDRANT_UPSERT_PARALLEL)
+    args = parser.parse_args()
+
+    client = make_qdrant_client(args.url)
+    points = synthetic_points(args.points)
+    print(f"{args.points} points, {EMBEDDING_DIMENSIONS} dims, against {args.url}")
+
+    runs = [
+        ("one upsert per point", lambda c, name: per_point(c, name, points)),
+        (f"batched {args.batch_size} x1", lambda c, name: batched(c, name, points, args.batch_size, 1)),
+    ]
+    # In-process clients always upload one batch at a time
+    if args.parallel > 1 and not is_local_client(client):
+        runs.append((f"batched {args.batch_size} x{args.parallel}",
+                     lambda c, name: batched(c, name, points, args.batch_size, args.parallel)))
+    for label, run in runs:
+        collection = f"bench_upsert_{uuid.uuid4().hex[:8]}"
+        create_products_collection(client, collection)
+        try:
+            elapsed = run(client, collection)
+            stored = client.count(collection, exact=True).count
+            print(f"{label:<24} {elapsed:7.2f}s  {args.points / elapsed:9.0f} points/s  ({stored} stored)")
+        finally:
+            client.delete_collection(collection)
@@ -0,0 +1,138 @@
+"""
+Load test for the recommender: requests/sec and tail latency of the async
+endpoints vs. the old blocking `def` handlers, which ran the same calls on
+Starlette's threadpool.
+
+    python -m benchmarks.recommender_load --requests 2000 --concurrency 200
+
+Both apps get the same mocked backends: a stand-in embedder and a Qdrant
+stub returning canned hits, each call delayed by --embed-latency-ms /
+--qdrant-latency-ms. The traffic mix is 70% /search/semantic and 30%
+/recommend/similar, sent in-process through the ASGI apps.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import warnings
+
+import httpx
+from fastapi import FastAPI
+
+# recommender connects to QDRANT_URL at import; the benchmark swaps in local clients
+warnings.filterwarnings("ignore", message="Failed to obtain server version")
+import recommender
+from collection_config import search_params
+from hybrid_search import hybrid_query
+from product_payload import build_product_payload
+from benchmarks.stand_ins import CannedQdrant, stand_in_embedders, synthetic_products
+
+SHOP = "bench-store.myshopify.com"
+COLLECTION = recommender.COLLECTION_NAME
+QUERIES = ["red headphones", "waterproof jacket", "black sneakers", "small backpack", "smart watch", "speaker"]
+
+
+def catalog_payloads(count: int):
+    return [
+        build_product_payload(
+            title=product["title"], vendor=product["vendor"], product_type=product["product_type"],
+            tags=product["tags"], handle=product["handle"], description=product["body_html"],
+            variants=product["variants"], options=product["options"], shop_id=SHOP,
+        )
+        for product in synthetic_products(count)
+    ]
+
+
+def legacy_app(qdrant: CannedQdrant, embedder) -> FastAPI:
+    """The pre-async handlers: blocking embed + Qdrant calls in `def` endpoints."""
+    app = FastAPI()
+
+    @app.post("/search/semantic")
+    def semantic_search(request: recommender.SearchRequest):
+        vector = embedder.embed([request.query])[0]
+        search_filter = recommender.build_qdrant_filter(request.filters, request.shop_id)
+        response = qdrant.query_points(
+            collection_name=COLLECTION,
+            **hybrid_query(vector, request.query, search_filter, request.limit, dense_params=search_params())
+        )
+        return {"query": request.query, "results": [recommender.format_hit(hit) for hit in response.points]}
+
+    @app.post("/recommend/similar")
+    def recommend_similar(request: recommender.SimilarRequest):
+        search_filter = recommender.build_qdrant_filter(request.filters, request.shop_id)
+        query = recommender.recommend_request([request.product_id], [], search_filter, request.limit)
+        response = qdrant.query_points(
+            collection_name=COLLECTION, query=query.query, using=query.using, query_filter=query.filter,
+            search_params=query.params, limit=query.limit, with_payload=True,
+        )
+        return {"recommendations": [recommender.format_hit(hit) for hit in response.points]}
+
+    return app
+
+
+def workload(count: int, products: int, seed: int = 0):
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        if rng.random() < 0.7:
+            requests.append(("/search/semantic", {"query": rng.choice(QUERIES), "shop_id": SHOP}))
+        else:
+            requests.append(("/recommend/similar", {"product_id": rng.randint(1, products), "shop_id": SHOP}))
+    return requests
+
+
+async def drive(app: FastAPI, requests, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async def one(path, body):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(path, json=body)
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(path, body) for path, body in requests))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": len(requests) / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+        "errors": errors,
+    }
+
+
+async def main(args) -> None:
+    embed_latency, qdrant_latency = args.embed_latency_ms / 1000, args.qdrant_latency_ms / 1000
+    # Small vectors: the stub ignores them, so only the delay should cost anything
+    sync_embedder, async_embedder = stand_in_embedders(embed_latency, dimensions=64)
+    payloads = catalog_payloads(args.products)
+    recommender.qdrant_client = CannedQdrant(payloads, qdrant_latency, is_async=True)
+    recommender.embedding_batcher = async_embedder
+
+    requests = workload(args.requests, args.products)
+    print(f"{args.requests} requests, concurrency {args.concurrency}, embed {args.embed_latency_ms}ms, "
+          f"qdrant {args.qdrant_latency_ms}ms")
+    before = legacy_app(CannedQdrant(payloads, qdrant_latency), sync_embedder)
+    for label, app in (("before (sync def)", before), ("after (async)", recommender.app)):
+        stats = await drive(app, requests, args.concurrency)
+        print(f"{label:<18} {stats['rps']:8.1f} req/s  p50={stats['p50']:7.1f}ms  p95={stats['p95']:7.1f}ms  "
+              f"p99={stats['p99']:7.1f}ms  errors={stats['errors']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommender requests/sec and tail latency, before vs after")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--embed-latency-ms", type=float, default=80.0)
+    parser.add_argument("--qdrant-latency-ms", type=float, default=10.0)
+    asyncio.run(main(parser.parse_args()))
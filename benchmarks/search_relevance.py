@@ -0,0 +1,118 @@
+"""
+Offline relevance and latency of product search: dense only, sparse (BM25)
+only, and the hybrid RRF query the services use, on a synthetic catalog.
+
+    python -m benchmarks.search_relevance
+    EMBEDDING_SEARCH_DIMENSIONS=256 python -m benchmarks.search_relevance    # Matryoshka layout
+    python -m benchmarks.search_relevance --url http://localhost:6333
+
+Two kinds of labelled queries:
+  paraphrase  "crimson headset": relevant = every red headphones product. Only
+              the dense half can find these (no word overlaps the catalog).
+  exact       a product's own title, e.g. "Acme Headphones 42": relevant = that
+              product. The dense stand-in embedder cannot tell such products
+              apart, so these need the sparse half.
+Hybrid search should be close to the better single method on both; if it
+drops to the dense numbers on exact queries, fusion is losing the sparse ranking.
+
+Dense vectors come from benchmarks.stand_ins.concept_embed_fn, where synonyms
+share a vector, so no OpenAI key is needed.
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+import warnings
+
+warnings.filterwarnings("ignore", message="Failed to obtain server version")
+
+from collection_config import EMBEDDING_DIMENSIONS, create_products_collection, search_params
+from hybrid_search import (
+    EMBEDDING_SEARCH_DIMENSIONS, SPARSE_VECTOR_NAME, dense_prefetch, hybrid_query, query_sparse_vector
+)
+from qdrant_writer import BatchedQdrantWriter, make_qdrant_client
+from benchmarks.stand_ins import (
+    COLORS, SYNONYMS, catalog_points, concept_embed_fn, prefetch_as_query, synthetic_products
+)
+
+
+def labelled_queries(products, count: int, seed: int = 0):
+    """[(kind, query, relevant product IDs)]"""
+    rng = random.Random(seed)
+    queries = []
+    types = sorted({p["product_type"] for p in products})
+    for _ in range(count):
+        product_type, color = rng.choice(types), rng.choice(COLORS)
+        relevant = {
+            p["id"] for p in products
+            if p["product_type"] == product_type and color in p["tags"].split(", ")
+        }
+        if relevant:
+            text = f"{rng.choice(SYNONYMS[color][1:])} {rng.choice(SYNONYMS[product_type.lower()][1:])}"
+            queries.append(("paraphrase", text, relevant))
+    for product in rng.sample(products, count):
+        queries.append(("exact", product["title"], {product["id"]}))
+    return queries
+
+
+def mode_query(mode: str, vector, text: str, limit: int) -> dict:
+    """query_points arguments for one retrieval mode."""
+    if mode == "hybrid":
+        return hybrid_query(vector, text, limit=limit, dense_params=search_params())
+    if mode == "dense":
+        return prefetch_as_query(dense_prefetch(vector, limit=limit, dense_params=search_params()))
+    return {"query": query_sparse_vector(text), "using": SPARSE_VECTOR_NAME, "limit": limit}
+
+
+def evaluate(client, collection: str, queries, vectors, mode: str, k: int) -> dict:
+    """precision@k for paraphrase queries, recall@k and MRR for exact ones, latency for all."""
+    scores = {"paraphrase": [], "exact": [], "mrr": []}
+    latencies = []
+    for (kind, text, relevant), vector in zip(queries, vectors):
+        start = time.perf_counter()
+        response = client.query_points(collection_name=collection, **mode_query(mode, vector, text, k))
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids = [point.id for point in response.points]
+        if kind == "paraphrase":
+            scores["paraphrase"].append(sum(i in relevant for i in ids) / min(k, len(relevant)))
+        else:
+            scores["exact"].append(float(any(i in relevant for i in ids)))
+            rank = next((r for r, i in enumerate(ids, 1) if i in relevant), None)
+            scores["mrr"].append(1 / rank if rank else 0.0)
+    latencies.sort()
+    return {
+        **{name: statistics.mean(values) for name, values in scores.items()},
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dense vs sparse vs hybrid search relevance and latency")
+    parser.add_argument("--url", default=":memory:")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=100, help="Queries of each kind")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    client = make_qdrant_client(args.url)
+    embed = concept_embed_fn(EMBEDDING_DIMENSIONS)
+    products = synthetic_products(args.products)
+    queries = labelled_queries(products, args.queries)
+    vectors = embed([text for _, text, _ in queries])
+
+    collection = f"bench_relevance_{uuid.uuid4().hex[:8]}"
+    create_products_collection(client, collection)
+    try:
+        with BatchedQdrantWriter(client, collection) as writer:
+            writer.extend(catalog_points(products, embed))
+        print(f"{args.products} products, {len(queries)} queries, k={args.k}, "
+              f"search dimensions {EMBEDDING_SEARCH_DIMENSIONS or EMBEDDING_DIMENSIONS}, against {args.url}")
+        for mode in ("dense", "sparse", "hybrid"):
+            stats = evaluate(client, collection, queries, vectors, mode, args.k)
+            print(f"{mode:<7} paraphrase precision@{args.k} {stats['paraphrase']:5.2f}   "
+                  f"exact recall@{args.k} {stats['exact']:5.2f}  MRR {stats['mrr']:5.2f}   "
+                  f"p50 {stats['p50']:6.1f}ms  p95 {stats['p95']:6.1f}ms")
+    finally:
+        client.delete_collection(collection)
@@ -0,0 +1,142 @@
+"""
+Per-request latency of the pooled ShopifyClient vs. a fresh httpx.AsyncClient
+per call (the old behaviour), against a local stand-in GraphQL endpoint.
+
+    python -m benchmarks.shopify_pool                # plain HTTP
+    python -m benchmarks.shopify_pool --tls          # HTTPS with a throwaway self-signed cert
+
+--tls is the representative run: a client per call pays for loading the CA
+bundle and a TCP+TLS handshake every time. The stand-in is uvicorn, which
+only speaks HTTP/1.1, so this measures keep-alive reuse, not HTTP/2
+multiplexing.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+import certifi
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from shopify_tools import ShopifyClient
+
+QUERY = "query { shop { name } }"
+
+app = FastAPI()
+
+
+@app.post("/admin/api/{version}/graphql.json")
+async def graphql(version: str):
+    return {
+        "data": {"shop": {"name": "bench"}},
+        "extensions": {"cost": {
+            "requestedQueryCost": 1,
+            "actualQueryCost": 1,
+            "throttleStatus": {"maximumAvailable": 1000000, "currentlyAvailable": 1000000, "restoreRate": 1000000},
+        }},
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def self_signed_cert(directory: str):
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+def start_server(port: int, cert: str = None, key: str = None) -> uvicorn.Server:
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                            ssl_certfile=cert, ssl_keyfile=key)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def unpooled_request(client: ShopifyClient) -> None:
+    # What _make_request did before the shared pool: a client per call
+    async with httpx.AsyncClient() as http:
+        response = await http.post(client.base_url, headers=client.headers,
+                                   json={"query": QUERY, "variables": {}}, timeout=10.0)
+        response.raise_for_status()
+
+
+async def pooled_request(client: ShopifyClient) -> None:
+    await client.execute_query(QUERY)
+
+
+async def measure(request_fn, client: ShopifyClient, requests: int, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await request_fn(client)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await request_fn(client)  # warm-up (and opens the pool for the pooled run)
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "rps": requests / elapsed,
+    }
+
+
+async def run(port: int, tls: bool, requests: int, concurrency: int) -> None:
+    async with ShopifyClient(f"127.0.0.1:{port}", "bench-token", http2=tls) as client:
+        if not tls:
+            # ShopifyClient always builds an https:// URL
+            client.base_url = client.base_url.replace("https://", "http://")
+        for name, fn in (("new client per call", unpooled_request), ("pooled ShopifyClient", pooled_request)):
+            stats = await measure(fn, client, requests, concurrency)
+            print(f"{name:<22} p50={stats['p50']:7.2f}ms  p95={stats['p95']:7.2f}ms  {stats['rps']:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pooled vs unpooled ShopifyClient latency")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--tls", action="store_true", help="Serve the stand-in over HTTPS")
+    args = parser.parse_args()
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        cert = key = None
+        if args.tls:
+            cert, key = self_signed_cert(tmp)
+            # httpx picks the CA up from here for both clients. Keep the full
+            # certifi bundle in it so building a client costs what it does in production.
+            bundle = os.path.join(tmp, "ca-bundle.pem")
+            with open(bundle, "w") as out, open(certifi.where()) as ca, open(cert) as own:
+                out.write(ca.read() + own.read())
+            os.environ["SSL_CERT_FILE"] = bundle
+        server = start_server(port, cert, key)
+        print(f"Stand-in GraphQL server on {'https' if args.tls else 'http'}://127.0.0.1:{port} "
+              f"({args.requests} requests, concurrency {args.concurrency})")
+        try:
+            asyncio.run(run(port, args.tls, args.requests, args.concurrency))
+        finally:
+            server.should_exit = True
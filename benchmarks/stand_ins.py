@@ -0,0 +1,222 @@
+"""
+Local stand-ins shared by the benchmarks: embedders and Qdrant clients with
+a fixed, configurable delay, and a synthetic product catalog.
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import List
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http.models import QueryResponse, ScoredPoint
+from qdrant_client.models import PointStruct, Prefetch
+
+from embedding_batcher import EmbeddingBatcher, hash_embed_fn
+from hybrid_search import product_vectors, tokenize
+from product_payload import build_product_payload
+
+VENDORS = ["Acme", "Northwind", "Globex", "Initech", "Umbrella"]
+PRODUCT_TYPES = ["Headphones", "Speaker", "Jacket", "Sneakers", "Backpack", "Watch"]
+COLORS = ["red", "blue", "black", "white", "green"]
+SIZES = ["S", "M", "L"]
+
+# Words a shopper may use for each product type / color; the first is the catalog's own
+SYNONYMS = {
+    "headphones": ["headphones", "headset", "earphones", "cans"],
+    "speaker": ["speaker", "soundbar", "boombox"],
+    "jacket": ["jacket", "coat", "parka", "anorak"],
+    "sneakers": ["sneakers", "trainers", "runners", "kicks"],
+    "backpack": ["backpack", "rucksack", "daypack", "knapsack"],
+    "watch": ["watch", "timepiece", "wristwatch"],
+    "red": ["red", "crimson", "scarlet", "ruby"],
+    "blue": ["blue", "navy", "azure", "cobalt"],
+    "black": ["black", "onyx", "jet", "charcoal"],
+    "white": ["white", "ivory", "snow", "cream"],
+    "green": ["green", "olive", "emerald", "sage"],
+}
+
+
+class SerializedClient:
+    """
+    Wraps a sync QdrantClient: every call waits `latency` seconds (a stand-in
+    for the network), then runs under a lock, because the in-process
+    ":memory:" client is not thread-safe.
+    """
+    def __init__(self, client: QdrantClient, latency: float = 0.0):
+        self._client = client
+        self._latency = latency
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if self._latency:
+                time.sleep(self._latency)
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+
+class DelayedAsyncClient:
+    """AsyncQdrantClient whose calls first await `latency` seconds."""
+    def __init__(self, client: AsyncQdrantClient, latency: float = 0.0):
+        self._client = client
+        self._latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            if self._latency:
+                await asyncio.sleep(self._latency)
+            return await attr(*args, **kwargs)
+        return call
+
+
+class CannedQdrant:
+    """
+    Mock Qdrant for load tests: `query_points` / `query_batch_points` wait
+    `latency` seconds and return the same hits. Sync or async via `is_async`.
+    """
+    def __init__(self, payloads: List[dict], latency: float = 0.0, is_async: bool = False):
+        self._points = [
+            ScoredPoint(id=i + 1, version=0, score=1.0 - i / 100, payload=payload)
+            for i, payload in enumerate(payloads)
+        ]
+        self._latency = latency
+        self._is_async = is_async
+
+    def _response(self, limit: int) -> QueryResponse:
+        return QueryResponse(points=self._points[:limit])
+
+    def query_points(self, collection_name: str, limit: int = 10, **kwargs):
+        if self._is_async:
+            return self._aquery(limit)
+        time.sleep(self._latency)
+        return self._response(limit)
+
+    async def _aquery(self, limit: int) -> QueryResponse:
+        await asyncio.sleep(self._latency)
+        return self._response(limit)
+
+    async def query_batch_points(self, collection_name: str, requests, **kwargs):
+        await asyncio.sleep(self._latency)
+        return [self._response(request.limit) for request in requests]
+
+
+def prefetch_as_query(prefetch: Prefetch) -> dict:
+    """`query_points` arguments running a single Prefetch (e.g. hybrid_search.dense_prefetch) on its own."""
+    return {
+        "prefetch": prefetch.prefetch,
+        "query": prefetch.query,
+        "using": prefetch.using,
+        "query_filter": prefetch.filter,
+        "search_params": prefetch.params,
+        "limit": prefetch.limit,
+    }
+
+
+def stand_in_embedders(latency: float = 0.0, dimensions: int = 1536):
+    """
+    (sync, async) EmbeddingBatchers over hash vectors, each request taking
+    `latency` seconds. No cache, so every call pays the delay.
+    """
+    embed = hash_embed_fn(dimensions)
+
+    def sync_embed(texts: List[str]) -> List[List[float]]:
+        time.sleep(latency)
+        return embed(texts)
+
+    async def async_embed(texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(latency)
+        return embed(texts)
+
+    return EmbeddingBatcher(sync_embed), EmbeddingBatcher(async_embed)
+
+
+def concept_embed_fn(dimensions: int = 1536, noise: float = 0.5):
+    """
+    Stand-in for a semantic embedder: synonyms ("crimson", "red") share one
+    concept vector, every other word only adds text-specific noise. So
+    paraphrases land close together, while names, numbers and SKUs are lost,
+    which is what the sparse half of hybrid search is for.
+    """
+    embed = hash_embed_fn(dimensions)
+    concept_of = {word: concept for concept, words in SYNONYMS.items() for word in words}
+    concepts = {concept: np.asarray(v) for concept, v in zip(SYNONYMS, embed(list(SYNONYMS)))}
+
+    def embed_texts(texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text, text_noise in zip(texts, embed(texts)):
+            vector = noise * np.asarray(text_noise)
+            for concept in {concept_of[t] for t in tokenize(text) if t in concept_of}:
+                vector += concepts[concept]
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+    return embed_texts
+
+
+def product_text(product: dict) -> str:
+    """The text the ingestion paths embed for a REST product."""
+    return (
+        f"Product: {product['title']}. Vendor: {product['vendor']}. "
+        f"Tags: {product['tags']}. Description: {product['body_html']}"
+    )
+
+
+def catalog_points(products: List[dict], embed, shop_id: str = None) -> List[PointStruct]:
+    """Product points (dense + sparse vectors, canonical payload) for `synthetic_products`."""
+    texts = [product_text(p) for p in products]
+    points = []
+    for product, text, vector in zip(products, texts, embed(texts)):
+        payload = build_product_payload(
+            title=product["title"], vendor=product["vendor"], product_type=product["product_type"],
+            tags=product["tags"], handle=product["handle"], description=product["body_html"],
+            variants=product["variants"], options=product["options"], shop_id=shop_id,
+        )
+        points.append(PointStruct(id=product["id"], vector=product_vectors(vector, text), payload=payload))
+    return points
+
+
+def synthetic_products(count: int, seed: int = 0) -> List[dict]:
+    """REST-shaped (webhook / products.json) products with sized and coloured variants."""
+    rng = random.Random(seed)
+    products = []
+    for i in range(1, count + 1):
+        vendor = rng.choice(VENDORS)
+        product_type = rng.choice(PRODUCT_TYPES)
+        colors = rng.sample(COLORS, 2)
+        price = round(rng.uniform(10, 400), 2)
+        variants = []
+        for j, (color, size) in enumerate((c, s) for c in colors for s in SIZES):
+            variants.append({
+                "id": i * 100 + j,
+                "sku": f"{vendor[:3].upper()}-{i:05d}-{color[:2].upper()}{size}",
+                "price": f"{price:.2f}",
+                "option1": color.title(),
+                "option2": size,
+                "inventory_quantity": rng.choice([0, 0, 3, 12]),
+                "inventory_management": "shopify",
+                "inventory_policy": "deny",
+                "inventory_item_id": i * 1000 + j,
+            })
+        products.append({
+            "id": i,
+            "title": f"{vendor} {product_type} {i}",
+            "body_html": f"<p>{vendor} {product_type.lower()} in {colors[0]} and {colors[1]}.</p>",
+            "vendor": vendor,
+            "product_type": product_type,
+            "tags": ", ".join([product_type.lower(), *colors]),
+            "handle": f"{vendor.lower()}-{product_type.lower()}-{i}",
+            "updated_at": "2024-05-01T12:00:00Z",
+            "options": [{"name": "Color", "values": [c.title() for c in colors]}, {"name": "Size", "values": SIZES}],
+            "variants": variants,
+        })
+    return products
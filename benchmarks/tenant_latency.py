@@ -0,0 +1,97 @@
+"""
+Per-tenant search latency with many shops in one collection: the hybrid
+query the services run, scoped to one shop by the `shop_id` tenant filter,
+for shops of very different catalog sizes. Also checks that no hit ever
+belongs to another shop.
+
+    python -m benchmarks.tenant_latency
+    python -m benchmarks.tenant_latency --url http://localhost:6333
+    QDRANT_TENANT_HNSW=true python -m benchmarks.tenant_latency --url http://localhost:6333
+
+Shop sizes follow a Zipf curve (a few big stores, a long tail of small
+ones). The in-process client scans every point, so the numbers only become
+representative against a server, where the tenant index and, with
+QDRANT_TENANT_HNSW, per-shop HNSW graphs apply.
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+import warnings
+
+warnings.filterwarnings("ignore", message="Failed to obtain server version")
+
+from collection_config import EMBEDDING_DIMENSIONS, create_products_collection, search_params
+from hybrid_search import hybrid_query
+from product_payload import SHOP_ID_FIELD, build_product_filter, ensure_payload_indexes
+from qdrant_writer import BatchedQdrantWriter, make_qdrant_client
+from benchmarks.stand_ins import COLORS, PRODUCT_TYPES, catalog_points, concept_embed_fn, synthetic_products
+
+
+def shop_sizes(shops: int, products: int) -> dict:
+    """{shop_id: product count}, Zipf-distributed, at least one product each."""
+    weights = [1 / rank for rank in range(1, shops + 1)]
+    sizes = [max(1, round(products * w / sum(weights))) for w in weights]
+    return {f"shop-{rank:03d}.myshopify.com": size for rank, size in enumerate(sizes, 1)}
+
+
+def load(client, collection: str, sizes: dict, embed) -> None:
+    products = synthetic_products(sum(sizes.values()))
+    with BatchedQdrantWriter(client, collection) as writer:
+        start = 0
+        for shop_id, size in sizes.items():
+            writer.extend(catalog_points(products[start:start + size], embed, shop_id))
+            start += size
+
+
+def measure(client, collection: str, shop_id, queries, vectors, limit: int) -> dict:
+    latencies, leaked = [], 0
+    search_filter = build_product_filter(shop_id=shop_id)
+    for text, vector in zip(queries, vectors):
+        start = time.perf_counter()
+        response = client.query_points(
+            collection_name=collection,
+            **hybrid_query(vector, text, search_filter, limit, dense_params=search_params())
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        leaked += sum(shop_id is not None and (p.payload or {}).get(SHOP_ID_FIELD) != shop_id for p in response.points)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "leaked": leaked,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shop-scoped search latency across tenants of different sizes")
+    parser.add_argument("--url", default=":memory:")
+    parser.add_argument("--shops", type=int, default=20)
+    parser.add_argument("--products", type=int, default=5000, help="Products across all shops")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per shop")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    client = make_qdrant_client(args.url)
+    embed = concept_embed_fn(EMBEDDING_DIMENSIONS)
+    sizes = shop_sizes(args.shops, args.products)
+    rng = random.Random(0)
+    queries = [f"{rng.choice(COLORS)} {rng.choice(PRODUCT_TYPES).lower()}" for _ in range(args.queries)]
+    vectors = embed(queries)
+
+    collection = f"bench_tenants_{uuid.uuid4().hex[:8]}"
+    create_products_collection(client, collection)
+    try:
+        ensure_payload_indexes(client, collection)
+        load(client, collection, sizes, embed)
+        print(f"{args.shops} shops, {sum(sizes.values())} products, {args.queries} queries per shop, against {args.url}")
+        print(f"{'shop':<28}{'products':>9}{'p50 ms':>9}{'p95 ms':>9}{'leaked':>8}")
+        # The unscoped row is the baseline: what every search would cost without the tenant filter
+        for shop_id in [None, *sizes]:
+            stats = measure(client, collection, shop_id, queries, vectors, args.limit)
+            label = shop_id or "(unscoped, all shops)"
+            size = sizes.get(shop_id, sum(sizes.values()))
+            print(f"{label:<28}{size:>9}{stats['p50']:>9.1f}{stats['p95']:>9.1f}{stats['leaked']:>8}")
+    finally:
+        client.delete_collection(collection)
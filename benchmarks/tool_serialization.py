@@ -0,0 +1,130 @@
+"""
+Prompt tokens per conversation for a canned multi-turn shopping transcript,
+with tool results sent to the model as `str(observation)` (the old
+ToolMessage content) vs. `serialize_tool_result` (minified, whitelisted,
+tabular, with products already shown in the turn listed by ID only).
+
+    python -m benchmarks.tool_serialization
+    python -m benchmarks.tool_serialization --description-words 150
+
+The tool results come from the agent's own tools, run against an in-process
+QdrantClient(":memory:") with a synthetic catalog, so their shapes are the
+real ones. Every LLM call's prompt is the whole history so far (no
+compaction), counted with message_compaction.estimate_prompt_tokens.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import warnings
+
+# langgraph_agent builds its OpenAI clients at import; nothing is sent to them here
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+warnings.filterwarnings("ignore", message="Failed to obtain server version")
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from qdrant_client import QdrantClient
+
+import langgraph_agent as agent
+from collection_config import create_products_collection
+from embedding_batcher import hash_embed_fn
+from message_compaction import estimate_prompt_tokens
+from tool_serialization import extract_product_ids, serialize_tool_result
+from benchmarks.stand_ins import SerializedClient, catalog_points, stand_in_embedders, synthetic_products
+
+SHOP = "bench-store.myshopify.com"
+SYSTEM = SystemMessage(content="You are a helpful shopping assistant.")
+FILLER = (
+    "crafted from durable materials with a comfortable fit lightweight design everyday use "
+    "water resistant finish adjustable details premium stitching easy care machine washable"
+).split()
+
+# One conversation: (user message, [(tool name, args)] called in that turn).
+# Turn 2 searches twice, so the second search repeats products of the first.
+TRANSCRIPT = [
+    ("Show me red jackets under $150", [
+        ("search_products_qdrant", {"query": "red jacket", "color": "red", "product_type": "jacket", "max_price": 150}),
+    ]),
+    ("Any black ones? Also show me jackets from Acme", [
+        ("search_products_qdrant", {"query": "black jacket", "product_type": "jacket", "limit": 8}),
+        ("search_products_qdrant", {"query": "jacket", "product_type": "jacket", "vendor": "acme", "limit": 8}),
+    ]),
+    ("Tell me more about the first one", [("get_product_details", "first")]),
+    ("Compare the first three", [("compare_products", "first three")]),
+    ("Which sizes does the second one have in stock?", [("get_product_details", "second")]),
+    ("Add the first one to my cart", [("add_to_cart", "first")]),
+]
+
+
+def pad_descriptions(products, words: int, seed: int = 0) -> None:
+    """Real product descriptions are paragraphs, not one line."""
+    rng = random.Random(seed)
+    for product in products:
+        product["body_html"] += "<p>" + " ".join(rng.choice(FILLER) for _ in range(words)) + "</p>"
+
+
+def resolve_args(args, last_results: list):
+    """Turns "first" / "second" / "first three" into IDs from the latest search."""
+    ids = [p["product_id"] for p in last_results]
+    if args in ("first", "second"):
+        return {"product_id": ids[0 if args == "first" else 1]}
+    if args == "first three":
+        return {"product_ids": ids[:3]}
+    return args
+
+
+def run_conversation(serialize: bool) -> dict:
+    messages = [SYSTEM]
+    prompt_tokens, llm_calls, result_tokens = 0, 0, 0
+    last_results = []
+    for question, calls in TRANSCRIPT:
+        messages.append(HumanMessage(content=question))
+        shown_ids = set()
+        for index, (name, args) in enumerate(calls):
+            prompt_tokens += estimate_prompt_tokens(messages)
+            llm_calls += 1
+            args = resolve_args(args, last_results)
+            messages.append(AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{index}"}]))
+            with contextlib.redirect_stdout(io.StringIO()):
+                observation = agent.run_tool_call({"name": name, "args": args}, SHOP)
+            if name == "search_products_qdrant":
+                last_results = observation
+            if serialize:
+                content = serialize_tool_result(name, observation, shown_ids)
+                shown_ids.update(extract_product_ids(content))
+            else:
+                content = str(observation)
+            tool_message = ToolMessage(content=content, tool_call_id=f"call_{index}")
+            result_tokens += estimate_prompt_tokens([tool_message])
+            messages.append(tool_message)
+        prompt_tokens += estimate_prompt_tokens(messages)
+        llm_calls += 1
+        messages.append(AIMessage(content="Here is what I found."))
+    return {"llm_calls": llm_calls, "prompt_tokens": prompt_tokens, "result_tokens": result_tokens}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prompt tokens per conversation: str(observation) vs serialize_tool_result")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--description-words", type=int, default=80, help="Filler words added to each description")
+    args = parser.parse_args()
+
+    products = synthetic_products(args.products)
+    pad_descriptions(products, args.description_words)
+    client = QdrantClient(":memory:")
+    create_products_collection(client, agent.COLLECTION_NAME)
+    client.upsert(agent.COLLECTION_NAME, points=catalog_points(products, hash_embed_fn(), SHOP))
+    agent.qdrant = SerializedClient(client)
+    agent.embedding_batcher, _ = stand_in_embedders()
+
+    turns = len(TRANSCRIPT)
+    print(f"{turns} user turns, {sum(len(calls) for _, calls in TRANSCRIPT)} tool calls, "
+          f"descriptions padded with {args.description_words} words")
+    baseline = None
+    for label, serialize in (("str(observation)", False), ("serialize_tool_result", True)):
+        stats = run_conversation(serialize)
+        baseline = baseline or stats["prompt_tokens"]
+        print(f"{label:<22} {stats['llm_calls']} LLM calls  ~{stats['result_tokens']:6d} tool result tokens  "
+              f"~{stats['prompt_tokens']:7d} prompt tokens per conversation "
+              f"({stats['prompt_tokens'] / baseline:.0%})")
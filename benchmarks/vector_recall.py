@@ -0,0 +1,185 @@
+"""
+Recall, memory and latency of the dense vector storage settings
+(collection_config): quantization with rescoring at several oversampling
+factors, and Matryoshka search vectors re-scored with the full-size ones at
+several candidate limits, checked against exact float32 search.
+
+    python -m benchmarks.vector_recall                          # offline sweep + in-process Qdrant
+    python -m benchmarks.vector_recall --vectors embeddings.npy # real embeddings (one row per product)
+    QDRANT_QUANTIZATION=scalar python -m benchmarks.vector_recall --url http://localhost:6333
+    EMBEDDING_SEARCH_DIMENSIONS=256 python -m benchmarks.vector_recall
+
+The sweep simulates Qdrant's scoring in numpy (int8 scalar quantization at
+QDRANT_SCALAR_QUANTILE, 1-bit binary quantization), fetches k x oversampling
+candidates and rescores them with the originals. Matryoshka rows quantize
+the search vector as QDRANT_QUANTIZATION does; the full-size vector adds no
+RAM, it is on disk and unquantized. The configured factor
+(collection_config.oversampling) and MATRYOSHKA_RESCORE_LIMIT are marked with
+*; they should reach ~1.0 recall@k.
+
+Without --vectors the embeddings are synthetic: clustered, with the topic
+signal concentrated in the leading dimensions like text-embedding-3 vectors. Queries are
+held-out rows. The Qdrant part loads the same vectors into a collection
+created with the current QDRANT_* settings and measures the service's dense
+query. The in-process client ignores quantization, so use --url for that.
+"""
+import argparse
+import statistics
+import time
+import uuid
+import warnings
+
+import numpy as np
+
+warnings.filterwarnings("ignore", message="Failed to obtain server version")
+
+from qdrant_client.models import PointStruct
+
+from collection_config import (
+    EMBEDDING_DIMENSIONS, QDRANT_QUANTIZATION, QDRANT_SCALAR_QUANTILE, QDRANT_VECTORS_ON_DISK,
+    create_products_collection, oversampling, search_params
+)
+from hybrid_search import EMBEDDING_SEARCH_DIMENSIONS, MATRYOSHKA_RESCORE_LIMIT, dense_prefetch, layout_vectors
+from qdrant_writer import BatchedQdrantWriter, make_qdrant_client
+from benchmarks.stand_ins import prefetch_as_query
+
+OVERSAMPLING = [1.0, 1.5, 2.0, 3.0, 4.0]
+SEARCH_DIMENSIONS = [256, 512]
+RESCORE_LIMITS = [10, 25, 50, 100, 200]
+MB = 1024 * 1024
+
+
+def synthetic_embeddings(count: int, dimensions: int, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """Topic centers whose weight falls off across dimensions, plus per-product noise."""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.normal(size=(clusters, dimensions)) * (np.arange(dimensions) + 1.0) ** -0.25)
+    noise = normalize(rng.normal(size=(count, dimensions)))
+    return normalize((centers[rng.integers(clusters, size=count)] + noise).astype(np.float32))
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise indices of the k highest scores, best first."""
+    k = min(k, scores.shape[1])
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1)
+    return np.take_along_axis(best, order, axis=1)
+
+
+def rescored_recall(approx: np.ndarray, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray,
+                    k: int, candidates: int) -> float:
+    """Recall@k after taking `candidates` by the approximate scores and rescoring them exactly."""
+    shortlist = top_k(approx, candidates)
+    exact = np.einsum("qd,qcd->qc", queries, corpus[shortlist])
+    found = np.take_along_axis(shortlist, top_k(exact, k), axis=1)
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def scalar_scores(corpus: np.ndarray, queries: np.ndarray, quantile: float = QDRANT_SCALAR_QUANTILE) -> np.ndarray:
+    """Dot products on int8-quantized document vectors (value range clipped at `quantile`)."""
+    low, high = np.quantile(corpus, 1 - quantile), np.quantile(corpus, quantile)
+    codes = np.round((np.clip(corpus, low, high) - low) / (high - low) * 255)
+    return queries @ (codes * (high - low) / 255 + low).T
+
+
+def binary_scores(corpus: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """Agreement of sign bits, as in 1-bit binary quantization."""
+    return np.sign(queries) @ np.sign(corpus).T
+
+
+def memory_mb(count: int, dimensions: int) -> dict:
+    """
+    {setting: (RAM MB with originals in RAM, RAM MB with QDRANT_VECTORS_ON_DISK)}
+    for `count` dense vectors, HNSW links not included. Quantized codes stay
+    in RAM either way (QDRANT_QUANTIZATION_ALWAYS_RAM).
+    """
+    full = count * dimensions * 4 / MB
+    return {"none": (full, 0.0), "scalar": (full * 1.25, full / 4), "binary": (full * 33 / 32, full / 32)}
+
+
+def sweep(corpus: np.ndarray, queries: np.ndarray, k: int) -> None:
+    truth = top_k(queries @ corpus.T, k)
+    memory = memory_mb(len(corpus), corpus.shape[1])
+    print(f"{'setting':<26}{'recall@' + str(k):>10}{'RAM MB':>10}{'RAM MB (vectors on disk)':>26}")
+    print(f"{'float32 (exact)':<26}{1.0:>10.3f}{memory['none'][0]:>10.1f}{memory['none'][1]:>26.1f}")
+    for mode, score_fn in (("scalar", scalar_scores), ("binary", binary_scores)):
+        approx = score_fn(corpus, queries)
+        for factor in OVERSAMPLING:
+            recall = rescored_recall(approx, corpus, queries, truth, k, int(np.ceil(k * factor)))
+            marker = "*" if factor == oversampling(mode) else " "
+            label = f"{mode} x{factor:g}{marker}"
+            print(f"{label:<26}{recall:>10.3f}{memory[mode][0]:>10.1f}{memory[mode][1]:>26.1f}")
+    for dimensions in sorted(set(SEARCH_DIMENSIONS) | ({EMBEDDING_SEARCH_DIMENSIONS} - {0})):
+        if dimensions >= corpus.shape[1]:
+            continue
+        # Only the search vector takes RAM, quantized as QDRANT_QUANTIZATION: the
+        # full-size vector is on disk and unquantized (collection_config.vectors_config)
+        short_corpus, short_queries = normalize(corpus[:, :dimensions]), normalize(queries[:, :dimensions])
+        short_mb = memory_mb(len(corpus), dimensions)[QDRANT_QUANTIZATION]
+        if QDRANT_QUANTIZATION == "scalar":
+            approx = scalar_scores(short_corpus, short_queries)
+        elif QDRANT_QUANTIZATION == "binary":
+            approx = binary_scores(short_corpus, short_queries)
+        else:
+            approx = short_queries @ short_corpus.T
+        for limit in RESCORE_LIMITS:
+            if limit < k:
+                continue
+            recall = rescored_recall(approx, corpus, queries, truth, k, limit)
+            marker = "*" if limit == MATRYOSHKA_RESCORE_LIMIT else " "
+            mode = "" if QDRANT_QUANTIZATION == "none" else f" {QDRANT_QUANTIZATION}"
+            label = f"{dimensions}d{mode} rescore {limit}{marker}"
+            print(f"{label:<26}{recall:>10.3f}{short_mb[0]:>10.1f}{short_mb[1]:>26.1f}")
+
+
+def dense_search(vector, k: int) -> dict:
+    """query_points arguments for the services' dense search (the dense half of hybrid_query)."""
+    return prefetch_as_query(dense_prefetch(vector, limit=k, dense_params=search_params()))
+
+
+def qdrant_run(url: str, corpus: np.ndarray, queries: np.ndarray, k: int) -> None:
+    client = make_qdrant_client(url)
+    collection = f"bench_recall_{uuid.uuid4().hex[:8]}"
+    create_products_collection(client, collection)
+    try:
+        with BatchedQdrantWriter(client, collection) as writer:
+            writer.extend(
+                PointStruct(id=i + 1, vector=layout_vectors(vector.tolist(), None)) for i, vector in enumerate(corpus)
+            )
+        truth = top_k(queries @ corpus.T, k) + 1
+        recalls, latencies = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            response = client.query_points(collection_name=collection, **dense_search(query.tolist(), k))
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len({p.id for p in response.points} & set(expected.tolist())) / k)
+        latencies.sort()
+        print(f"Qdrant ({url}, quantization={QDRANT_QUANTIZATION}, "
+              f"search dimensions {EMBEDDING_SEARCH_DIMENSIONS or EMBEDDING_DIMENSIONS}): recall@{k} {statistics.mean(recalls):.3f}  "
+              f"p50 {statistics.median(latencies):.1f}ms  p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f}ms")
+    finally:
+        client.delete_collection(collection)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall / memory / latency of the dense vector settings")
+    parser.add_argument("--vectors", help=".npy file of real embeddings (rows), instead of synthetic ones")
+    parser.add_argument("--count", type=int, default=10000, help="Synthetic corpus size")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--url", default=":memory:")
+    parser.add_argument("--skip-qdrant", action="store_true", help="Only run the offline sweep")
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = normalize(np.load(args.vectors).astype(np.float32))
+    else:
+        vectors = synthetic_embeddings(args.count + args.queries, EMBEDDING_DIMENSIONS)
+    corpus, queries = vectors[:-args.queries], vectors[-args.queries:]
+    print(f"{len(corpus)} vectors x {corpus.shape[1]} dims, {len(queries)} queries, k={args.k}")
+    sweep(corpus, queries, args.k)
+    if not args.skip_qdrant:
+        qdrant_run(args.url, corpus, queries, args.k)
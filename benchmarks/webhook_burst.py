@@ -0,0 +1,152 @@
+"""
+Load test for webhook ingestion: replays a burst of HMAC-signed
+products/update webhooks through the shopify_webhook app and measures how
+fast the ingest queue drains, for the asyncio and the thread worker pools.
+
+    python -m benchmarks.webhook_burst --events 2000 --embed-latency-ms 200
+
+OpenAI is replaced by a stand-in embedder (hash vectors after a fixed
+delay per request) and Qdrant by an in-process QdrantClient(":memory:").
+Requests go through the ASGI app in-process (signature check, routing,
+queueing) without a network hop.
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+import warnings
+
+tmp_dir = tempfile.mkdtemp(prefix="webhook_burst_")
+os.environ.setdefault("INGEST_QUEUE_PATH", os.path.join(tmp_dir, "ingest_queue.sqlite"))
+
+import httpx
+from qdrant_client import AsyncQdrantClient, QdrantClient
+
+# shopify_webhook connects to QDRANT_URL at import; the benchmark swaps in local clients
+warnings.filterwarnings("ignore", message="Failed to obtain server version")
+import shopify_webhook as wh
+from collection_config import create_products_collection, vectors_config
+from hybrid_search import SPARSE_VECTORS_CONFIG
+from ingest_queue import AsyncIngestWorkerPool, IngestQueue, IngestWorkerPool
+from benchmarks.stand_ins import SerializedClient, stand_in_embedders
+
+SHOP_DOMAIN = "bench-store.myshopify.com"
+
+
+def product_event(product_id: int, revision: int) -> dict:
+    return {
+        "id": product_id,
+        "title": f"Bench product {product_id} rev {revision}",
+        "body_html": f"<p>Synthetic product {product_id}, revision {revision}.</p>",
+        "vendor": "Bench",
+        "product_type": "Widget",
+        "tags": "bench, synthetic",
+        "handle": f"bench-{product_id}",
+        "updated_at": f"2024-05-01T12:{revision // 60:02d}:{revision % 60:02d}Z",
+        "variants": [{"id": product_id * 10, "price": "19.99", "inventory_quantity": 5,
+                      "inventory_management": "shopify", "option1": "Default Title"}],
+        "options": [{"name": "Title", "values": ["Default Title"]}],
+    }
+
+
+def signed(body: bytes) -> str:
+    digest = hmac.new(wh.SHOPIFY_SECRET.encode("utf-8"), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+async def replay(events, concurrency: int) -> float:
+    """POSTs every event; returns the seconds until the last one was accepted."""
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=wh.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def post(event):
+            body = json.dumps(event).encode("utf-8")
+            async with semaphore:
+                response = await client.post(
+                    "/webhooks/shopify/products-update",
+                    content=body,
+                    headers={"X-Shopify-Hmac-Sha256": signed(body), "X-Shopify-Shop-Domain": SHOP_DOMAIN},
+                )
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(event) for event in events))
+        return time.perf_counter() - start
+
+
+async def wait_drained(queue: IngestQueue, poll: float = 0.05) -> None:
+    while True:
+        metrics = await asyncio.to_thread(queue.metrics)
+        if metrics["depth"] == 0:
+            return
+        await asyncio.sleep(poll)
+
+
+async def run_mode(mode: str, events, args) -> dict:
+    wh.ingest_queue = IngestQueue(os.path.join(tmp_dir, f"{mode}-{uuid.uuid4().hex[:6]}.sqlite"))
+    wh.COLLECTION_NAME = f"bench_{mode}"
+    if mode == "async":
+        wh.async_qdrant_client = AsyncQdrantClient(":memory:")
+        await wh.async_qdrant_client.create_collection(
+            wh.COLLECTION_NAME, vectors_config=vectors_config(), sparse_vectors_config=SPARSE_VECTORS_CONFIG
+        )
+        pool = AsyncIngestWorkerPool(
+            wh.ingest_queue, wh.aprocess_and_ingest_products, wh.adelete_products_from_qdrant,
+            wh.aupdate_inventory_levels, workers=args.workers, batch_size=args.batch_size, poll_interval=0.05,
+        )
+    else:
+        wh.qdrant_client = SerializedClient(QdrantClient(":memory:"))
+        create_products_collection(wh.qdrant_client, wh.COLLECTION_NAME)
+        pool = IngestWorkerPool(
+            wh.ingest_queue, wh.process_and_ingest_products, wh.delete_products_from_qdrant,
+            wh.update_inventory_levels, workers=args.workers, batch_size=args.batch_size, poll_interval=0.05,
+        )
+
+    start = time.perf_counter()
+    pool.start()
+    accept_seconds = await replay(events, args.concurrency)
+    await wait_drained(wh.ingest_queue)
+    total_seconds = time.perf_counter() - start
+    if mode == "async":
+        await pool.stop()
+    else:
+        await asyncio.to_thread(pool.stop)
+    return {
+        "accepted_per_s": len(events) / accept_seconds,
+        "drained_per_s": len(events) / total_seconds,
+        "dead_letters": wh.ingest_queue.metrics()["dead_letters"],
+    }
+
+
+async def main(args) -> None:
+    wh.embedding_batcher, wh.async_embedding_batcher = stand_in_embedders(args.embed_latency_ms / 1000)
+    # Every event is a distinct product revision, so nothing coalesces away
+    events = [product_event(i % args.products + 1, i // args.products) for i in range(args.events)]
+    print(f"{len(events)} signed products/update events for {args.products} products, "
+          f"embed latency {args.embed_latency_ms}ms, {args.workers} workers x batch {args.batch_size}")
+    for mode in ("async", "threads"):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output) if not args.verbose else contextlib.nullcontext():
+            stats = await run_mode(mode, events, args)
+        print(f"{mode:<8} accepted {stats['accepted_per_s']:8.0f} events/s   "
+              f"ingested {stats['drained_per_s']:8.0f} events/s   dead letters {stats['dead_letters']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a burst of signed product webhooks")
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=2000, help="Distinct product IDs the events cycle through")
+    parser.add_argument("--concurrency", type=int, default=50, help="Webhook requests in flight")
+    parser.add_argument("--embed-latency-ms", type=float, default=200.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's per-batch logging")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,204 @@
+import argparse
+import os
+import time
+from typing import Dict, Optional, Union
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    BinaryQuantization, BinaryQuantizationConfig, CreateAlias, CreateAliasOperation, DeleteAlias,
+    DeleteAliasOperation, Distance, HnswConfigDiff, PointStruct, QuantizationSearchParams,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, SearchParams, VectorParams
+)
+
+from hybrid_search import (
+    DENSE_VECTOR_NAME, EMBEDDING_SEARCH_DIMENSIONS, FULL_VECTOR_NAME, SPARSE_VECTORS_CONFIG, convert_vectors
+)
+from product_payload import ensure_payload_indexes
+from qdrant_writer import BatchedQdrantWriter, make_qdrant_client
+
+# --- CONFIGURATION ---
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+# "none", "scalar" (int8, 4x smaller) or "binary" (1 bit, 32x smaller)
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none").lower()
+# Keep the quantized vectors in RAM even when the originals live on disk
+QDRANT_QUANTIZATION_ALWAYS_RAM = os.getenv("QDRANT_QUANTIZATION_ALWAYS_RAM", "true").lower() == "true"
+QDRANT_SCALAR_QUANTILE = float(os.getenv("QDRANT_SCALAR_QUANTILE", "0.99"))
+# Re-rank the quantized candidates with the original vectors
+QDRANT_RESCORE = os.getenv("QDRANT_RESCORE", "true").lower() == "true"
+# Candidates scored on quantized vectors = oversampling x limit; 0 uses the
+# per-mode default (benchmarks/vector_recall.py: binary needs ~3x for ~1.0 recall@10)
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "0"))
+DEFAULT_OVERSAMPLING = {"scalar": 2.0, "binary": 3.0}
+# Store the float32 originals (memmapped) on disk instead of RAM
+QDRANT_VECTORS_ON_DISK = os.getenv("QDRANT_VECTORS_ON_DISK", "false").lower() == "true"
+QDRANT_PAYLOAD_ON_DISK = os.getenv("QDRANT_PAYLOAD_ON_DISK", "false").lower() == "true"
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100"))
+QDRANT_HNSW_ON_DISK = os.getenv("QDRANT_HNSW_ON_DISK", "false").lower() == "true"
+# Search-time beam width; 0 leaves it to Qdrant
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", "0"))
+# Build one HNSW graph per shop instead of a global one. Only enable when
+# every search is shop-scoped (unscoped searches fall back to a full scan).
+QDRANT_TENANT_HNSW = os.getenv("QDRANT_TENANT_HNSW", "false").lower() == "true"
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+
+def vectors_config() -> Union[VectorParams, Dict[str, VectorParams]]:
+    """
+    A single full-size vector, or with EMBEDDING_SEARCH_DIMENSIONS the
+    shortened search vector plus a full-size one that has no HNSW graph
+    (m=0) and lives on disk, since it is only read for re-scoring.
+
+    The named vectors carry the quantization themselves, on the search vector
+    only: a collection-wide config would also keep a quantized copy of the
+    full vector in RAM, and VectorParams can't opt out of it at creation
+    (Disabled is only accepted by VectorParamsDiff).
+    """
+    if not EMBEDDING_SEARCH_DIMENSIONS:
+        return VectorParams(size=EMBEDDING_DIMENSIONS, distance=Distance.COSINE, on_disk=QDRANT_VECTORS_ON_DISK)
+    return {
+        DENSE_VECTOR_NAME: VectorParams(
+            size=EMBEDDING_SEARCH_DIMENSIONS, distance=Distance.COSINE, on_disk=QDRANT_VECTORS_ON_DISK,
+            quantization_config=quantization_config()
+        ),
+        FULL_VECTOR_NAME: VectorParams(
+            size=EMBEDDING_DIMENSIONS, distance=Distance.COSINE, on_disk=True, hnsw_config=HnswConfigDiff(m=0)
+        ),
+    }
+
+
+def hnsw_config() -> HnswConfigDiff:
+    if QDRANT_TENANT_HNSW:
+        return HnswConfigDiff(
+            m=0, payload_m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT, on_disk=QDRANT_HNSW_ON_DISK
+        )
+    return HnswConfigDiff(m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT, on_disk=QDRANT_HNSW_ON_DISK)
+
+
+def quantization_config(mode: str = QDRANT_QUANTIZATION) -> Optional[Union[ScalarQuantization, BinaryQuantization]]:
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"QDRANT_QUANTIZATION must be one of {QUANTIZATION_MODES}, got {mode!r}")
+    if mode == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8,
+            quantile=QDRANT_SCALAR_QUANTILE,
+            always_ram=QDRANT_QUANTIZATION_ALWAYS_RAM,
+        ))
+    if mode == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=QDRANT_QUANTIZATION_ALWAYS_RAM))
+    return None
+
+
+def oversampling(mode: str = QDRANT_QUANTIZATION) -> float:
+    return QDRANT_OVERSAMPLING or DEFAULT_OVERSAMPLING.get(mode, 1.0)
+
+
+def search_params(mode: str = QDRANT_QUANTIZATION) -> Optional[SearchParams]:
+    """
+    Dense search parameters matching the collection config: with quantization,
+    oversampling(mode) x limit candidates are scored on the quantized vectors
+    and then rescored with the originals.
+    """
+    quantization = None
+    if mode != "none":
+        quantization = QuantizationSearchParams(rescore=QDRANT_RESCORE, oversampling=oversampling(mode))
+    if quantization is None and not QDRANT_HNSW_EF:
+        return None
+    return SearchParams(hnsw_ef=QDRANT_HNSW_EF or None, quantization=quantization)
+
+
+def create_products_collection(client: QdrantClient, collection_name: str) -> None:
+    """Creates the products collection with the configured storage settings."""
+    print(
+        f"Creating Qdrant collection: {collection_name} (quantization={QDRANT_QUANTIZATION}, "
+        f"search_dimensions={EMBEDDING_SEARCH_DIMENSIONS or EMBEDDING_DIMENSIONS}, "
+        f"vectors_on_disk={QDRANT_VECTORS_ON_DISK}, hnsw m={QDRANT_HNSW_M} ef_construct={QDRANT_HNSW_EF_CONSTRUCT}, "
+        f"per_tenant_hnsw={QDRANT_TENANT_HNSW})"
+    )
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=vectors_config(),
+        sparse_vectors_config=SPARSE_VECTORS_CONFIG,
+        hnsw_config=hnsw_config(),
+        # With Matryoshka vectors it is set on the search vector (see vectors_config)
+        quantization_config=None if EMBEDDING_SEARCH_DIMENSIONS else quantization_config(),
+        on_disk_payload=QDRANT_PAYLOAD_ON_DISK,
+    )
+
+
+def resolve_alias(client: QdrantClient, name: str) -> Optional[str]:
+    """Returns the collection an alias points to, or None if `name` is not an alias."""
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == name:
+            return alias.collection_name
+    return None
+
+
+def rebuild_collection(client: QdrantClient, name: str, batch_size: int = 256) -> str:
+    """
+    Copies every point (all named vectors + payload) of `name` into a new
+    collection created with the current settings, then points the alias
+    `name` at it so readers and writers switch over without code changes.
+    Vectors are converted to the configured layout on the way, so this is
+    also how EMBEDDING_SEARCH_DIMENSIONS is turned on or changed.
+
+    If `name` is still a plain collection (first rebuild), it is deleted just
+    before the alias is created; queries fail for that moment. Later rebuilds
+    swap the alias atomically. Writes landing during the copy are not carried
+    over, so pause ingestion (or re-run the backfill) around a rebuild.
+    Returns the new collection's name.
+    """
+    source = resolve_alias(client, name) or name
+    target = f"{name}_{int(time.time())}"
+    create_products_collection(client, target)
+
+    copied = 0
+    offset = None
+    with BatchedQdrantWriter(client, target, batch_size=batch_size) as writer:
+        while True:
+            points, offset = client.scroll(
+                collection_name=source,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            writer.extend([
+                PointStruct(id=p.id, vector=convert_vectors(p.vector), payload=p.payload) for p in points
+            ])
+            copied += len(points)
+            if offset is None:
+                break
+    ensure_payload_indexes(client, target)
+    print(f"📦 Copied {copied} points from {source} into {target}")
+
+    if source == name:
+        client.delete_collection(name)
+        client.update_collection_aliases(change_aliases_operations=[
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=name)),
+        ])
+    else:
+        client.update_collection_aliases(change_aliases_operations=[
+            DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=name)),
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=name)),
+        ])
+        client.delete_collection(source)
+    return target
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Products collection storage tools")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the collection with the current QDRANT_* settings")
+    parser.add_argument("--show", action="store_true", help="Print the collection's current config")
+    parser.add_argument("--collection", default="shopify_products")
+    args = parser.parse_args()
+
+    qdrant = make_qdrant_client(os.getenv("QDRANT_URL", "http://localhost:6333"))
+    if args.rebuild:
+        new_name = rebuild_collection(qdrant, args.collection)
+        print(f"✅ {args.collection} now points at {new_name}")
+    elif args.show:
+        print(qdrant.get_collection(args.collection).config)
+    else:
+        print("Please specify --rebuild or --show")
@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import inspect
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
+
+from embedding_cache import EmbeddingCache
+
+# --- CONFIGURATION ---
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+# OpenAI limits: 2048 inputs and ~300k tokens per request, 8191 tokens per input
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300_000
+MAX_TOKENS_PER_INPUT = 8191
+CHARS_PER_TOKEN = 4  # rough estimate, avoids a tokenizer dependency
+
+EmbedFn = Callable[[List[str]], Union[List[List[float]], Awaitable[List[List[float]]]]]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def openai_embed_fn(client, model: str = EMBEDDING_MODEL) -> EmbedFn:
+    """
+    Wraps an `OpenAI` client so one call embeds a whole list of inputs.
+    """
+    def embed(texts: List[str]) -> List[List[float]]:
+        response = client.embeddings.create(input=texts, model=model)
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+    return embed
+
+
+def async_openai_embed_fn(client, model: str = EMBEDDING_MODEL) -> EmbedFn:
+    """
+    Same as `openai_embed_fn` for an `AsyncOpenAI` client.
+    """
+    async def embed(texts: List[str]) -> List[List[float]]:
+        response = await client.embeddings.create(input=texts, model=model)
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+    return embed
+
+
+def hash_embed_fn(dimensions: int = 1536) -> EmbedFn:
+    """
+    Deterministic local embedder (no network) for tests and benchmarks.
+    Identical texts always map to the same unit vector.
+    """
+    def embed(texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            values = []
+            counter = 0
+            while len(values) < dimensions:
+                digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+                values.extend((b - 127.5) / 127.5 for b in digest)
+                counter += 1
+            values = values[:dimensions]
+            norm = math.sqrt(sum(v * v for v in values)) or 1.0
+            vectors.append([v / norm for v in values])
+        return vectors
+    return embed
+
+
+class EmbeddingBatcher:
+    """
+    Shared embedding front-end for every ingestion path.
+
+    Splits inputs into requests bounded by `batch_size` and an estimated token
+    budget, truncates oversized inputs, and runs up to `max_concurrency`
+    requests at once. Output order always matches input order.
+
+    With a `cache`, cached texts are served locally and only the misses
+    (deduplicated) are sent to `embed_fn`; `model` namespaces the cache keys.
+    """
+    def __init__(
+        self,
+        embed_fn: EmbedFn,
+        model: str = EMBEDDING_MODEL,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+        max_tokens_per_batch: int = MAX_TOKENS_PER_REQUEST,
+        max_tokens_per_input: int = MAX_TOKENS_PER_INPUT,
+    ):
+        self.embed_fn = embed_fn
+        self.model = model
+        self.cache = cache
+        self.batch_size = min(batch_size, MAX_INPUTS_PER_REQUEST)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_tokens_per_input = max_tokens_per_input
+        self.is_async = inspect.iscoroutinefunction(embed_fn)
+
+    def _truncate(self, text: str) -> str:
+        max_chars = self.max_tokens_per_input * CHARS_PER_TOKEN
+        return text[:max_chars] if len(text) > max_chars else text
+
+    def make_batches(self, texts: List[str]) -> List[List[str]]:
+        """
+        Greedy chunking by input count and estimated token budget.
+        """
+        batches, current, current_tokens = [], [], 0
+        for text in texts:
+            text = self._truncate(text)
+            tokens = estimate_tokens(text)
+            if current and (len(current) >= self.batch_size or current_tokens + tokens > self.max_tokens_per_batch):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _split_cached(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[str]]:
+        """
+        Returns (results with None for misses, unique texts still to embed).
+        """
+        if self.cache is None:
+            return [None] * len(texts), list(dict.fromkeys(texts))
+        results = self.cache.get_many(self.model, texts)
+        missing = list(dict.fromkeys(t for t, r in zip(texts, results) if r is None))
+        return results, missing
+
+    def _merge(self, texts, results, missing, vectors) -> List[List[float]]:
+        if self.cache is not None and missing:
+            self.cache.put_many(self.model, missing, vectors)
+        fresh = dict(zip(missing, vectors))
+        return [r if r is not None else fresh[t] for t, r in zip(texts, results)]
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        batches = self.make_batches(texts)
+        if not batches:
+            return []
+        if len(batches) == 1 or self.max_concurrency == 1:
+            results = [self.embed_fn(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                results = list(pool.map(self.embed_fn, batches))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    async def _aembed_uncached(self, texts: List[str]) -> List[List[float]]:
+        batches = self.make_batches(texts)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                if self.is_async:
+                    return await self.embed_fn(batch)
+                return await asyncio.to_thread(self.embed_fn, batch)
+
+        results = await asyncio.gather(*(run(batch) for batch in batches))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Synchronous entry point (backfill scripts, threadpool background tasks).
+        """
+        if self.is_async:
+            return asyncio.run(self.aembed(texts))
+        results, missing = self._split_cached(texts)
+        vectors = self._embed_uncached(missing) if missing else []
+        return self._merge(texts, results, missing, vectors)
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Async entry point; sync embed functions are run in worker threads.
+        """
+        results, missing = self._split_cached(texts)
+        vectors = await self._aembed_uncached(missing) if missing else []
+        return self._merge(texts, results, missing, vectors)
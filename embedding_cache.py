@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+# --- CONFIGURATION ---
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")  # e.g. ".cache/embeddings.sqlite"
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "1000000"))
+
+# How many disk inserts between pruning passes
+_PRUNE_EVERY = 1000
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC, trimmed, with whitespace runs collapsed to single spaces."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    return f"{model}\x00{normalize_text(text)}"
+
+
+class EmbeddingCache:
+    """
+    Two-level embedding cache keyed by model name + normalized text.
+
+    Level 1 is an in-process LRU of `max_entries` vectors; level 2 is an
+    optional SQLite file shared by every process pointing at the same path,
+    pruned to `max_disk_entries` by least-recent use. Vectors are stored as
+    float32 (`array('f')`), roughly 4x smaller than a list of Python floats.
+    Safe to use from multiple threads.
+    """
+    def __init__(
+        self,
+        max_entries: int = EMBEDDING_CACHE_SIZE,
+        path: Optional[str] = EMBEDDING_CACHE_PATH,
+        max_disk_entries: int = EMBEDDING_CACHE_DISK_SIZE,
+    ):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_inserts = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_accessed ON embeddings (accessed_at)")
+            self._db.commit()
+
+    # --- internal helpers (caller holds the lock) ---
+
+    def _remember(self, key: str, vector: array) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _prune_disk(self) -> None:
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    # --- public API ---
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Returns cached vectors in input order, None for misses."""
+        results: List[Optional[List[float]]] = []
+        with self._lock:
+            for text in texts:
+                key = cache_key(model, text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                elif self._db is not None:
+                    row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        vector = array("f")
+                        vector.frombytes(row[0])
+                        self._db.execute(
+                            "UPDATE embeddings SET accessed_at = ? WHERE key = ?", (time.time(), key)
+                        )
+                        self._remember(key, vector)
+                        self.hits += 1
+                        self.disk_hits += 1
+                if vector is None:
+                    self.misses += 1
+                results.append(vector.tolist() if vector is not None else None)
+            if self._db is not None:
+                self._db.commit()
+        return results
+
+    def put(self, model: str, text: str, vector: Sequence[float]) -> None:
+        self.put_many(model, [text], [vector])
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        with self._lock:
+            now = time.time()
+            rows = []
+            for text, values in zip(texts, vectors):
+                key = cache_key(model, text)
+                vector = array("f", values)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+            if self._db is not None and rows:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, accessed_at) VALUES (?, ?, ?)", rows
+                )
+                self._disk_inserts += len(rows)
+                if self._disk_inserts >= _PRUNE_EVERY:
+                    self._prune_disk()
+                    self._disk_inserts = 0
+                self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> EmbeddingCache:
+    """Process-wide cache shared by every embedding call site."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
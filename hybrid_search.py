@@ -0,0 +1,215 @@
+import math
+import os
+import re
+import unicodedata
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    Filter, Fusion, FusionQuery, Modifier, Prefetch, SearchParams, SparseVector, SparseVectorParams
+)
+
+# --- CONFIGURATION ---
+# Candidates fetched from each of the dense and sparse indexes before fusion
+HYBRID_PREFETCH_LIMIT = int(os.getenv("HYBRID_PREFETCH_LIMIT", "50"))
+SPARSE_BM25_K1 = float(os.getenv("SPARSE_BM25_K1", "1.2"))
+SPARSE_BM25_B = float(os.getenv("SPARSE_BM25_B", "0.75"))
+# Typical product text length in tokens, used for BM25 length normalization
+SPARSE_AVG_DOC_LENGTH = float(os.getenv("SPARSE_AVG_DOC_LENGTH", "80"))
+# Matryoshka search vector size (e.g. 256 or 512); 0 indexes the full embedding.
+# text-embedding-3 models keep their quality when truncated and re-normalized.
+EMBEDDING_SEARCH_DIMENSIONS = int(os.getenv("EMBEDDING_SEARCH_DIMENSIONS", "0"))
+# Candidates re-scored with the full-size vector after the shortened search
+MATRYOSHKA_RESCORE_LIMIT = int(os.getenv("MATRYOSHKA_RESCORE_LIMIT", "100"))
+
+# Without Matryoshka the dense embedding is the collection's default (unnamed)
+# vector. With it, "dense" holds the shortened, HNSW-indexed search vector and
+# "full" the unindexed full-size embedding used only for re-scoring.
+DENSE_VECTOR_NAME = "dense" if EMBEDDING_SEARCH_DIMENSIONS else ""
+FULL_VECTOR_NAME = "full"
+SPARSE_VECTOR_NAME = "text-sparse"
+
+# Qdrant computes IDF over the collection at query time, so documents
+# only carry the BM25 term-frequency part
+SPARSE_VECTORS_CONFIG = {
+    SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF),
+}
+
+# Keeps SKU / model-number tokens like "wh-1000xm5" or "3.5mm" in one piece
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[-_./]")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were will with product vendor tags description price".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens without stopwords. Compound tokens such as
+    "WH-1000XM5" also emit their parts and the joined form ("wh", "1000xm5",
+    "wh1000xm5") so partial and differently punctuated codes still match.
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for token in _TOKEN_RE.findall(text):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        parts = _SPLIT_RE.split(token)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p not in STOPWORDS)
+            tokens.append("".join(parts))
+    return tokens
+
+
+def token_index(token: str) -> int:
+    """Stable feature-hash index, so no vocabulary has to be stored or shared."""
+    return zlib.crc32(token.encode("utf-8")) & 0x7FFFFFFF
+
+
+def _to_sparse(weights: Dict[int, float]) -> SparseVector:
+    indices = sorted(weights)
+    return SparseVector(indices=indices, values=[weights[i] for i in indices])
+
+
+def sparse_vector(text: str) -> SparseVector:
+    """BM25 document vector (term-frequency saturation and length normalization)."""
+    counts = Counter(tokenize(text))
+    length = sum(counts.values())
+    norm = SPARSE_BM25_K1 * (1 - SPARSE_BM25_B + SPARSE_BM25_B * length / SPARSE_AVG_DOC_LENGTH)
+    weights: Dict[int, float] = {}
+    for token, tf in counts.items():
+        index = token_index(token)
+        weights[index] = weights.get(index, 0.0) + tf * (SPARSE_BM25_K1 + 1) / (tf + norm)
+    return _to_sparse(weights)
+
+
+def query_sparse_vector(text: str) -> SparseVector:
+    """Query side: each distinct term counts once; IDF is applied by Qdrant."""
+    return _to_sparse({token_index(token): 1.0 for token in set(tokenize(text))})
+
+
+def truncate_embedding(vector: List[float], dimensions: int = EMBEDDING_SEARCH_DIMENSIONS) -> List[float]:
+    """
+    Matryoshka shortening: keeps the first `dimensions` values and re-normalizes,
+    equivalent to requesting `dimensions` from the embeddings API.
+    """
+    if not dimensions or dimensions >= len(vector):
+        return list(vector)
+    head = vector[:dimensions]
+    norm = math.sqrt(sum(x * x for x in head))
+    return [x / norm for x in head] if norm else list(head)
+
+
+def layout_vectors(full_vector: List[float], sparse: Optional[SparseVector]) -> dict:
+    """Named vectors for a point in the configured layout."""
+    vectors = {DENSE_VECTOR_NAME: truncate_embedding(full_vector)}
+    if EMBEDDING_SEARCH_DIMENSIONS:
+        vectors[FULL_VECTOR_NAME] = list(full_vector)
+    if sparse is not None:
+        vectors[SPARSE_VECTOR_NAME] = sparse
+    return vectors
+
+
+def product_vectors(dense_vector: List[float], text: str) -> dict:
+    """Named vectors for a product point: the dense embedding(s) plus the sparse twin."""
+    return layout_vectors(dense_vector, sparse_vector(text))
+
+
+def convert_vectors(stored) -> dict:
+    """
+    Re-lays out vectors read back from Qdrant (either layout) into the configured
+    one, so switching Matryoshka on or off needs no re-embedding. Going from a
+    Matryoshka layout works because the full-size vector is kept there.
+    """
+    if not isinstance(stored, dict):
+        return layout_vectors(stored, None)
+    full = stored.get(FULL_VECTOR_NAME) or stored.get("")
+    if full is None:
+        raise ValueError(f"Stored point has no full-size dense vector (names: {sorted(stored)})")
+    return layout_vectors(full, stored.get(SPARSE_VECTOR_NAME))
+
+
+def dense_prefetch(
+    dense_vector: List[float],
+    query_filter: Optional[Filter] = None,
+    limit: int = HYBRID_PREFETCH_LIMIT,
+    dense_params: Optional[SearchParams] = None,
+) -> Prefetch:
+    """
+    The dense half of `hybrid_query`. With Matryoshka enabled it searches the
+    shortened vectors for MATRYOSHKA_RESCORE_LIMIT candidates and re-scores
+    them against the full-size vector.
+    """
+    if not EMBEDDING_SEARCH_DIMENSIONS:
+        return Prefetch(
+            query=list(dense_vector),
+            using=DENSE_VECTOR_NAME or None,
+            filter=query_filter,
+            params=dense_params,
+            limit=limit
+        )
+    shortened = Prefetch(
+        query=truncate_embedding(dense_vector),
+        using=DENSE_VECTOR_NAME,
+        filter=query_filter,
+        params=dense_params,
+        limit=max(limit, MATRYOSHKA_RESCORE_LIMIT)
+    )
+    return Prefetch(
+        prefetch=[shortened],
+        query=list(dense_vector),
+        using=FULL_VECTOR_NAME,
+        filter=query_filter,
+        limit=limit
+    )
+
+
+def hybrid_query(
+    dense_vector: List[float],
+    text: str,
+    query_filter: Optional[Filter] = None,
+    limit: int = 5,
+    prefetch_limit: int = HYBRID_PREFETCH_LIMIT,
+    dense_params: Optional[SearchParams] = None,
+) -> dict:
+    """
+    Keyword arguments for `query_points` / `QueryRequest` that run a dense and
+    a sparse search server-side and merge them with Reciprocal Rank Fusion,
+    all in one request. Filters are applied inside both prefetches;
+    `dense_params` (e.g. collection_config.search_params()) tunes the dense one.
+
+    `dense_vector` is the full-size query embedding. With Matryoshka enabled
+    only the dense half is re-scored with the full-size vector (see
+    `dense_prefetch`), before fusion, so the sparse ranking is fused in unchanged.
+    """
+    candidates = max(limit, prefetch_limit)
+    prefetch = [dense_prefetch(dense_vector, query_filter, candidates, dense_params)]
+    sparse = query_sparse_vector(text)
+    if sparse.indices:
+        prefetch.append(Prefetch(query=sparse, using=SPARSE_VECTOR_NAME, filter=query_filter, limit=candidates))
+    return {
+        "prefetch": prefetch,
+        "query": FusionQuery(fusion=Fusion.RRF),
+        "limit": limit,
+        "with_payload": True,
+    }
+
+
+def require_sparse_vectors(client: QdrantClient, collection_name: str) -> None:
+    """
+    Refuses to run against a collection created before hybrid search: every
+    write and query uses the sparse vector, and Qdrant cannot add one to an
+    existing collection. `python collection_config.py --rebuild` recreates it
+    with the sparse vector; `python backfill_qdrant.py --force` then fills it in.
+    """
+    sparse = client.get_collection(collection_name).config.params.sparse_vectors or {}
+    if SPARSE_VECTOR_NAME not in sparse:
+        raise RuntimeError(
+            f"Collection {collection_name} has no sparse vector '{SPARSE_VECTOR_NAME}'; run "
+            "`python collection_config.py --rebuild` and `python backfill_qdrant.py --force` first"
+        )
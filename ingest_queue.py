@@ -0,0 +1,513 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# --- CONFIGURATION ---
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "ingest_queue.sqlite")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+# A failed event waits base x 2^(attempts - 1) seconds (capped) before it is retried,
+# so a short Qdrant/OpenAI outage is ridden out instead of burning every attempt
+INGEST_RETRY_BASE_DELAY = float(os.getenv("INGEST_RETRY_BASE_DELAY", "5"))
+INGEST_RETRY_MAX_DELAY = float(os.getenv("INGEST_RETRY_MAX_DELAY", "600"))
+# A claimed event whose worker died is handed out again after this many seconds
+INGEST_VISIBILITY_TIMEOUT = float(os.getenv("INGEST_VISIBILITY_TIMEOUT", "300"))
+
+ACTION_UPSERT = "upsert"
+ACTION_DELETE = "delete"
+# Inventory level changes are keyed by "inventory:<item>", so they coalesce per
+# inventory item without touching the product's pending upsert/delete
+ACTION_INVENTORY = "inventory"
+
+
+def event_kind(action: str) -> str:
+    """"inventory" or "product" (upserts and deletes); the two never run concurrently."""
+    return ACTION_INVENTORY if action == ACTION_INVENTORY else "product"
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds before retrying an event that has failed `attempts` times."""
+    return min(INGEST_RETRY_MAX_DELAY, INGEST_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0))
+
+
+def parse_event_time(value) -> Optional[float]:
+    """
+    Epoch seconds from a Shopify timestamp: `updated_at` ("2024-05-01T12:00:00-04:00")
+    or the X-Shopify-Triggered-At header (UTC, up to nanosecond precision).
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = re.sub(r"(\.\d{6})\d+", r"\1", str(value).strip()).replace("Z", "+00:00")
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+
+@dataclass
+class IngestEvent:
+    product_id: str
+    action: str
+    payload: Optional[dict]
+    version: int
+    attempts: int
+
+
+class IngestQueue:
+    """
+    Persistent, coalescing product event queue backed by SQLite.
+
+    There is at most one pending row per product: a newer event replaces the
+    older one (last write wins), so a delete cancels a pending upsert and ten
+    rapid updates cost one embedding. Rows survive restarts; claimed rows are
+    re-delivered after the visibility timeout if their worker dies.
+
+    Shopify does not deliver webhooks in order and retries can arrive late, so
+    "newer" is decided by the event's own timestamp when it has one: the latest
+    timestamp seen per product is kept, and older events are dropped on arrival
+    instead of overwriting (or re-applying over) newer data.
+
+    Each row carries a version that is bumped on every overwrite. `ack()` only
+    removes the row if it was not overwritten while being processed; otherwise
+    it is released so the newer event gets picked up.
+    """
+    def __init__(self, path: str = INGEST_QUEUE_PATH, visibility_timeout: float = INGEST_VISIBILITY_TIMEOUT):
+        self.visibility_timeout = visibility_timeout
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "product_id TEXT PRIMARY KEY, "
+            "action TEXT NOT NULL, "
+            "payload TEXT, "
+            "version INTEGER NOT NULL DEFAULT 0, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "first_enqueued_at REAL NOT NULL, "
+            "enqueued_at REAL NOT NULL, "
+            "claimed_at REAL, "
+            "available_at REAL)"
+        )
+        # Queues created before retry backoff
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(events)")}
+        if "available_at" not in columns:
+            self._db.execute("ALTER TABLE events ADD COLUMN available_at REAL")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_events_enqueued ON events (enqueued_at)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            "product_id TEXT, action TEXT, payload TEXT, error TEXT, failed_at REAL)"
+        )
+        # Latest event timestamp seen per key, kept after the event is processed
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS event_times (product_id TEXT PRIMARY KEY, event_time REAL NOT NULL)"
+        )
+
+    def enqueue(
+        self, product_id, action: str, payload: Optional[dict] = None, event_time: Optional[float] = None
+    ) -> bool:
+        """
+        Queues an event, replacing any pending one for the same product.
+        Returns False if `event_time` is older than an event already seen for
+        this product; the event is dropped. Events without a time always apply.
+        """
+        now = time.time()
+        key = str(product_id)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if event_time is not None:
+                    seen = self._db.execute(
+                        "SELECT event_time FROM event_times WHERE product_id = ?", (key,)
+                    ).fetchone()
+                    if seen and seen[0] > event_time:
+                        self._db.execute("COMMIT")
+                        return False
+                    self._db.execute(
+                        "INSERT INTO event_times (product_id, event_time) VALUES (?, ?) "
+                        "ON CONFLICT(product_id) DO UPDATE SET event_time = excluded.event_time",
+                        (key, event_time),
+                    )
+                self._db.execute(
+                    "INSERT INTO events (product_id, action, payload, first_enqueued_at, enqueued_at) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(product_id) DO UPDATE SET "
+                    "action = excluded.action, payload = excluded.payload, "
+                    "version = events.version + 1, attempts = 0, enqueued_at = excluded.enqueued_at, "
+                    "available_at = NULL",
+                    (key, action, json.dumps(payload) if payload is not None else None, now, now),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return True
+
+    def enqueue_upsert(self, product: dict, event_time: Optional[float] = None) -> bool:
+        """The product's `updated_at` orders upserts; `event_time` is the fallback."""
+        return self.enqueue(
+            product["id"], ACTION_UPSERT, product, parse_event_time(product.get("updated_at")) or event_time
+        )
+
+    def enqueue_delete(self, product_id, shop_id: Optional[str] = None, event_time: Optional[float] = None) -> bool:
+        payload = {"id": product_id, "shop_id": shop_id} if shop_id else None
+        return self.enqueue(product_id, ACTION_DELETE, payload, event_time)
+
+    def enqueue_inventory(self, level: dict, event_time: Optional[float] = None) -> bool:
+        key = f"inventory:{level['inventory_item_id']}"
+        return self.enqueue(key, ACTION_INVENTORY, level, parse_event_time(level.get("updated_at")) or event_time)
+
+    def claim_batch(self, limit: int = INGEST_BATCH_SIZE) -> List[IngestEvent]:
+        """
+        Claims up to `limit` of the oldest unclaimed events that are not backing off.
+
+        An inventory patch rewrites its product's `variants`, and its row is
+        keyed by inventory item rather than product, so product and inventory
+        events are never in flight in different batches at the same time: the
+        batch stops at the first event whose kind conflicts with what other
+        workers hold. Stopping (rather than skipping ahead) keeps the queue
+        FIFO, so neither kind can starve the other.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                in_flight = {
+                    event_kind(row[0]) for row in self._db.execute(
+                        "SELECT DISTINCT action FROM events WHERE claimed_at >= ?",
+                        (now - self.visibility_timeout,),
+                    )
+                }
+                rows = []
+                for row in self._db.execute(
+                    "SELECT product_id, action, payload, version, attempts FROM events "
+                    "WHERE (claimed_at IS NULL OR claimed_at < ?) AND (available_at IS NULL OR available_at <= ?) "
+                    "ORDER BY enqueued_at LIMIT ?",
+                    (now - self.visibility_timeout, now, limit),
+                ).fetchall():
+                    if in_flight - {event_kind(row[1])}:
+                        break
+                    rows.append(row)
+                self._db.executemany(
+                    "UPDATE events SET claimed_at = ? WHERE product_id = ?",
+                    [(now, row[0]) for row in rows],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return [
+            IngestEvent(row[0], row[1], json.loads(row[2]) if row[2] else None, row[3], row[4])
+            for row in rows
+        ]
+
+    def ack(self, events: List[IngestEvent]) -> None:
+        """Marks events as done; rows overwritten in the meantime are released instead."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            for event in events:
+                self._db.execute(
+                    "DELETE FROM events WHERE product_id = ? AND version = ?",
+                    (event.product_id, event.version),
+                )
+                # Overwritten while in flight: lag now counts from the newer event
+                self._db.execute(
+                    "UPDATE events SET claimed_at = NULL, first_enqueued_at = enqueued_at WHERE product_id = ?",
+                    (event.product_id,),
+                )
+            self._db.execute("COMMIT")
+
+    def nack(self, events: List[IngestEvent], error: str, max_attempts: int = INGEST_MAX_ATTEMPTS) -> None:
+        """
+        Releases failed events for retry after a backoff of `retry_delay(attempts)`;
+        gives up after `max_attempts` and moves them to `dead_letters`.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            for event in events:
+                if event.attempts + 1 >= max_attempts:
+                    self._db.execute(
+                        "INSERT INTO dead_letters (product_id, action, payload, error, failed_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (event.product_id, event.action, json.dumps(event.payload), error, now),
+                    )
+                    self._db.execute(
+                        "DELETE FROM events WHERE product_id = ? AND version = ?",
+                        (event.product_id, event.version),
+                    )
+                self._db.execute(
+                    "UPDATE events SET claimed_at = NULL, attempts = attempts + 1, available_at = ? "
+                    "WHERE product_id = ? AND version = ?",
+                    (now + retry_delay(event.attempts + 1), event.product_id, event.version),
+                )
+                self._db.execute(
+                    "UPDATE events SET claimed_at = NULL WHERE product_id = ?", (event.product_id,)
+                )
+            self._db.execute("COMMIT")
+
+    def requeue_dead_letters(self, limit: Optional[int] = None) -> int:
+        """
+        Moves dead-lettered events back onto the queue with their attempts
+        reset, e.g. once the outage that failed them is fixed. The newest dead
+        letter per product is kept, and a pending event for the same product
+        wins over it. Returns the number of events queued again.
+        """
+        now = time.time()
+        requeued = 0
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT rowid, product_id, action, payload FROM dead_letters ORDER BY failed_at DESC LIMIT ?",
+                    (-1 if limit is None else limit,),
+                ).fetchall()
+                for rowid, product_id, action, payload in rows:
+                    cursor = self._db.execute(
+                        "INSERT INTO events (product_id, action, payload, first_enqueued_at, enqueued_at) "
+                        "VALUES (?, ?, ?, ?, ?) ON CONFLICT(product_id) DO NOTHING",
+                        (product_id, action, None if payload in (None, "null") else payload, now, now),
+                    )
+                    requeued += cursor.rowcount
+                    self._db.execute("DELETE FROM dead_letters WHERE rowid = ?", (rowid,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return requeued
+
+    def metrics(self) -> Dict[str, float]:
+        """Queue depth, in-flight count and lag (age of the oldest pending event, seconds)."""
+        with self._lock:
+            depth, in_flight, oldest = self._db.execute(
+                "SELECT COUNT(*), COUNT(claimed_at), MIN(first_enqueued_at) FROM events"
+            ).fetchone()
+            dead = self._db.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        return {
+            "depth": depth,
+            "in_flight": in_flight,
+            "lag_seconds": time.time() - oldest if oldest else 0.0,
+            "dead_letters": dead,
+        }
+
+
+def split_actions(events: List[IngestEvent]) -> Tuple[List[IngestEvent], List[IngestEvent], List[IngestEvent]]:
+    """Returns (upserts, deletes, inventory updates) for a claimed batch."""
+    upserts = [e for e in events if e.action == ACTION_UPSERT]
+    deletes = [e for e in events if e.action == ACTION_DELETE]
+    inventory = [e for e in events if e.action == ACTION_INVENTORY]
+    return upserts, deletes, inventory
+
+
+def delete_items(events: List[IngestEvent]) -> List[dict]:
+    """{"id", "shop_id"} dicts for delete events (shop_id is None for legacy rows)."""
+    return [e.payload or {"id": e.product_id, "shop_id": None} for e in events]
+
+
+# (event, error) for an event that failed on its own
+Failure = Tuple[IngestEvent, str]
+
+
+def nack_failures(queue: IngestQueue, failures: List[Failure]) -> None:
+    """One nack (one attempt) per failed event of a claimed batch."""
+    by_error: Dict[str, List[IngestEvent]] = {}
+    for event, error in failures:
+        by_error.setdefault(error, []).append(event)
+    for error, events in by_error.items():
+        queue.nack(events, error)
+
+
+class IngestWorkerPool:
+    """
+    Background threads draining an IngestQueue in batches.
+
+    `upsert_fn` receives a list of product dicts, `delete_fn` a list of
+    {"id", "shop_id"} dicts and `inventory_fn` a list of inventory level dicts;
+    all should raise on failure so the batch is retried. A failed batch is
+    split in halves and retried down to single events, so only the events
+    that fail on their own count an attempt, and they count one attempt
+    however many splits it took. Failed events are retried after a backoff
+    (see `retry_delay`), not on the next poll.
+    """
+    def __init__(
+        self,
+        queue: IngestQueue,
+        upsert_fn: Callable[[List[dict]], None],
+        delete_fn: Callable[[List[dict]], None],
+        inventory_fn: Optional[Callable[[List[dict]], None]] = None,
+        workers: int = INGEST_WORKERS,
+        batch_size: int = INGEST_BATCH_SIZE,
+        poll_interval: float = 0.5,
+    ):
+        self.queue = queue
+        self.upsert_fn = upsert_fn
+        self.delete_fn = delete_fn
+        self.inventory_fn = inventory_fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _apply(self, group: List[IngestEvent], run: Callable[[List[IngestEvent]], None]) -> List[Failure]:
+        """Runs `group`, bisecting on failure; acks what succeeds and returns the events that failed alone."""
+        if not group:
+            return []
+        try:
+            run(group)
+        except Exception as e:
+            if len(group) == 1:
+                print(f"❌ Ingest event {group[0].product_id} failed: {e}")
+                return [(group[0], str(e))]
+            print(f"⚠️ Ingest batch failed ({len(group)} events), retrying in halves: {e}")
+            middle = len(group) // 2
+            return self._apply(group[:middle], run) + self._apply(group[middle:], run)
+        self.queue.ack(group)
+        return []
+
+    def process_batch(self, events: List[IngestEvent]) -> None:
+        upserts, deletes, inventory = split_actions(events)
+        if inventory and self.inventory_fn is None:
+            # No inventory handler configured: drop them rather than retrying forever
+            self.queue.ack(inventory)
+            inventory = []
+        failures = self._apply(upserts, lambda group: self.upsert_fn([e.payload for e in group]))
+        failures += self._apply(deletes, lambda group: self.delete_fn(delete_items(group)))
+        failures += self._apply(inventory, lambda group: self.inventory_fn([e.payload for e in group]))
+        nack_failures(self.queue, failures)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                events = self.queue.claim_batch(self.batch_size)
+            except Exception as e:
+                print(f"❌ Ingest queue error: {e}")
+                events = []
+            if not events:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.process_batch(events)
+
+    def start(self) -> None:
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+class AsyncIngestWorkerPool:
+    """
+    asyncio counterpart of IngestWorkerPool: `workers` tasks on the running
+    event loop, calling coroutine `upsert_fn` / `delete_fn`. SQLite queue
+    operations are pushed to a thread so they never block the loop. Failed
+    batches are bisected, counted and backed off the same way.
+    """
+    def __init__(
+        self,
+        queue: IngestQueue,
+        upsert_fn: Callable[[List[dict]], Awaitable[None]],
+        delete_fn: Callable[[List[dict]], Awaitable[None]],
+        inventory_fn: Optional[Callable[[List[dict]], Awaitable[None]]] = None,
+        workers: int = INGEST_WORKERS,
+        batch_size: int = INGEST_BATCH_SIZE,
+        poll_interval: float = 0.5,
+    ):
+        self.queue = queue
+        self.upsert_fn = upsert_fn
+        self.delete_fn = delete_fn
+        self.inventory_fn = inventory_fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def _apply(
+        self, group: List[IngestEvent], run: Callable[[List[IngestEvent]], Awaitable[None]]
+    ) -> List[Failure]:
+        if not group:
+            return []
+        try:
+            await run(group)
+        except Exception as e:
+            if len(group) == 1:
+                print(f"❌ Ingest event {group[0].product_id} failed: {e}")
+                return [(group[0], str(e))]
+            print(f"⚠️ Ingest batch failed ({len(group)} events), retrying in halves: {e}")
+            middle = len(group) // 2
+            return await self._apply(group[:middle], run) + await self._apply(group[middle:], run)
+        await asyncio.to_thread(self.queue.ack, group)
+        return []
+
+    async def process_batch(self, events: List[IngestEvent]) -> None:
+        upserts, deletes, inventory = split_actions(events)
+        if inventory and self.inventory_fn is None:
+            await asyncio.to_thread(self.queue.ack, inventory)
+            inventory = []
+        upsert_failures, delete_failures = await asyncio.gather(
+            self._apply(upserts, lambda group: self.upsert_fn([e.payload for e in group])),
+            self._apply(deletes, lambda group: self.delete_fn(delete_items(group))),
+        )
+        # After the upserts: an inventory patch rewrites the product's variants
+        inventory_failures = await self._apply(inventory, lambda group: self.inventory_fn([e.payload for e in group]))
+        await asyncio.to_thread(nack_failures, self.queue, upsert_failures + delete_failures + inventory_failures)
+
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                events = await asyncio.to_thread(self.queue.claim_batch, self.batch_size)
+            except Exception as e:
+                print(f"❌ Ingest queue error: {e}")
+                events = []
+            if not events:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.process_batch(events)
+
+    def start(self) -> None:
+        """Must be called from within the running event loop (e.g. a startup hook)."""
+        self._stop = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(), name=f"ingest-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+        self._tasks = []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest queue tools")
+    parser.add_argument("--metrics", action="store_true", help="Print queue depth, lag and dead letters")
+    parser.add_argument("--requeue-dead-letters", action="store_true", help="Put dead-lettered events back on the queue")
+    parser.add_argument("--limit", type=int, help="Requeue at most this many dead letters (newest first)")
+    parser.add_argument("--queue", default=INGEST_QUEUE_PATH)
+    args = parser.parse_args()
+
+    queue = IngestQueue(args.queue)
+    if args.requeue_dead_letters:
+        print(f"🔁 Requeued {queue.requeue_dead_letters(args.limit)} dead-lettered events")
+    elif args.metrics:
+        print(queue.metrics())
+    else:
+        print("Please specify --requeue-dead-letters or --metrics")
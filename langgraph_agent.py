@@ -1,12 +1,18 @@
 # UPDATED IMPORTS: using langchain_core for messages and tools
-from langchain_core.tools import tool
-from langchain_core.messages import AnyMessage, SystemMessage, ToolMessage, HumanMessage
+from langchain_core.tools import tool, InjectedToolArg
+from langchain_core.messages import AnyMessage, SystemMessage, ToolMessage, HumanMessage, AIMessage, AIMessageChunk
 from typing_extensions import TypedDict, Annotated
+import functools
 import operator
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from dotenv import load_dotenv
 from typing import Literal
 from langgraph.graph import StateGraph, START, END
+from langgraph.checkpoint.memory import MemorySaver
 
 # We use the specific OpenAI class for better stability, 
 # or you can ensure 'langchain' is installed to use init_chat_model
@@ -16,6 +22,15 @@ from langchain_community.vectorstores import Qdrant
 from langchain_openai import OpenAIEmbeddings
 from qdrant_client import QdrantClient
 from openai import OpenAI
+from embedding_batcher import EmbeddingBatcher, openai_embed_fn
+from embedding_cache import get_default_cache
+from product_payload import SHOP_ID_FIELD, build_product_filter, catalog_version
+from hybrid_search import hybrid_query
+from collection_config import search_params
+from message_compaction import compact_messages, estimate_message_tokens, split_turns
+from tool_serialization import serialize_tool_result, extract_product_ids
+from answer_cache import SemanticAnswerCache, ANSWER_CACHE_ENABLED
+from shop_registry import default_shop_id, normalize_shop_domain
 
 from langchain_community.vectorstores import Qdrant
 
@@ -25,7 +40,12 @@ from dotenv import load_dotenv
 load_dotenv()  # <-- MUST be before OpenAI initialization
 
 
-qdrant = QdrantClient(url=os.getenv("QDRANT_URL", "http://localhost:6333"))
+# Per-request timeout of the clients the tools use, so a hung Qdrant or OpenAI
+# call ends instead of holding a tool worker; a tool makes at most an embedding
+# (with one retry) and a Qdrant request, which must fit in TOOL_TIMEOUT
+TOOL_REQUEST_TIMEOUT = int(os.getenv("TOOL_REQUEST_TIMEOUT", "8"))
+
+qdrant = QdrantClient(url=os.getenv("QDRANT_URL", "http://localhost:6333"), timeout=TOOL_REQUEST_TIMEOUT)
 embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
 COLLECTION_NAME = "shopify_products"
 '''
@@ -35,7 +55,8 @@ qdrant = Qdrant.from_existing_collection(
     embedding=embeddings
 )
 '''
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=TOOL_REQUEST_TIMEOUT, max_retries=1)
+embedding_batcher = EmbeddingBatcher(openai_embed_fn(openai_client), cache=get_default_cache())
 
 COLLECTION_NAME = "shopify_products"
 SHOPIFY_STORE_URL = os.getenv("SHOPIFY_STORE_URL")
@@ -54,23 +75,59 @@ model = ChatOpenAI(
 
 # ----------------- Define Tools -----------------
 
+# Tools taking an injected `shop_id` are scoped to the conversation's shop.
+# The argument is hidden from the model and filled in by tool_node.
+TENANT_TOOLS = {"search_products_qdrant", "get_product_details", "compare_products", "checkout_cart"}
+
+def store_url(shop_id: str | None) -> str:
+    return f"https://{shop_id or SHOPIFY_STORE_URL}"
+
+def require_shop(shop_id: str | None) -> str:
+    """Catalog tools never run unscoped, which would expose every tenant's products."""
+    if not shop_id:
+        raise ValueError("No shop for this conversation; pass shop_id or set SHOPIFY_STORE_URL")
+    return shop_id
+
+def belongs_to_shop(payload: dict, shop_id: str | None) -> bool:
+    return payload.get(SHOP_ID_FIELD) == require_shop(shop_id)
+
 @tool
 def search_products_qdrant(
     query: str,
-    limit: int = 5
+    limit: int = 5,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    color: str | None = None,
+    vendor: str | None = None,
+    product_type: str | None = None,
+    in_stock: bool | None = None,
+    shop_id: Annotated[str | None, InjectedToolArg] = None
 ) -> list:
     """
-    Perform a semantic product search using Qdrant via query_points.
+    Perform a hybrid (semantic + keyword) product search using Qdrant via query_points.
+    Exact SKUs, model numbers and brand names match through the keyword half.
+
+    Filters are applied inside the same search, so pass the user's budget,
+    color, brand or category here instead of filtering results afterwards.
 
     Args:
         query: Natural language search query describing the desired product.
         limit: Maximum number of products to return.
+        min_price: Minimum acceptable product price.
+        max_price: Maximum acceptable product price.
+        color: Desired color (matched against product tags and variant options, e.g. "red").
+        vendor: Vendor / brand name (case-insensitive).
+        product_type: Product type / category (case-insensitive).
+        in_stock: True to only return products that can be bought now
+            (with a price range, an available variant must be in that range).
 
     Returns:
         A list of product dictionaries containing:
         - product_id
         - title
-        - price
+        - price (cheapest variant)
+        - in_stock
+        - options (available option values such as colors and sizes)
         - vendor
         - tags
         - description
@@ -79,17 +136,23 @@ def search_products_qdrant(
     
     print(f"--- Tool: Qdrant Search | Query='{query}' ---")
 
-    # 1. Embed query
-    embedding = openai_client.embeddings.create(
-        input=query,
-        model="text-embedding-3-small"
-    ).data[0].embedding
+    search_filter = build_product_filter(
+        min_price=min_price,
+        max_price=max_price,
+        vendor=vendor,
+        product_type=product_type,
+        color=color,
+        in_stock=in_stock,
+        shop_id=require_shop(shop_id)
+    )
+
+    # 1. Embed query (served from the shared cache for repeated queries)
+    embedding = embedding_batcher.embed([query])[0]
 
-    # 2. Correct Qdrant call
+    # 2. Dense + sparse search fused with RRF in a single request
     results = qdrant.query_points(
         collection_name=COLLECTION_NAME,
-        query=embedding,
-        limit=limit
+        **hybrid_query(embedding, query, search_filter, limit, dense_params=search_params())
     )
 
     # 4. Extract matches for the first query vector
@@ -106,59 +169,18 @@ def search_products_qdrant(
             "product_id": point_id,
             "title": payload.get("title"),
             "price": payload.get("price"),
+            "in_stock": payload.get("in_stock"),
+            "options": payload.get("options"),
             "vendor": payload.get("vendor"),
             "tags": payload.get("tags"),
             "description": payload.get("description"),
-            "url": f"https://{SHOPIFY_STORE_URL}/products/{payload.get('handle')}"
+            "url": f"{store_url(shop_id)}/products/{payload.get('handle')}"
         })
 
     return products
  
 
 
-@tool
-def filter_products(
-        products: list,
-        min_price: float | None = None,
-        max_price: float | None = None,
-        color: str | None = None
-    ) -> list:
-        """
-        Filter a list of products based on price range and color.
-
-        Use this tool after retrieving products to narrow down the results
-        according to user preferences such as budget or color.
-
-        Args:
-            products: List of product dictionaries to filter.
-            min_price: Minimum acceptable product price.
-            max_price: Maximum acceptable product price.
-            color: Desired color to filter by (matched against product tags).
-
-        Returns:
-            A filtered list of product dictionaries that satisfy the criteria.
-        """
-
-
-        print("--- Tool: Filter Products ---")
-
-        filtered = []
-
-        for p in products:
-            price = float(p["price"])
-
-            if min_price is not None and price < min_price:
-                continue
-            if max_price is not None and price > max_price:
-                continue
-            if color and color.lower() not in (p.get("tags") or "").lower():
-                continue
-
-            filtered.append(p)
-
-        return filtered
-
-
 @tool
 def filter_by_color(products: list, color: str) -> list:
     """
@@ -198,7 +220,7 @@ def filter_by_type(products: list, product_type: str) -> list:
     return [p for p in products]
 
 @tool
-def get_product_details(product_id: int) -> dict:
+def get_product_details(product_id: int, shop_id: Annotated[str | None, InjectedToolArg] = None) -> dict:
     """
     Retrieve detailed information for a specific product.
 
@@ -213,6 +235,9 @@ def get_product_details(product_id: int) -> dict:
         - title
         - description
         - price
+        - in_stock
+        - variants (per variant: options, price, inventory and availability,
+          so stock questions need no call to Shopify)
         - vendor
         - tags
         - url (Shopify product link)
@@ -227,7 +252,8 @@ def get_product_details(product_id: int) -> dict:
         with_payload=True
     )
 
-    if not points:
+    # Point IDs are global; never show another shop's product
+    if not points or not belongs_to_shop(points[0].payload or {}, shop_id):
         return {"error": "Product not found"}
 
     payload = points[0].payload
@@ -236,14 +262,33 @@ def get_product_details(product_id: int) -> dict:
         "title": payload.get("title"),
         "description": payload.get("description"),
         "price": payload.get("price"),
+        "in_stock": payload.get("in_stock"),
+        "variants": [
+            {
+                "options": v.get("options"),
+                "price": v.get("price"),
+                "inventory_quantity": v.get("inventory_quantity"),
+                "available": v.get("available"),
+            }
+            for v in payload.get("variants") or []
+        ],
         "vendor": payload.get("vendor"),
         "tags": payload.get("tags"),
-        "url": f"https://{SHOPIFY_STORE_URL}/products/{payload.get('handle')}"
+        "url": f"{store_url(shop_id)}/products/{payload.get('handle')}"
     }
 
 
+# Payload fields projected for comparisons (descriptions are left out on purpose)
+COMPARE_FIELDS = [
+    "title", "price", "min_price", "max_price", "in_stock", "options", "vendor", "product_type", "tags",
+    "inventory_quantity", "handle",
+    SHOP_ID_FIELD
+]
+# Fetched for URLs / tenant checks, not shown as attributes
+COMPARE_HIDDEN_FIELDS = {"handle", SHOP_ID_FIELD}
+
 @tool
-def compare_products(product_ids: list[int]) -> dict:
+def compare_products(product_ids: list[int], shop_id: Annotated[str | None, InjectedToolArg] = None) -> dict:
     """
     Compare multiple products side-by-side.
 
@@ -254,17 +299,37 @@ def compare_products(product_ids: list[int]) -> dict:
         product_ids: List of product IDs to compare.
 
     Returns:
-        A dictionary containing a comparison of the selected products.
+        A columnar comparison table: "product_ids" lists the compared products
+        and "attributes" maps each attribute to one value per product (same order).
+        IDs that could not be found are listed under "not_found".
     """
 
 
     print(f"--- Tool: Compare Products | {product_ids} ---")
 
-    products = []
-    for pid in product_ids:
-        products.append(get_product_details(pid))
+    # One batched retrieve, projecting only the compared fields
+    points = qdrant.retrieve(
+        collection_name=COLLECTION_NAME,
+        ids=product_ids,
+        with_payload=COMPARE_FIELDS,
+        with_vectors=False
+    )
+    payloads = {p.id: p.payload or {} for p in points if belongs_to_shop(p.payload or {}, shop_id)}
+    found = [pid for pid in product_ids if pid in payloads]
+
+    attributes = {
+        field: [payloads[pid].get(field) for pid in found]
+        for field in COMPARE_FIELDS if field not in COMPARE_HIDDEN_FIELDS
+    }
+    attributes["url"] = [
+        f"{store_url(shop_id)}/products/{payloads[pid].get('handle')}" for pid in found
+    ]
 
-    return {"comparison": products}
+    comparison = {"product_ids": found, "attributes": attributes}
+    not_found = [pid for pid in product_ids if pid not in payloads]
+    if not_found:
+        comparison["not_found"] = not_found
+    return {"comparison": comparison}
 
 
 @tool
@@ -300,7 +365,7 @@ def view_cart() -> dict:
     return {"items": "cart_items_placeholder"}
 
 @tool
-def checkout_cart() -> dict:
+def checkout_cart(shop_id: Annotated[str | None, InjectedToolArg] = None) -> dict:
     """
     Initiate the checkout process for the current cart.
 
@@ -312,7 +377,7 @@ def checkout_cart() -> dict:
     """
 
     return {
-        "checkout_url": f"https://{SHOPIFY_STORE_URL}/checkout"
+        "checkout_url": f"{store_url(shop_id)}/checkout"
     }
 
 
@@ -321,7 +386,6 @@ def checkout_cart() -> dict:
 # Bind tools to the model
 tools = [
     search_products_qdrant,
-    filter_products,
     get_product_details,
     compare_products,
     add_to_cart,
@@ -332,11 +396,20 @@ tools = [
 tools_by_name = {tool.name: tool for tool in tools}
 model_with_tools = model.bind_tools(tools)
 
+# Tool calls from one LLM turn run concurrently on this bounded pool
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "8"))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))  # seconds, per tool call from when it starts running
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
 # ----------------- Define State -----------------
 
 class MessagesState(TypedDict):
     messages: Annotated[list[AnyMessage], operator.add] 
     llm_calls: int
+    # Estimated prompt size (tokens) of every LLM call, for monitoring growth
+    prompt_tokens: Annotated[list[int], operator.add]
+    # Tenant (myshopify domain) every catalog tool is scoped to
+    shop_id: str | None
 
 # ----------------- Nodes -----------------
 
@@ -344,28 +417,82 @@ def llm_call(state: MessagesState):
     """LLM decides whether to call a tool or not"""
     
     sys_msg = SystemMessage(
-        content="You are a helpful shopping assistant. Use the provided tools to search for products, filter them by price, color, or type, and recommend them to the user."
+        content="You are a helpful shopping assistant. Use the provided tools to search for products (passing any price, color, vendor, type or in-stock constraints as search filters) and recommend them to the user."
     )
     
-    # We invoke the model with the system message + conversation history
-    response = model_with_tools.invoke([sys_msg] + state["messages"])
+    # We invoke the model with the system message + the history compacted to the token budget
+    history, history_tokens = compact_messages(state["messages"])
+    prompt_tokens = estimate_message_tokens(sys_msg) + history_tokens
+    print(f"--- LLM Call | ~{prompt_tokens} prompt tokens ({len(history)}/{len(state['messages'])} messages) ---")
+    response = model_with_tools.invoke([sys_msg] + history)
 
     return {
         "messages": [response],
-        "llm_calls": state.get('llm_calls', 0) + 1
+        "llm_calls": state.get('llm_calls', 0) + 1,
+        "prompt_tokens": [prompt_tokens]
     }
 
+def run_tool_call(tool_call: dict, shop_id: str | None = None, on_start=None):
+    if on_start is not None:
+        on_start()
+    tool = tools_by_name[tool_call["name"]]
+    args = tool_call["args"]
+    if tool_call["name"] in TENANT_TOOLS:
+        args = {**args, "shop_id": shop_id}
+    return tool.invoke(args)
+
 def tool_node(state: MessagesState):
-    """Performs the tool call"""
+    """
+    Performs all tool calls of the last turn concurrently.
+    Results keep the order of the calls; a failing or slow tool only
+    turns its own ToolMessage into an error.
+
+    Each tool gets TOOL_TIMEOUT from when it starts running, so time spent
+    queued behind other conversations' tools doesn't count. A running thread
+    can't be cancelled; it ends on its own through the clients' request
+    timeouts (TOOL_REQUEST_TIMEOUT). A call that can't even start within
+    TOOL_TIMEOUT is taken off the queue.
+    """
     result = []
     last_message = state["messages"][-1]
-    
-    for tool_call in last_message.tool_calls:
-        tool = tools_by_name[tool_call["name"]]
-        # Execute tool
-        observation = tool.invoke(tool_call["args"])
+
+    # Products already returned earlier in this turn are referenced by ID only
+    current_turn = split_turns(state["messages"])[-1]
+    shown_ids = set()
+    for message in current_turn:
+        if isinstance(message, ToolMessage):
+            shown_ids.update(extract_product_ids(message.content))
+
+    # Execute tools
+    shop_id = state.get("shop_id")
+    calls = last_message.tool_calls
+    started = [threading.Event() for _ in calls]
+    started_at = [0.0] * len(calls)
+
+    def mark_started(index: int):
+        started_at[index] = time.monotonic()
+        started[index].set()
+
+    futures = [
+        tool_executor.submit(run_tool_call, tool_call, shop_id, functools.partial(mark_started, i))
+        for i, tool_call in enumerate(calls)
+    ]
+
+    for i, (tool_call, future) in enumerate(zip(calls, futures)):
+        try:
+            if not started[i].wait(TOOL_TIMEOUT) and future.cancel():
+                raise RuntimeError(f"not started within {TOOL_TIMEOUT}s, the tool pool is busy")
+            started[i].wait()
+            remaining = TOOL_TIMEOUT - (time.monotonic() - started_at[i])
+            observation = future.result(timeout=max(0.0, remaining))
+            content, status = serialize_tool_result(tool_call["name"], observation, shown_ids), "success"
+            shown_ids.update(extract_product_ids(content))
+        except FuturesTimeoutError:
+            content, status = f"Error: tool '{tool_call['name']}' timed out after {TOOL_TIMEOUT}s", "error"
+        except Exception as e:
+            content, status = f"Error: tool '{tool_call['name']}' failed: {e}", "error"
         # Create ToolMessage
-        result.append(ToolMessage(content=str(observation), tool_call_id=tool_call["id"]))
+        result.append(ToolMessage(content=content, tool_call_id=tool_call["id"], status=status))
         
     return {"messages": result}
 
@@ -395,6 +522,163 @@ agent_builder.add_edge("tool_node", "llm_call")
 
 agent = agent_builder.compile()
 
+# Conversations kept in memory; the least recently active ones beyond this
+# (or idle longer than AGENT_THREAD_TTL seconds) are dropped
+AGENT_MAX_THREADS = int(os.getenv("AGENT_MAX_THREADS", "1000"))
+AGENT_THREAD_TTL = float(os.getenv("AGENT_THREAD_TTL", str(24 * 3600)))
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver that forgets old conversations instead of keeping every
+    thread for the life of the process. Checked whenever a checkpoint is written.
+    """
+    def __init__(self, max_threads: int = AGENT_MAX_THREADS, ttl: float = AGENT_THREAD_TTL):
+        super().__init__()
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self._last_used: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, config) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        now = time.monotonic()
+        with self._lock:
+            self._last_used[thread_id] = now
+            self._last_used.move_to_end(thread_id)
+            expired = []
+            while self._last_used:
+                oldest, last_used = next(iter(self._last_used.items()))
+                if len(self._last_used) <= self.max_threads and now - last_used <= self.ttl:
+                    break
+                self._last_used.popitem(last=False)
+                expired.append(oldest)
+        for old_thread in expired:
+            super().delete_thread(old_thread)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        self._touch(config)
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._last_used.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+# Session-backed variant: state lives in the checkpointer under a thread ID,
+# so each turn only needs to send the new HumanMessage
+checkpointer = BoundedMemorySaver()
+chat_agent = agent_builder.compile(checkpointer=checkpointer)
+
+def end_conversation(thread_id: str) -> None:
+    """Frees a conversation's checkpoints (e.g. when the user clears the chat)."""
+    checkpointer.delete_thread(thread_id)
+
+# ----------------- Answer Cache -----------------
+
+# Context-free first-turn questions are answered from here when a near-identical
+# question was answered before and the catalog hasn't changed since.
+# One cache per shop, so answers never cross tenants.
+answer_caches: dict[str | None, SemanticAnswerCache] = {}
+
+def get_answer_cache(shop_id: str | None) -> SemanticAnswerCache:
+    if shop_id not in answer_caches:
+        answer_caches[shop_id] = SemanticAnswerCache(
+            catalog_version=lambda: catalog_version(qdrant, COLLECTION_NAME, shop_id)
+        )
+    return answer_caches[shop_id]
+
+def first_turn_question(inputs: dict, config: dict | None) -> str | None:
+    """Returns the question text if this run starts a new conversation."""
+    messages = inputs.get("messages", [])
+    if len(messages) != 1 or not isinstance(messages[0], HumanMessage):
+        return None
+    if not isinstance(messages[0].content, str):
+        return None
+    if config and chat_agent.get_state(config).values.get("messages"):
+        return None
+    return messages[0].content
+
+# ----------------- Streaming -----------------
+
+def stream_agent(inputs: dict, thread_id: str | None = None, shop_id: str | None = None):
+    """
+    Runs the agent and yields UI-agnostic events as they happen.
+    With a `thread_id` the checkpointed `chat_agent` is used and `inputs`
+    should only hold the new message(s) for this turn. Catalog tools are
+    scoped to `shop_id` (default: SHOPIFY_STORE_URL); raises ValueError if
+    neither is set.
+
+    Events:
+        ("token", str)          assistant text chunks from llm_call
+        ("tool_calls", list)    names of the tools the model decided to call
+        ("tool_results", list)  ToolMessages once a tool_node step finishes
+        ("done", dict)          {"state": final state, "ttft": seconds to first
+                                token (None if no text), "total": seconds,
+                                "cached": True if served by the answer cache}
+    """
+    started = time.perf_counter()
+    ttft = None
+    final_state = None
+    text_step = None
+
+    graph = chat_agent if thread_id else agent
+    config = {"configurable": {"thread_id": thread_id}} if thread_id else None
+    shop_id = require_shop(normalize_shop_domain(shop_id) or default_shop_id())
+    inputs = {**inputs, "shop_id": shop_id}
+    answer_cache = get_answer_cache(shop_id)
+
+    question = first_turn_question(inputs, config) if ANSWER_CACHE_ENABLED else None
+    query_vector = embedding_batcher.embed([question])[0] if question else None
+    hit = answer_cache.lookup(query_vector) if query_vector is not None else None
+    if hit:
+        answer, similarity = hit
+        print(f"--- Answer Cache Hit | similarity={similarity:.3f} ---")
+        ttft = time.perf_counter() - started
+        yield "token", answer
+        new_messages = [inputs["messages"][0], AIMessage(content=answer)]
+        if config:
+            # Record the turn so follow-up questions see it
+            chat_agent.update_state(config, {"messages": new_messages, "shop_id": shop_id}, as_node="llm_call")
+            final_state = chat_agent.get_state(config).values
+        else:
+            final_state = {"messages": new_messages, "llm_calls": 0, "prompt_tokens": [], "shop_id": shop_id}
+        yield "done", {"state": final_state, "ttft": ttft, "total": time.perf_counter() - started, "cached": True}
+        return
+
+    for mode, chunk in graph.stream(inputs, config=config, stream_mode=["messages", "updates", "values"]):
+        if mode == "messages":
+            message, metadata = chunk
+            if metadata.get("langgraph_node") != "llm_call" or not isinstance(message, AIMessageChunk):
+                continue
+            if not isinstance(message.content, str) or not message.content:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            # Separate text produced by different LLM calls in the same run
+            step = metadata.get("langgraph_step")
+            if text_step is not None and step != text_step:
+                yield "token", "\n\n"
+            text_step = step
+            yield "token", message.content
+        elif mode == "updates":
+            for node, update in chunk.items():
+                messages = (update or {}).get("messages", [])
+                if node == "llm_call":
+                    names = [tc["name"] for m in messages for tc in (getattr(m, "tool_calls", None) or [])]
+                    if names:
+                        yield "tool_calls", names
+                elif node == "tool_node":
+                    yield "tool_results", messages
+        elif mode == "values":
+            final_state = chunk
+
+    if query_vector is not None and final_state:
+        last_message = final_state["messages"][-1]
+        if isinstance(last_message, AIMessage) and last_message.content and not last_message.tool_calls:
+            answer_cache.store(question, query_vector, last_message.content)
+
+    yield "done", {"state": final_state, "ttft": ttft, "total": time.perf_counter() - started, "cached": False}
+
 # ----------------- Execution -----------------
 
 if __name__ == "__main__":
@@ -410,7 +694,7 @@ if __name__ == "__main__":
     print(f"User: {user_input}\n")
 
     messages = [HumanMessage(content=user_input)]
-    result = agent.invoke({"messages": messages})
+    result = agent.invoke({"messages": messages, "shop_id": require_shop(default_shop_id())})
 
     print("\n--- Final Conversation History ---")
     for m in result["messages"]:
@@ -0,0 +1,87 @@
+import json
+import os
+from typing import List, Tuple
+
+from langchain_core.messages import AnyMessage, HumanMessage, ToolMessage
+from embedding_batcher import estimate_tokens
+from tool_serialization import extract_product_ids
+
+# --- CONFIGURATION ---
+AGENT_PROMPT_TOKEN_BUDGET = int(os.getenv("AGENT_PROMPT_TOKEN_BUDGET", "8000"))
+# Old tool results are cut down to this many characters (plus referenced IDs)
+STALE_TOOL_RESULT_CHARS = int(os.getenv("STALE_TOOL_RESULT_CHARS", "300"))
+
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_message_tokens(message: AnyMessage) -> int:
+    """`estimate_tokens` of the content and tool calls, plus the per-message overhead."""
+    text = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        text += tool_call["name"] + json.dumps(tool_call["args"], default=str)
+    return estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_prompt_tokens(messages: List[AnyMessage]) -> int:
+    return sum(estimate_message_tokens(m) for m in messages)
+
+
+def compact_tool_message(message: ToolMessage, max_chars: int = STALE_TOOL_RESULT_CHARS) -> ToolMessage:
+    """
+    Replaces a stale tool payload with a short preview plus the product IDs
+    it mentioned, so the model can still refer back to those products.
+    """
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    if len(content) <= max_chars:
+        return message
+    ids = extract_product_ids(content)
+    compacted = content[:max_chars] + " …[truncated older tool result]"
+    if ids:
+        compacted += f" product_ids={','.join(ids)}"
+    return ToolMessage(content=compacted, tool_call_id=message.tool_call_id, status=message.status)
+
+
+def split_turns(messages: List[AnyMessage]) -> List[List[AnyMessage]]:
+    """Groups messages into turns, each starting at a HumanMessage."""
+    turns: List[List[AnyMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def compact_messages(
+    messages: List[AnyMessage],
+    max_tokens: int = AGENT_PROMPT_TOKEN_BUDGET,
+    stale_tool_chars: int = STALE_TOOL_RESULT_CHARS,
+) -> Tuple[List[AnyMessage], int]:
+    """
+    Fits the conversation into `max_tokens` (estimated) before it is sent
+    to the LLM. The state itself is left untouched.
+
+    1. Tool results from earlier turns are truncated to a preview plus
+       their product IDs; the current turn is kept verbatim.
+    2. If still over budget, whole turns are dropped oldest-first. Turns
+       are cut at HumanMessage boundaries so tool calls and their results
+       are never separated. The current turn is always kept.
+
+    Returns (messages to send, estimated token count).
+    """
+    turns = split_turns(messages)
+    if not turns:
+        return [], 0
+
+    compacted_turns = [
+        [compact_tool_message(m, stale_tool_chars) if isinstance(m, ToolMessage) else m for m in turn]
+        for turn in turns[:-1]
+    ] + [turns[-1]]
+
+    sizes = [estimate_prompt_tokens(turn) for turn in compacted_turns]
+    total = sum(sizes)
+    start = 0
+    while total > max_tokens and start < len(compacted_turns) - 1:
+        total -= sizes[start]
+        start += 1
+
+    return [m for turn in compacted_turns[start:] for m in turn], total
@@ -1,12 +1,21 @@
 import argparse
+import os
 import uvicorn
 import asyncio
-from typing import List, Dict, Optional
-from fastapi import FastAPI, Request, HTTPException
+import json
+import httpx
+from typing import AsyncIterator, List, Dict, Optional
+from fastapi import FastAPI, Header, Request, HTTPException
+from qdrant_client import AsyncQdrantClient
 from langchain_openai import OpenAIEmbeddings
 from tools.shopify_client import shopify_client
 from memory.db_managers import qdrant_db
 from config.settings import settings
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import get_default_cache
+from product_payload import SHOP_ID_FIELD, build_product_payload, abump_catalog_version, record_shops
+from shop_registry import default_shop_id, normalize_shop_domain
+from hybrid_search import product_vectors
 
 # Initialize Embeddings
 # Ensure OPENAI_API_KEY is set in settings/.env
@@ -14,54 +23,142 @@ embeddings_model = OpenAIEmbeddings(
     model="text-embedding-3-small", 
     api_key=settings.OPENAI_API_KEY
 )
+embedding_batcher = EmbeddingBatcher(
+    embeddings_model.aembed_documents,
+    model=embeddings_model.model,
+    cache=get_default_cache()
+)
+# Only used to publish catalog version bumps (collection metadata)
+async_qdrant_client = AsyncQdrantClient(url=os.getenv("QDRANT_URL", "http://localhost:6333"))
 
 app = FastAPI(title="Shopify Product Webhook Listener")
 
+BULK_PRODUCTS_QUERY = """
+{
+  products {
+    edges {
+      node {
+        id
+        title
+        description
+        vendor
+        productType
+        tags
+        handle
+        options {
+          name
+        }
+        variants {
+          edges {
+            node {
+              id
+              sku
+              price
+              inventoryQuantity
+              availableForSale
+              selectedOptions {
+                name
+                value
+              }
+              inventoryItem {
+                id
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+BULK_RUN_MUTATION = """
+mutation bulkRun($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_STATUS_QUERY = """
+query ($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation {
+      id
+      status
+      errorCode
+      objectCount
+      url
+      partialDataUrl
+    }
+  }
+}
+"""
+
+BULK_TERMINAL_STATES = {"COMPLETED", "FAILED", "CANCELED", "EXPIRED"}
+
 class ProductIndexer:
-    def __init__(self):
+    def __init__(self, shop_id: Optional[str] = None):
         self.collection_name = "shopify_products"
+        # Tenant of synced products; webhook products carry their own shop_id
+        self.shop_id = normalize_shop_domain(shop_id) or default_shop_id()
 
     async def generate_embedding(self, text: str) -> List[float]:
-        return await embeddings_model.aembed_query(text)
+        return (await embedding_batcher.aembed([text]))[0]
 
-    async def index_product(self, product_data: Dict):
+    def build_point(self, product_data: Dict):
         """
-        Processes a single product dictionary (from GraphQL or Webhook)
-        and inserts it into Qdrant.
+        Normalizes a product dictionary (from GraphQL or Webhook)
+        into (id, text_to_embed, payload).
         """
         # Handle structure differences between GraphQL and Webhook JSON
         p_id = str(product_data.get("id", ""))
         title = product_data.get("title", "")
         # GraphQL uses 'description', Webhooks might use 'body_html' or 'body'
         desc = product_data.get("description") or product_data.get("body_html") or ""
-        
-        # Extract Price (Simplified)
-        price = "0.00"
-        if "variants" in product_data:
-            # GraphQL structure
-            variants = product_data["variants"]
-            if isinstance(variants, dict) and "edges" in variants:
-                 if variants["edges"]:
-                     price = variants["edges"][0]["node"].get("price", "0.00")
-            # Webhook structure (list of dicts)
-            elif isinstance(variants, list) and len(variants) > 0:
-                price = variants[0].get("price", "0.00")
-
-        text_to_embed = f"Product: {title}. Description: {desc}. Price: {price}"
-        
-        print(f"Generate embedding for: {title}")
-        vector = await self.generate_embedding(text_to_embed)
-
-        payload = {
-            "product_id": p_id,
-            "title": title,
-            "description": desc,
-            "price": price,
-            "raw_text": text_to_embed
-        }
 
-        qdrant_db.upsert_point(self.collection_name, p_id, vector, payload)
-        print(f"Indexed product: {title} ({p_id})")
+        # Prices and inventory live in the per-variant payload, so price or
+        # stock changes never require a new embedding
+        text_to_embed = f"Product: {title}. Description: {desc}"
+
+        payload = build_product_payload(
+            title=title,
+            vendor=product_data.get("vendor", ""),
+            product_type=product_data.get("productType") or product_data.get("product_type", ""),
+            tags=product_data.get("tags"),
+            handle=product_data.get("handle", ""),
+            description=desc,
+            variants=product_data.get("variants"),
+            options=product_data.get("options"),
+            product_id=p_id,
+            raw_text=text_to_embed,
+            shop_id=product_data.get(SHOP_ID_FIELD) or self.shop_id
+        )
+        return p_id, text_to_embed, payload
+
+    async def index_products(self, products: List[Dict]):
+        """
+        Embeds a list of products in batched requests and inserts them into Qdrant.
+        """
+        points = [self.build_point(p) for p in products]
+        if not points:
+            return
+
+        print(f"Generate embeddings for {len(points)} products")
+        vectors = await embedding_batcher.aembed([text for _, text, _ in points])
+
+        for (p_id, text, payload), vector in zip(points, vectors):
+            qdrant_db.upsert_point(self.collection_name, p_id, product_vectors(vector, text), payload)
+            print(f"Indexed product: {payload['title']} ({p_id})")
+        await abump_catalog_version(async_qdrant_client, self.collection_name, record_shops(points))
+
+    async def index_product(self, product_data: Dict):
+        """
+        Processes a single product dictionary (from GraphQL or Webhook)
+        and inserts it into Qdrant.
+        """
+        await self.index_products([product_data])
 
     async def sync_all_products(self):
         print("--- Starting Bulk Sync from Shopify ---")
@@ -81,10 +178,28 @@ class ProductIndexer:
                     id
                     title
                     description
-                    variants(first: 1) {
+                    vendor
+                    productType
+                    tags
+                    handle
+                    options {
+                        name
+                    }
+                    variants(first: 100) {
                         edges {
                             node {
+                                id
+                                sku
                                 price
+                                inventoryQuantity
+                                availableForSale
+                                selectedOptions {
+                                    name
+                                    value
+                                }
+                                inventoryItem {
+                                    id
+                                }
                             }
                         }
                     }
@@ -98,9 +213,7 @@ class ProductIndexer:
             data = result.get("data", {}).get("products", {})
             
             edges = data.get("edges", [])
-            for edge in edges:
-                node = edge["node"]
-                await self.index_product(node)
+            await self.index_products([edge["node"] for edge in edges])
             
             page_info = data.get("pageInfo", {})
             has_next = page_info.get("hasNextPage", False)
@@ -108,12 +221,154 @@ class ProductIndexer:
             
         print("--- Bulk Sync Complete ---")
 
+    async def start_bulk_operation(self) -> str:
+        """
+        Submits the catalog export as a Shopify Bulk Operation and returns its ID.
+        """
+        result = shopify_client.execute(BULK_RUN_MUTATION, {"query": BULK_PRODUCTS_QUERY})
+        data = result.get("data", {}).get("bulkOperationRunQuery", {})
+        if data.get("userErrors"):
+            raise Exception(f"Bulk Operation Failed to Start: {data['userErrors']}")
+        return data["bulkOperation"]["id"]
+
+    async def wait_for_bulk_operation(
+        self, operation_id: str, poll_interval: float = 5.0, timeout: float = 3600.0
+    ) -> Dict:
+        """
+        Polls the bulk operation `operation_id` until it reaches a terminal state.
+        """
+        elapsed = 0.0
+        while elapsed < timeout:
+            result = shopify_client.execute(BULK_STATUS_QUERY, {"id": operation_id})
+            operation = result.get("data", {}).get("node") or {}
+            status = operation.get("status")
+            print(f"Bulk operation {operation_id}: {status} ({operation.get('objectCount', 0)} objects)")
+            if status in BULK_TERMINAL_STATES:
+                if status != "COMPLETED":
+                    raise Exception(f"Bulk Operation {status}: {operation.get('errorCode')}")
+                return operation
+            await asyncio.sleep(poll_interval)
+            elapsed += poll_interval
+        raise TimeoutError(f"Timed out waiting for bulk operation {operation_id} to finish")
+
+    async def iter_jsonl_lines(self, source: str) -> AsyncIterator[str]:
+        """
+        Streams lines from the bulk result, one at a time.
+        `source` may be an http(s) URL or a local file path / file:// URL.
+        """
+        if source.startswith("http://") or source.startswith("https://"):
+            async with httpx.AsyncClient(timeout=None) as client:
+                async with client.stream("GET", source) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        yield line
+        else:
+            path = source[len("file://"):] if source.startswith("file://") else source
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    yield line
+
+    async def iter_bulk_products(self, source: str) -> AsyncIterator[Dict]:
+        """
+        Reassembles products from the flattened bulk JSONL.
+        Child rows (variants) carry `__parentId` and normally follow their parent,
+        so only the product currently being assembled is held in memory. Children
+        that show up before their parent are buffered by parent ID. Children
+        that show up after their product was already emitted are buffered until
+        the end of the stream; those products are then re-read from `source`
+        and emitted again complete, so no variant is lost. Children whose
+        product never appears are reported.
+        """
+        current = None
+        emitted = set()
+        orphans: Dict[str, List[Dict]] = {}
+        async for line in self.iter_jsonl_lines(source):
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            parent_id = row.pop("__parentId", None)
+            if parent_id is None:
+                if current is not None:
+                    emitted.add(current.get("id"))
+                    yield current
+                current = row
+                current["variants"] = {"edges": [{"node": child} for child in orphans.pop(row.get("id"), [])]}
+            elif current is not None and current.get("id") == parent_id:
+                current["variants"]["edges"].append({"node": row})
+            else:
+                orphans.setdefault(parent_id, []).append(row)
+        if current is not None:
+            emitted.add(current.get("id"))
+            yield current
+
+        late = {parent_id for parent_id in orphans if parent_id in emitted}
+        if late:
+            print(f"🔁 Re-assembling {len(late)} products whose variants came after a later product")
+            async for product in self.iter_bulk_products_by_id(source, late):
+                yield product
+        missing = {parent_id: rows for parent_id, rows in orphans.items() if parent_id not in emitted}
+        if missing:
+            print(
+                f"⚠️ Skipped {sum(len(rows) for rows in missing.values())} bulk child rows whose product "
+                f"is missing from the file: {sorted(missing)[:10]}"
+            )
+
+    async def iter_bulk_products_by_id(self, source: str, product_ids: set) -> AsyncIterator[Dict]:
+        """
+        Second pass over the bulk JSONL: collects the listed products and every
+        child row that belongs to them, wherever it appears.
+        """
+        products: Dict[str, Dict] = {}
+        children: Dict[str, List[Dict]] = {}
+        async for line in self.iter_jsonl_lines(source):
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            parent_id = row.pop("__parentId", None)
+            if parent_id is None and row.get("id") in product_ids:
+                products[row["id"]] = row
+            elif parent_id in product_ids:
+                children.setdefault(parent_id, []).append(row)
+        for product_id, product in products.items():
+            product["variants"] = {"edges": [{"node": child} for child in children.get(product_id, [])]}
+            yield product
+
+    async def sync_all_products_bulk(self, result_url: Optional[str] = None, poll_interval: float = 5.0):
+        """
+        Full-catalog sync via bulkOperationRunQuery.
+        Pass `result_url` to index an existing bulk result (URL or local JSONL file).
+        """
+        print("--- Starting Bulk Operation Sync from Shopify ---")
+        if result_url is None:
+            operation_id = await self.start_bulk_operation()
+            operation = await self.wait_for_bulk_operation(operation_id, poll_interval=poll_interval)
+            result_url = operation.get("url")
+            if not result_url:
+                print("Bulk operation returned no data (empty catalog)")
+                return
+
+        count = 0
+        pending = []
+        async for product in self.iter_bulk_products(result_url):
+            pending.append(product)
+            if len(pending) >= embedding_batcher.batch_size:
+                await self.index_products(pending)
+                count += len(pending)
+                pending = []
+        if pending:
+            await self.index_products(pending)
+            count += len(pending)
+
+        print(f"--- Bulk Operation Sync Complete ({count} products) ---")
+
 indexer = ProductIndexer()
 
 # --- Webhook Endpoints ---
 
 @app.post("/webhooks/shopify/product-update")
-async def product_update_webhook(request: Request):
+async def product_update_webhook(request: Request, x_shopify_shop_domain: Optional[str] = Header(None)):
     """
     Endpoint for 'products/create' and 'products/update' webhooks.
     """
@@ -122,6 +377,7 @@ async def product_update_webhook(request: Request):
     try:
         payload = await request.json()
         # Webhook payload is usually the product object directly
+        payload[SHOP_ID_FIELD] = normalize_shop_domain(x_shopify_shop_domain) or indexer.shop_id
         await indexer.index_product(payload)
         return {"status": "success", "message": "Product indexed"}
     except Exception as e:
@@ -137,11 +393,15 @@ def health_check():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Shopify Product Indexer & Webhook Server")
     parser.add_argument("--sync", action="store_true", help="Run bulk sync of all Shopify products")
+    parser.add_argument("--bulk", action="store_true", help="Use a Shopify Bulk Operation for --sync")
+    parser.add_argument("--bulk-result", help="Index an existing bulk result JSONL (URL or file path)")
     parser.add_argument("--server", action="store_true", help="Start the Webhook Server")
     
     args = parser.parse_args()
 
-    if args.sync:
+    if args.sync and (args.bulk or args.bulk_result):
+        asyncio.run(indexer.sync_all_products_bulk(result_url=args.bulk_result))
+    elif args.sync:
         asyncio.run(indexer.sync_all_products())
     elif args.server:
         print("Starting Webhook Server on port 8000...")
@@ -0,0 +1,566 @@
+import argparse
+import hashlib
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import (
+    FieldCondition, Filter, KeywordIndexParams, KeywordIndexType, MatchAny, MatchValue, Nested, NestedCondition,
+    PayloadSchemaType, Range, SetPayload, SetPayloadOperation
+)
+
+from shop_registry import default_shop_id, normalize_shop_domain
+
+# Payload key holding the hash of the text the stored vector was computed from
+CONTENT_HASH_FIELD = "content_hash"
+
+# Tenant key: the shop's myshopify domain (see shop_registry.normalize_shop_domain).
+# Shopify product IDs are unique across shops, so point IDs stay the product ID.
+SHOP_ID_FIELD = "shop_id"
+
+# Collection metadata key prefix set by every ingestion path, one key per shop
+# ("catalog_version:<shop_id>"). It lives in Qdrant, so readers in other
+# processes or hosts (the agent's answer cache) see changes, and a write to one
+# shop's products leaves the other shops' caches alone.
+CATALOG_VERSION_KEY = "catalog_version"
+
+# Canonical payload schema: field -> Qdrant payload index type.
+# `price` is the cheapest variant price (what "under $50" filters mean).
+# `shop_id` is a tenant index: Qdrant co-locates each shop's points on disk.
+# `variants` is an array of per-variant objects (price, options, inventory);
+# `options` flattens their lowercased option values (e.g. "red", "xl").
+# `vendor_key` / `product_type_key` are lowercased copies of vendor and
+# product_type (kept as-is for display) so filters match case-insensitively.
+PAYLOAD_INDEXES = {
+    SHOP_ID_FIELD: KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True),
+    "price": PayloadSchemaType.FLOAT,
+    "min_price": PayloadSchemaType.FLOAT,
+    "max_price": PayloadSchemaType.FLOAT,
+    "vendor_key": PayloadSchemaType.KEYWORD,
+    "product_type_key": PayloadSchemaType.KEYWORD,
+    "tags": PayloadSchemaType.KEYWORD,
+    "options": PayloadSchemaType.KEYWORD,
+    "in_stock": PayloadSchemaType.BOOL,
+    "variants[].price": PayloadSchemaType.FLOAT,
+    "variants[].available": PayloadSchemaType.BOOL,
+    # Looked up by inventory_levels/update webhooks
+    "variants[].inventory_item_id": PayloadSchemaType.INTEGER,
+}
+
+
+def content_hash(text_to_embed: str) -> str:
+    return hashlib.sha256(text_to_embed.encode("utf-8")).hexdigest()
+
+
+def catalog_version_key(shop_id: str) -> str:
+    return f"{CATALOG_VERSION_KEY}:{shop_id}"
+
+
+def _catalog_version_metadata(shop_ids: Iterable[Optional[str]]) -> Dict[str, float]:
+    now = time.time()
+    return {catalog_version_key(shop_id): now for shop_id in set(shop_ids) if shop_id}
+
+
+def bump_catalog_version(client: QdrantClient, collection_name: str, shop_ids: Iterable[Optional[str]]) -> None:
+    """
+    Signals that products of `shop_ids` changed (consumed by the agent's answer
+    cache), in one request: collection metadata updates merge keys.
+    Needs Qdrant 1.16+ (collection metadata); a failure only warns, so ingestion
+    is never retried because of it.
+    """
+    metadata = _catalog_version_metadata(shop_ids)
+    if not metadata:
+        return
+    try:
+        client.update_collection(collection_name=collection_name, metadata=metadata)
+    except Exception as e:
+        print(f"⚠️ Could not bump the catalog version of {collection_name}: {e}")
+
+
+async def abump_catalog_version(
+    client: AsyncQdrantClient, collection_name: str, shop_ids: Iterable[Optional[str]]
+) -> None:
+    """`bump_catalog_version` for an AsyncQdrantClient."""
+    metadata = _catalog_version_metadata(shop_ids)
+    if not metadata:
+        return
+    try:
+        await client.update_collection(collection_name=collection_name, metadata=metadata)
+    except Exception as e:
+        print(f"⚠️ Could not bump the catalog version of {collection_name}: {e}")
+
+
+def catalog_version(client: QdrantClient, collection_name: str, shop_id: Optional[str] = None) -> float:
+    """
+    The timestamp of the shop's last bump, or 0.0 if it was never bumped.
+    Without a shop (unscoped searches span every shop), the latest bump of any.
+    """
+    metadata = client.get_collection(collection_name).config.metadata or {}
+    if shop_id:
+        return float(metadata.get(catalog_version_key(shop_id)) or 0.0)
+    prefix = catalog_version_key("")
+    return max((float(v or 0.0) for k, v in metadata.items() if k.startswith(prefix)), default=0.0)
+
+
+def record_shops(records: List[Tuple]) -> Set[str]:
+    """The shops of (point_id, text_to_embed, payload) records."""
+    return {payload.get(SHOP_ID_FIELD) for _, _, payload in records if payload.get(SHOP_ID_FIELD)}
+
+
+def parse_price(value) -> Optional[float]:
+    """'49.99' / 49.99 / {'amount': '49.99'} -> 49.99; None if unparseable."""
+    if isinstance(value, dict):
+        value = value.get("amount")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_tags(tags: Union[str, List[str], None]) -> List[str]:
+    """
+    Shopify sends tags as 'Red, Waterproof' (REST) or a list (GraphQL).
+    Stored lowercased so keyword matching is case-insensitive.
+    """
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return [t.strip().lower() for t in tags if t and t.strip()]
+
+
+def keyword_key(value) -> str:
+    """'Nike ' -> 'nike': the form vendor / product_type are matched in."""
+    return str(value or "").strip().lower()
+
+
+def normalize_variants(variants) -> List[dict]:
+    """Flattens GraphQL `{"edges": [{"node": ...}]}` or REST lists into a list of dicts."""
+    if isinstance(variants, dict):
+        return [edge.get("node", {}) for edge in variants.get("edges", [])]
+    return list(variants or [])
+
+
+def parse_gid(value) -> Optional[int]:
+    """'gid://shopify/InventoryItem/123' / '123' / 123 -> 123; None if missing."""
+    if value is None or value == "":
+        return None
+    try:
+        return int(str(value).rsplit("/", 1)[-1])
+    except ValueError:
+        return None
+
+
+def option_names(options) -> List[str]:
+    """Product option names from REST `[{"name": "Color", ...}]` or GraphQL `[{"name": ...}]` / plain strings."""
+    return [o.get("name", "") if isinstance(o, dict) else str(o) for o in options or []]
+
+
+def variant_options(variant: dict, names: List[str]) -> Dict[str, str]:
+    """
+    {"color": "Red", "size": "XL"} from GraphQL `selectedOptions` or REST
+    option1..option3 (named after the product's options).
+    """
+    if variant.get("selectedOptions"):
+        return {o["name"].lower(): o["value"] for o in variant["selectedOptions"] if o.get("value")}
+    options = {}
+    for position in range(1, 4):
+        value = variant.get(f"option{position}")
+        if value:
+            name = names[position - 1] if position <= len(names) and names[position - 1] else f"option{position}"
+            options[name.lower()] = value
+    return options
+
+
+def build_variant_payload(variant: dict, names: List[str]) -> dict:
+    quantity = int(variant.get("inventory_quantity", variant.get("inventoryQuantity")) or 0)
+    if "availableForSale" in variant:
+        # GraphQL already accounts for tracking and the overselling policy
+        continue_selling = bool(variant["availableForSale"]) and quantity <= 0
+    else:
+        untracked = "inventory_management" in variant and not variant["inventory_management"]
+        continue_selling = untracked or variant.get("inventory_policy") == "continue"
+    inventory_item = variant.get("inventoryItem") or {}
+    return {
+        "variant_id": parse_gid(variant.get("id")),
+        "inventory_item_id": parse_gid(variant.get("inventory_item_id") or inventory_item.get("id")),
+        "sku": variant.get("sku") or "",
+        "price": parse_price(variant.get("price")) or 0.0,
+        "options": variant_options(variant, names),
+        "inventory_quantity": quantity,
+        # Untracked inventory or "continue selling when out of stock"
+        "continue_selling": continue_selling,
+        "available": continue_selling or quantity > 0,
+    }
+
+
+def total_inventory(variants) -> int:
+    """Sums variant inventory (REST `inventory_quantity` or GraphQL `inventoryQuantity`)."""
+    return sum(
+        int(v.get("inventory_quantity", v.get("inventoryQuantity")) or 0)
+        for v in normalize_variants(variants)
+    )
+
+
+def build_product_payload(
+    title: str = "",
+    vendor: str = "",
+    product_type: str = "",
+    tags=None,
+    handle: str = "",
+    description: str = "",
+    variants=None,
+    options=None,
+    **extra,
+) -> dict:
+    """
+    Builds the canonical, typed payload shared by every ingestion path.
+    `options` are the product's option definitions, used to name REST
+    option1..option3 values.
+    """
+    variants = normalize_variants(variants)
+    prices = [p for p in (parse_price(v.get("price")) for v in variants) if p is not None]
+    names = option_names(options)
+    variant_payloads = [build_variant_payload(v, names) for v in variants]
+    payload = {
+        "title": title,
+        "vendor": vendor or "",
+        "product_type": product_type or "",
+        "vendor_key": keyword_key(vendor),
+        "product_type_key": keyword_key(product_type),
+        "price": min(prices) if prices else 0.0,
+        "min_price": min(prices) if prices else 0.0,
+        "max_price": max(prices) if prices else 0.0,
+        "inventory_quantity": total_inventory(variants),
+        "handle": handle,
+        "tags": parse_tags(tags),
+        "description": description,
+        "variants": variant_payloads,
+        "options": sorted({value.lower() for v in variant_payloads for value in v["options"].values()}),
+        "in_stock": any(v["available"] for v in variant_payloads),
+    }
+    payload.update(extra)
+    return payload
+
+
+def normalize_payload(payload: dict, shop_id: Optional[str] = None) -> dict:
+    """
+    Converts a legacy payload (string price, comma-joined tags) to the
+    canonical schema. Only fields that need rewriting are returned.
+    Points without a shop are assigned `shop_id` if given.
+    """
+    patch = {}
+    if shop_id and not payload.get(SHOP_ID_FIELD):
+        patch[SHOP_ID_FIELD] = shop_id
+    price = payload.get("price")
+    if not isinstance(price, (int, float)):
+        price = parse_price(price) or 0.0
+        patch["price"] = price
+    if not isinstance(payload.get("min_price"), (int, float)):
+        patch["min_price"] = price
+    if not isinstance(payload.get("max_price"), (int, float)):
+        patch["max_price"] = price
+    tags = payload.get("tags")
+    if not isinstance(tags, list) or tags != parse_tags(tags):
+        patch["tags"] = parse_tags(tags)
+    for field in ("vendor", "product_type"):
+        if not isinstance(payload.get(field), str):
+            patch[field] = payload.get(field) or ""
+        if payload.get(f"{field}_key") != keyword_key(payload.get(field)):
+            patch[f"{field}_key"] = keyword_key(payload.get(field))
+    if not isinstance(payload.get("in_stock"), bool):
+        # Unknown until the product is re-ingested with its variants (it may be
+        # untracked or allow overselling), so keep it visible to in-stock searches
+        patch["in_stock"] = True
+    return patch
+
+
+def build_product_filter(
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    vendor: Optional[str] = None,
+    product_type: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    shop_id: Optional[str] = None,
+    color: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+) -> Optional[Filter]:
+    """
+    Builds a Qdrant filter over the indexed payload fields.
+    `tags`, `vendor` and `product_type` match case-insensitively; `color`
+    matches a tag or a variant option value; `shop_id` scopes the search to one tenant.
+
+    With `in_stock`, the price range must be met by an available variant
+    (not just by some variant), so "in stock under $50" is exact.
+    """
+    conditions = []
+    if shop_id:
+        conditions.append(FieldCondition(key=SHOP_ID_FIELD, match=MatchValue(value=shop_id)))
+    has_price_range = min_price is not None or max_price is not None
+    if in_stock and has_price_range:
+        conditions.append(NestedCondition(nested=Nested(key="variants", filter=Filter(must=[
+            FieldCondition(key="available", match=MatchValue(value=True)),
+            FieldCondition(key="price", range=Range(gte=min_price, lte=max_price)),
+        ]))))
+    elif has_price_range:
+        conditions.append(FieldCondition(key="price", range=Range(gte=min_price, lte=max_price)))
+    if in_stock is not None and not (in_stock and has_price_range):
+        conditions.append(FieldCondition(key="in_stock", match=MatchValue(value=in_stock)))
+    if color:
+        values = parse_tags([color])
+        conditions.append(Filter(should=[
+            FieldCondition(key="tags", match=MatchAny(any=values)),
+            FieldCondition(key="options", match=MatchAny(any=values)),
+        ]))
+    if vendor:
+        conditions.append(FieldCondition(key="vendor_key", match=MatchValue(value=keyword_key(vendor))))
+    if product_type:
+        conditions.append(FieldCondition(key="product_type_key", match=MatchValue(value=keyword_key(product_type))))
+    if tags:
+        conditions.append(FieldCondition(key="tags", match=MatchAny(any=parse_tags(tags))))
+    return Filter(must=conditions) if conditions else None
+
+
+def ensure_payload_indexes(client: QdrantClient, collection_name: str) -> None:
+    """
+    Creates the payload indexes from PAYLOAD_INDEXES that don't exist yet,
+    so filtered searches use them instead of scanning payloads.
+    """
+    existing = client.get_collection(collection_name).payload_schema or {}
+    for field, schema in PAYLOAD_INDEXES.items():
+        if field not in existing:
+            schema_name = schema.value if isinstance(schema, PayloadSchemaType) else schema.type.value
+            print(f"Creating payload index: {collection_name}.{field} ({schema_name})")
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field,
+                field_schema=schema,
+                wait=True,
+            )
+
+
+def migrate_payloads(
+    client: QdrantClient, collection_name: str, batch_size: int = 256, shop_id: Optional[str] = None
+) -> int:
+    """
+    Rewrites existing points to the canonical schema (payload only, vectors
+    untouched), assigning points that predate multi-tenancy to `shop_id`.
+    Safe to re-run; returns the number of points patched.
+    """
+    patched = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
+        )
+        records = []
+        for point in points:
+            patch = normalize_payload(point.payload or {}, shop_id)
+            if patch:
+                records.append((point.id, None, patch))
+        patch_payloads(client, collection_name, records)
+        patched += len(records)
+        if offset is None:
+            break
+    ensure_payload_indexes(client, collection_name)
+    return patched
+
+
+def fetch_content_hashes(client: QdrantClient, collection_name: str, ids: list) -> Dict:
+    """
+    Returns {point_id: content_hash} for the given IDs that already exist.
+    Only the hash field is transferred; vectors are not.
+    """
+    if not ids:
+        return {}
+    points = client.retrieve(
+        collection_name=collection_name,
+        ids=ids,
+        with_payload=[CONTENT_HASH_FIELD],
+        with_vectors=False,
+    )
+    return {p.id: (p.payload or {}).get(CONTENT_HASH_FIELD) for p in points}
+
+
+def _split_by_hash(existing: Dict, records: List[Tuple]) -> Tuple[List[Tuple], List[Tuple]]:
+    changed, unchanged = [], []
+    for record in records:
+        point_id, text, _ = record
+        if existing.get(point_id) == content_hash(text):
+            unchanged.append(record)
+        else:
+            changed.append(record)
+    return changed, unchanged
+
+
+def split_unchanged(client: QdrantClient, collection_name: str, records: List[Tuple]) -> Tuple[List[Tuple], List[Tuple]]:
+    """
+    Splits (point_id, text_to_embed, payload) records into those that need a
+    new embedding and those whose stored vector is still valid.
+    """
+    existing = fetch_content_hashes(client, collection_name, [r[0] for r in records])
+    return _split_by_hash(existing, records)
+
+
+async def asplit_unchanged(
+    client: AsyncQdrantClient, collection_name: str, records: List[Tuple]
+) -> Tuple[List[Tuple], List[Tuple]]:
+    """`split_unchanged` for an AsyncQdrantClient."""
+    ids = [r[0] for r in records]
+    if not ids:
+        return [], []
+    points = await client.retrieve(
+        collection_name=collection_name,
+        ids=ids,
+        with_payload=[CONTENT_HASH_FIELD],
+        with_vectors=False,
+    )
+    existing = {p.id: (p.payload or {}).get(CONTENT_HASH_FIELD) for p in points}
+    return _split_by_hash(existing, records)
+
+
+def _set_payload_operations(records: List[Tuple]) -> List[SetPayloadOperation]:
+    return [
+        SetPayloadOperation(set_payload=SetPayload(payload=payload, points=[point_id]))
+        for point_id, _, payload in records
+    ]
+
+
+def patch_payloads(client: QdrantClient, collection_name: str, records: List[Tuple], wait: bool = True) -> None:
+    """
+    Overwrites payload fields (price, inventory, ...) without touching vectors,
+    in a single batched request.
+    """
+    if not records:
+        return
+    client.batch_update_points(
+        collection_name=collection_name,
+        update_operations=_set_payload_operations(records),
+        wait=wait,
+    )
+
+
+async def apatch_payloads(
+    client: AsyncQdrantClient, collection_name: str, records: List[Tuple], wait: bool = True
+) -> None:
+    """`patch_payloads` for an AsyncQdrantClient."""
+    if not records:
+        return
+    await client.batch_update_points(
+        collection_name=collection_name,
+        update_operations=_set_payload_operations(records),
+        wait=wait,
+    )
+
+
+def apply_inventory_quantities(payload: dict, quantities: Dict[int, int]) -> Optional[dict]:
+    """
+    Sets the current Shopify `inventoryQuantity` ({inventory_item_id: quantity},
+    see ShopifyClient.get_inventory_item_quantities) on a stored product
+    payload's variants and returns the payload patch, or None if none of its
+    variants match.
+    """
+    variants = [dict(v) for v in payload.get("variants") or []]
+    matched = False
+    for variant in variants:
+        quantity = quantities.get(variant.get("inventory_item_id"))
+        if quantity is None:
+            continue
+        matched = True
+        variant["inventory_quantity"] = quantity
+        variant["available"] = bool(variant.get("continue_selling")) or quantity > 0
+    if not matched:
+        return None
+    return {
+        "variants": variants,
+        "inventory_quantity": sum(v.get("inventory_quantity") or 0 for v in variants),
+        "in_stock": any(v.get("available") for v in variants),
+    }
+
+
+def _inventory_filter(quantities: Dict[int, int]) -> Filter:
+    return Filter(must=[FieldCondition(key="variants[].inventory_item_id", match=MatchAny(any=sorted(quantities)))])
+
+
+def _inventory_patch_records(points, quantities: Dict[int, int]) -> Tuple[List[Tuple], Set[str]]:
+    records, flipped_shops = [], set()
+    for point in points:
+        payload = point.payload or {}
+        patch = apply_inventory_quantities(payload, quantities)
+        if not patch:
+            continue
+        records.append((point.id, None, patch))
+        if patch["in_stock"] != payload.get("in_stock"):
+            flipped_shops.add(payload.get(SHOP_ID_FIELD) or default_shop_id())
+    return records, flipped_shops
+
+
+# Read back to patch the variants and to tell which products changed availability
+INVENTORY_PATCH_FIELDS = ["variants", "in_stock", SHOP_ID_FIELD]
+
+
+def patch_inventory_quantities(
+    client: QdrantClient, collection_name: str, quantities: Dict[int, int]
+) -> Tuple[int, Set[str]]:
+    """
+    Payload-only inventory update: finds the products owning the inventory
+    items (one filtered scroll) and patches their variants, inventory and
+    `in_stock` in one batched request. Returns (products patched, shops with
+    a product whose `in_stock` flipped): quantity changes alone don't change
+    what the agent answers, so only those shops need a catalog version bump.
+
+    This rewrites the whole `variants` array, so it must not run concurrently
+    with an upsert of the same product (IngestQueue.claim_batch keeps the two
+    apart).
+    """
+    if not quantities:
+        return 0, set()
+    # An inventory item belongs to exactly one product
+    points, _ = client.scroll(
+        collection_name=collection_name,
+        scroll_filter=_inventory_filter(quantities),
+        limit=len(quantities),
+        with_payload=INVENTORY_PATCH_FIELDS,
+        with_vectors=False,
+    )
+    records, flipped_shops = _inventory_patch_records(points, quantities)
+    patch_payloads(client, collection_name, records)
+    return len(records), flipped_shops
+
+
+async def apatch_inventory_quantities(
+    client: AsyncQdrantClient, collection_name: str, quantities: Dict[int, int]
+) -> Tuple[int, Set[str]]:
+    """`patch_inventory_quantities` for an AsyncQdrantClient."""
+    if not quantities:
+        return 0, set()
+    points, _ = await client.scroll(
+        collection_name=collection_name,
+        scroll_filter=_inventory_filter(quantities),
+        limit=len(quantities),
+        with_payload=INVENTORY_PATCH_FIELDS,
+        with_vectors=False,
+    )
+    records, flipped_shops = _inventory_patch_records(points, quantities)
+    await apatch_payloads(client, collection_name, records)
+    return len(records), flipped_shops
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Product payload schema tools")
+    parser.add_argument("--migrate", action="store_true", help="Rewrite existing points to the typed schema")
+    parser.add_argument("--collection", default="shopify_products")
+    parser.add_argument("--shop", help="Shop domain to assign to points without a shop_id")
+    args = parser.parse_args()
+
+    if args.migrate:
+        qdrant = QdrantClient(url=os.getenv("QDRANT_URL", "http://localhost:6333"))
+        count = migrate_payloads(qdrant, args.collection, shop_id=normalize_shop_domain(args.shop) or default_shop_id())
+        print(f"✅ Migrated {count} points in {args.collection}")
+    else:
+        print("Please specify --migrate")
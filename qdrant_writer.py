@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+from qdrant_client import QdrantClient
+from qdrant_client.local.qdrant_local import QdrantLocal
+from qdrant_client.models import PointStruct
+
+# --- CONFIGURATION ---
+QDRANT_UPSERT_BATCH_SIZE = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", "256"))
+QDRANT_UPSERT_PARALLEL = int(os.getenv("QDRANT_UPSERT_PARALLEL", "4"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+
+
+def make_qdrant_client(url: str, prefer_grpc: bool = QDRANT_PREFER_GRPC) -> QdrantClient:
+    """
+    Creates a QdrantClient, optionally over gRPC (faster for bulk point uploads).
+    Use ":memory:" for an in-process instance.
+    """
+    if url == ":memory:":
+        return QdrantClient(":memory:")
+    return QdrantClient(url=url, prefer_grpc=prefer_grpc, grpc_port=QDRANT_GRPC_PORT)
+
+
+def is_local_client(client: QdrantClient) -> bool:
+    """True for in-process clients (":memory:" or a local path), which are not thread-safe."""
+    return isinstance(getattr(client, "_client", None), QdrantLocal)
+
+
+class BatchedQdrantWriter:
+    """
+    Buffers points and upserts them in batches, with up to `parallel` batches in
+    flight. Batches are sent with wait=False; `close()` drains the in-flight
+    uploads and sends the last batch with wait=True. Qdrant applies updates in
+    order, so once that call returns every earlier batch is applied too.
+    In-process clients are written one batch at a time.
+
+    Usable as a context manager:
+
+        with BatchedQdrantWriter(client, "shopify_products") as writer:
+            writer.add(PointStruct(...))
+    """
+    def __init__(
+        self,
+        client: QdrantClient,
+        collection_name: str,
+        batch_size: int = QDRANT_UPSERT_BATCH_SIZE,
+        parallel: int = QDRANT_UPSERT_PARALLEL,
+    ):
+        self.client = client
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.parallel = 1 if is_local_client(client) else max(1, parallel)
+        self._buffer: List[PointStruct] = []
+        self._last_batch: List[PointStruct] = []
+        self._inflight: List[Future] = []
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.points_written = 0
+        self.batches_written = 0
+        # Wall-clock seconds with at least one upsert in flight
+        self.elapsed = 0.0
+        self._active = 0
+        self._busy_since = 0.0
+        self._timing_lock = threading.Lock()
+
+    def _upsert(self, points: List[PointStruct], wait: bool) -> None:
+        with self._timing_lock:
+            if self._active == 0:
+                self._busy_since = time.perf_counter()
+            self._active += 1
+        try:
+            self.client.upsert(collection_name=self.collection_name, points=points, wait=wait)
+        finally:
+            with self._timing_lock:
+                self._active -= 1
+                if self._active == 0:
+                    self.elapsed += time.perf_counter() - self._busy_since
+
+    def _submit(self, points: List[PointStruct]) -> None:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.parallel)
+        # Keep at most `parallel` batches in flight so buffered points stay bounded
+        if len(self._inflight) >= self.parallel:
+            self._inflight.pop(0).result()
+        self._inflight.append(self._pool.submit(self._upsert, points, False))
+        self._last_batch = points
+        self.points_written += len(points)
+        self.batches_written += 1
+
+    def add(self, point: PointStruct) -> None:
+        self._buffer.append(point)
+        if len(self._buffer) >= self.batch_size:
+            batch, self._buffer = self._buffer, []
+            self._submit(batch)
+
+    def extend(self, points: List[PointStruct]) -> None:
+        for point in points:
+            self.add(point)
+
+    def close(self) -> None:
+        """
+        Consistency barrier: drains in-flight uploads, then writes the final
+        batch with wait=True.
+        """
+        for future in self._inflight:
+            future.result()
+        self._inflight = []
+
+        if self._buffer:
+            final, self._buffer = self._buffer, []
+            self.points_written += len(final)
+            self.batches_written += 1
+        else:
+            # Re-sending the last batch is idempotent and gives us something to wait on
+            final = self._last_batch
+        if final:
+            self._upsert(final, wait=True)
+
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    @property
+    def throughput(self) -> float:
+        """
+        Points per second of upload time (after close()). Only time with an
+        upsert in flight counts, so embedding between batches is excluded.
+        """
+        return self.points_written / self.elapsed if self.elapsed else 0.0
+
+    def __enter__(self) -> "BatchedQdrantWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
@@ -1,21 +1,33 @@
 import os
-from typing import List, Optional
+import asyncio
+from typing import List, Literal, Optional, Union
+from typing_extensions import Annotated
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from openai import OpenAI
-from qdrant_client import QdrantClient
-from qdrant_client.models import Filter, FieldCondition, Range, MatchValue, MatchAny
+from pydantic import BaseModel, Field
+from openai import AsyncOpenAI
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import (
+    FieldCondition, Filter, HasIdCondition, MatchValue, QueryRequest, RecommendQuery, RecommendInput
+)
 import uvicorn
+from embedding_batcher import EmbeddingBatcher, async_openai_embed_fn
+from embedding_cache import get_default_cache
+from product_payload import SHOP_ID_FIELD, build_product_filter
+from hybrid_search import hybrid_query, DENSE_VECTOR_NAME
+from collection_config import search_params
+from shop_registry import default_shop_id, normalize_shop_domain
 
 # --- CONFIGURATION ---
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "sk-xxxxxxxxxxxx")
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333") 
 COLLECTION_NAME = "shopify_products"
+REQUEST_TIMEOUT = float(os.getenv("RECOMMENDER_REQUEST_TIMEOUT", "5.0"))  # seconds
 
 # --- INITIALIZATION ---
 app = FastAPI(title="Advanced Product Recommender")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-qdrant_client = QdrantClient(url=QDRANT_URL)
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+qdrant_client = AsyncQdrantClient(url=QDRANT_URL)
+embedding_batcher = EmbeddingBatcher(async_openai_embed_fn(openai_client), cache=get_default_cache())
 
 # --- DATA MODELS ---
 class FilterParams(BaseModel):
@@ -23,120 +35,200 @@ class FilterParams(BaseModel):
     max_price: Optional[float] = None
     vendor: Optional[str] = None
     allowed_tags: Optional[List[str]] = None  # e.g. ["Blue", "Waterproof"]
+    color: Optional[str] = None  # matches a tag or a variant option value
+    in_stock: Optional[bool] = None  # only products with an available variant (in the price range)
 
+# Every request is scoped to one shop (myshopify domain); defaults to SHOPIFY_STORE_URL
 class SearchRequest(BaseModel):
     query: str
     limit: int = 5
     filters: Optional[FilterParams] = None
+    shop_id: Optional[str] = None
 
 class RecommendationRequest(BaseModel):
     positive_product_ids: List[int]
     negative_product_ids: List[int] = []
     limit: int = 5
     filters: Optional[FilterParams] = None
+    shop_id: Optional[str] = None
 
 class SimilarRequest(BaseModel):
     product_id: int
     limit: int = 5
     filters: Optional[FilterParams] = None
+    shop_id: Optional[str] = None
+
+# Batch items carry a `type` discriminator so one POST can mix request kinds
+class BatchSearchItem(SearchRequest):
+    type: Literal["search"] = "search"
+
+class BatchSimilarItem(SimilarRequest):
+    type: Literal["similar"] = "similar"
+
+class BatchPersonalizedItem(RecommendationRequest):
+    type: Literal["personalized"] = "personalized"
+
+BatchItem = Annotated[
+    Union[BatchSearchItem, BatchSimilarItem, BatchPersonalizedItem],
+    Field(discriminator="type")
+]
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
 
 # --- HELPER FUNCTIONS ---
-def get_embedding(text: str):
-    """Generates vector embedding using the same model as ingestion."""
-    response = openai_client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+async def get_embedding(text: str):
+    """Generates vector embedding using the same model as ingestion (cached)."""
+    return (await embedding_batcher.aembed([text]))[0]
+
+async def with_timeout(coro, timeout: float = REQUEST_TIMEOUT):
+    """Bounds a backend call so slow requests fail fast instead of piling up."""
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Backend timed out after {timeout}s")
+
+def resolve_shop_id(shop_id: Optional[str]) -> str:
+    """
+    The request's shop, defaulting to SHOPIFY_STORE_URL. Without either the
+    request is rejected rather than searching every tenant.
+    """
+    shop_id = normalize_shop_domain(shop_id) or default_shop_id()
+    if not shop_id:
+        raise HTTPException(status_code=400, detail="shop_id is required")
+    return shop_id
 
-def build_qdrant_filter(filters: Optional[FilterParams]) -> Optional[Filter]:
+def build_qdrant_filter(filters: Optional[FilterParams], shop_id: Optional[str] = None) -> Optional[Filter]:
     """
     Constructs a Qdrant Filter object.
     Qdrant applies these filters BEFORE the vector search (Pre-filtering),
-    which is highly efficient.
+    which is highly efficient. The shop condition uses the tenant index,
+    so other shops' points are never visited.
     """
+    shop_id = resolve_shop_id(shop_id)
     if not filters:
-        return None
-    
-    conditions = []
-
-    # 1. Price Range Filter
-    if filters.min_price is not None or filters.max_price is not None:
-        conditions.append(
-            FieldCondition(
-                key="price",
-                range=Range(
-                    gte=filters.min_price,
-                    lte=filters.max_price
-                )
-            )
-        )
+        return build_product_filter(shop_id=shop_id)
 
-    # 2. Vendor Filter (Exact Match)
-    if filters.vendor:
-        conditions.append(
-            FieldCondition(
-                key="vendor",
-                match=MatchValue(value=filters.vendor)
-            )
-        )
+    # Price range, vendor, and any-of tags (vendor and tags match case-insensitively)
+    return build_product_filter(
+        min_price=filters.min_price,
+        max_price=filters.max_price,
+        vendor=filters.vendor,
+        tags=filters.allowed_tags,
+        color=filters.color,
+        in_stock=filters.in_stock,
+        shop_id=shop_id
+    )
 
-    # 3. Tags Filter (Match Any from list)
-    # If user asks for "Blue", checks if "Blue" is in the 'tags' list payload
-    if filters.allowed_tags:
-        conditions.append(
-            FieldCondition(
-                key="tags",
-                match=MatchAny(any=filters.allowed_tags)
-            )
-        )
+async def require_shop_products(product_ids: List[int], shop_id: Optional[str]) -> None:
+    """
+    Example products are looked up by point ID, which the shop filter doesn't
+    cover, so another shop's product could steer the recommendation. Raises
+    404 unless every ID is a product of the request's shop.
+    """
+    ids = sorted(set(product_ids))
+    if not ids:
+        return
+    points, _ = await with_timeout(qdrant_client.scroll(
+        collection_name=COLLECTION_NAME,
+        scroll_filter=Filter(must=[
+            HasIdCondition(has_id=ids),
+            FieldCondition(key=SHOP_ID_FIELD, match=MatchValue(value=resolve_shop_id(shop_id)))
+        ]),
+        limit=len(ids),
+        with_payload=False,
+        with_vectors=False
+    ))
+    missing = sorted(set(ids) - {p.id for p in points})
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Products not found: {missing}")
 
-    if not conditions:
-        return None
+def example_ids(item: Union[SimilarRequest, RecommendationRequest]) -> List[int]:
+    """The product IDs a similar / personalized request recommends from."""
+    if isinstance(item, SimilarRequest):
+        return [item.product_id]
+    return item.positive_product_ids + item.negative_product_ids
 
-    return Filter(must=conditions)
+def exclude_ids(search_filter: Optional[Filter], ids: List[int]) -> Filter:
+    """Keeps the example products themselves out of recommendation results."""
+    exclusion = HasIdCondition(has_id=ids)
+    if search_filter is None:
+        return Filter(must_not=[exclusion])
+    search_filter.must_not = (search_filter.must_not or []) + [exclusion]
+    return search_filter
+
+def recommend_request(
+    positive: List[int], negative: List[int], search_filter: Optional[Filter], limit: int
+) -> QueryRequest:
+    """
+    Recommendation from example products through the Query API (current
+    qdrant-client has no `recommend` method). The examples are excluded.
+    """
+    return QueryRequest(
+        query=RecommendQuery(recommend=RecommendInput(positive=positive, negative=negative)),
+        using=DENSE_VECTOR_NAME or None,
+        filter=exclude_ids(search_filter, positive + negative),
+        params=search_params(),
+        limit=limit,
+        with_payload=True
+    )
+
+async def query_recommendations(request: QueryRequest):
+    response = await with_timeout(qdrant_client.query_points(
+        collection_name=COLLECTION_NAME,
+        query=request.query,
+        using=request.using,
+        query_filter=request.filter,
+        search_params=request.params,
+        limit=request.limit,
+        with_payload=True
+    ))
+    return response.points
 
 # --- API ENDPOINTS ---
 
 @app.get("/")
-def health_check():
+async def health_check():
     return {"status": "Recommender System Online"}
 
+@app.get("/metrics/embedding-cache")
+async def embedding_cache_metrics():
+    return get_default_cache().stats()
+
 @app.post("/search/semantic")
-def semantic_search(request: SearchRequest):
+async def semantic_search(request: SearchRequest):
     """
-    🔍 Search by Meaning + Metadata Filters
+    🔍 Search by Meaning + Keywords + Metadata Filters
+    Dense and sparse (BM25) results are fused server-side with RRF.
     """
-    query_vector = get_embedding(request.query)
-    search_filter = build_qdrant_filter(request.filters)
+    search_filter = build_qdrant_filter(request.filters, request.shop_id)
+    query_vector = await with_timeout(get_embedding(request.query))
 
-    hits = qdrant_client.search(
+    response = await with_timeout(qdrant_client.query_points(
         collection_name=COLLECTION_NAME,
-        query_vector=query_vector,
-        query_filter=search_filter,
-        limit=request.limit
-    )
+        **hybrid_query(query_vector, request.query, search_filter, request.limit, dense_params=search_params())
+    ))
 
     return {
         "query": request.query,
-        "results": [format_hit(hit) for hit in hits]
+        "results": [format_hit(hit) for hit in response.points]
     }
 
 @app.post("/recommend/similar")
-def recommend_similar(request: SimilarRequest):
+async def recommend_similar(request: SimilarRequest):
     """
     👯 Item-to-Item Recommendation + Filters
     Changed to POST to allow complex filter body.
     """
     try:
-        search_filter = build_qdrant_filter(request.filters)
-        
-        results = qdrant_client.recommend(
-            collection_name=COLLECTION_NAME,
-            positive=[request.product_id],
-            query_filter=search_filter,
-            limit=request.limit
+        search_filter = build_qdrant_filter(request.filters, request.shop_id)
+        await require_shop_products(example_ids(request), request.shop_id)
+
+        results = await query_recommendations(
+            recommend_request([request.product_id], [], search_filter, request.limit)
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Error: {str(e)}")
 
@@ -146,21 +238,20 @@ def recommend_similar(request: SimilarRequest):
     }
 
 @app.post("/recommend/personalized")
-def personalized_recommendation(request: RecommendationRequest):
+async def personalized_recommendation(request: RecommendationRequest):
     """
     🧠 Contextual Recommendation + Filters
     (Vector(Liked) - Vector(Disliked)) + Filters
     """
     try:
-        search_filter = build_qdrant_filter(request.filters)
+        search_filter = build_qdrant_filter(request.filters, request.shop_id)
+        await require_shop_products(example_ids(request), request.shop_id)
 
-        results = qdrant_client.recommend(
-            collection_name=COLLECTION_NAME,
-            positive=request.positive_product_ids,
-            negative=request.negative_product_ids,
-            query_filter=search_filter,
-            limit=request.limit
-        )
+        results = await query_recommendations(recommend_request(
+            request.positive_product_ids, request.negative_product_ids, search_filter, request.limit
+        ))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
 
@@ -172,6 +263,66 @@ def personalized_recommendation(request: RecommendationRequest):
         "recommendations": [format_hit(hit) for hit in results]
     }
 
+@app.post("/batch")
+async def batch_search(request: BatchRequest):
+    """
+    📦 Several search / similar / personalized requests in one call.
+    All text queries are embedded together and every request runs in a
+    single Qdrant query_batch_points round-trip. Results keep input order.
+    """
+    items = request.requests
+    if not items:
+        return {"results": []}
+
+    await asyncio.gather(*(
+        require_shop_products(example_ids(item), item.shop_id) for item in items if item.type != "search"
+    ))
+    queries = [item.query for item in items if item.type == "search"]
+    vectors = iter(await with_timeout(embedding_batcher.aembed(queries)) if queries else [])
+
+    query_requests = []
+    for item in items:
+        search_filter = build_qdrant_filter(item.filters, item.shop_id)
+        if item.type == "search":
+            query_requests.append(QueryRequest(**hybrid_query(
+                next(vectors), item.query, search_filter, item.limit, dense_params=search_params()
+            )))
+            continue
+        if item.type == "similar":
+            query_requests.append(recommend_request([item.product_id], [], search_filter, item.limit))
+        else:
+            query_requests.append(recommend_request(
+                item.positive_product_ids, item.negative_product_ids, search_filter, item.limit
+            ))
+
+    try:
+        responses = await with_timeout(qdrant_client.query_batch_points(
+            collection_name=COLLECTION_NAME,
+            requests=query_requests
+        ))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
+
+    results = []
+    for item, response in zip(items, responses):
+        hits = [format_hit(hit) for hit in response.points]
+        if item.type == "search":
+            results.append({"type": item.type, "query": item.query, "results": hits})
+        elif item.type == "similar":
+            results.append({"type": item.type, "source_product": item.product_id, "recommendations": hits})
+        else:
+            results.append({
+                "type": item.type,
+                "context": {
+                    "liked": item.positive_product_ids,
+                    "disliked": item.negative_product_ids
+                },
+                "recommendations": hits
+            })
+    return {"results": results}
+
 def format_hit(hit):
     return {
         "id": hit.id,
@@ -179,7 +330,8 @@ def format_hit(hit):
         "title": hit.payload.get("title"),
         "price": hit.payload.get("price"),
         "vendor": hit.payload.get("vendor"),
-        "tags": hit.payload.get("tags")
+        "tags": hit.payload.get("tags"),
+        "in_stock": hit.payload.get("in_stock")
     }
 
 if __name__ == "__main__":
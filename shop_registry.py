@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# JSON file: {"store.myshopify.com": {"access_token": "...", "webhook_secret": "...", "api_version": "..."}}
+SHOPIFY_SHOPS_PATH = os.getenv("SHOPIFY_SHOPS_PATH", "shops.json")
+SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION", "2024-01")
+# Single-store settings; they register the default shop and still work on their own
+SHOPIFY_STORE_URL = os.getenv("SHOPIFY_STORE_URL")
+SHOPIFY_ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN")
+SHOPIFY_SECRET = os.getenv("SHOPIFY_SECRET")
+
+
+@dataclass(frozen=True)
+class ShopCredentials:
+    shop_id: str  # normalized myshopify domain, also the `shop_id` payload value
+    access_token: Optional[str] = None
+    webhook_secret: Optional[str] = None
+    api_version: str = SHOPIFY_API_VERSION
+
+
+def normalize_shop_domain(domain: Optional[str]) -> Optional[str]:
+    """'https://Store.myshopify.com/' -> 'store.myshopify.com'"""
+    if not domain:
+        return None
+    domain = domain.strip().lower()
+    for prefix in ("https://", "http://"):
+        if domain.startswith(prefix):
+            domain = domain[len(prefix):]
+    return domain.split("/")[0] or None
+
+
+def default_shop_id() -> Optional[str]:
+    """The shop configured through SHOPIFY_STORE_URL, if any."""
+    return normalize_shop_domain(SHOPIFY_STORE_URL)
+
+
+class ShopRegistry:
+    """
+    Per-shop Shopify credentials. The shops file is re-read when it changes,
+    so onboarding a store does not need a restart.
+    """
+    def __init__(self, path: str = SHOPIFY_SHOPS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._shops: Dict[str, ShopCredentials] = {}
+        self._reload()
+
+    def _load(self) -> Dict[str, ShopCredentials]:
+        shops: Dict[str, ShopCredentials] = {}
+        default_shop = default_shop_id()
+        if default_shop:
+            shops[default_shop] = ShopCredentials(default_shop, SHOPIFY_ACCESS_TOKEN, SHOPIFY_SECRET)
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for domain, settings in json.load(f).items():
+                    shop_id = normalize_shop_domain(domain)
+                    shops[shop_id] = ShopCredentials(
+                        shop_id=shop_id,
+                        access_token=settings.get("access_token"),
+                        webhook_secret=settings.get("webhook_secret"),
+                        api_version=settings.get("api_version", SHOPIFY_API_VERSION),
+                    )
+        return shops
+
+    def _reload(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime and self._shops:
+            return
+        with self._lock:
+            self._shops = self._load()
+            self._mtime = mtime
+
+    def get(self, shop_domain: Optional[str]) -> Optional[ShopCredentials]:
+        self._reload()
+        return self._shops.get(normalize_shop_domain(shop_domain))
+
+    def shop_ids(self) -> List[str]:
+        self._reload()
+        return sorted(self._shops)
+
+
+_registry: Optional[ShopRegistry] = None
+
+
+def get_shop_registry() -> ShopRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ShopRegistry()
+    return _registry
@@ -1,16 +1,122 @@
 import httpx
 import asyncio
+import heapq
+import itertools
 import logging
+import time
 from typing import Dict, Any, Optional, List
 
+from shop_registry import ShopCredentials, get_shop_registry, normalize_shop_domain
+
 # Configure module-level logger
 logger = logging.getLogger("shopify_tools")
 
+# Request priorities for the cost throttle (lower runs first)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BULK = 10
+
+
+class GraphQLCostThrottle:
+    """
+    Client-side token bucket mirroring Shopify's GraphQL leaky-bucket limits.
+
+    The bucket is re-synced from ``extensions.cost.throttleStatus`` after every
+    response and refilled locally at ``restoreRate`` in between, so concurrent
+    queries are paced before Shopify throttles them. Waiters are served in
+    priority order (lower value first, FIFO within a priority).
+    """
+    def __init__(self, maximum_available: float = 1000.0, restore_rate: float = 50.0):
+        self.maximum_available = maximum_available
+        self.restore_rate = restore_rate
+        self.available = maximum_available
+        self._last_refill = time.monotonic()
+        self._queue: List[tuple] = []
+        self._counter = itertools.count()
+        self._cond = asyncio.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self.available = min(self.maximum_available, self.available + elapsed * self.restore_rate)
+
+    async def acquire(self, cost: float, priority: int = PRIORITY_DEFAULT) -> None:
+        """
+        Waits until `cost` points are available and this request is next in line.
+        """
+        cost = min(cost, self.maximum_available)
+        entry = (priority, next(self._counter))
+        async with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    self._refill()
+                    is_next = self._queue[0] == entry
+                    if is_next and self.available >= cost:
+                        heapq.heappop(self._queue)
+                        self.available -= cost
+                        self._cond.notify_all()
+                        return
+                    # Only the head of the queue needs a timed wake-up for the refill;
+                    # everyone else waits for the head to be served.
+                    timeout = (cost - self.available) / self.restore_rate if is_next else None
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+                raise
+
+    def update(self, cost_info: Optional[Dict[str, Any]], requested_cost: float = 0.0) -> None:
+        """
+        Syncs the bucket with the server-reported throttle status.
+        Falls back to refunding the unused estimate when no status is returned.
+        """
+        status = (cost_info or {}).get("throttleStatus")
+        if status:
+            self.maximum_available = float(status.get("maximumAvailable", self.maximum_available))
+            self.restore_rate = float(status.get("restoreRate", self.restore_rate)) or self.restore_rate
+            self.available = float(status.get("currentlyAvailable", self.available))
+            self._last_refill = time.monotonic()
+        elif cost_info and cost_info.get("actualQueryCost") is not None:
+            refund = requested_cost - float(cost_info["actualQueryCost"])
+            self.available = min(self.maximum_available, self.available + max(refund, 0.0))
+
+    def drain(self) -> None:
+        """
+        Marks the bucket as empty (used when Shopify reports we were throttled anyway).
+        """
+        self.available = 0.0
+        self._last_refill = time.monotonic()
+
+
 class ShopifyClient:
     """
     Async client for Shopify Admin API (GraphQL) with rate limit handling.
+
+    A single pooled ``httpx.AsyncClient`` (keep-alive, optional HTTP/2) is shared
+    across requests so repeated tool calls reuse open connections instead of
+    paying for a new TCP+TLS handshake each time. Use the client as an async
+    context manager, or call ``aclose()`` when done.
     """
-    def __init__(self, shop_url: str, access_token: str, api_version: str = "2024-01"):
+    def __init__(
+        self,
+        shop_url: str,
+        access_token: str,
+        api_version: str = "2024-01",
+        http2: bool = True,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 10.0,
+        default_query_cost: float = 50.0,
+        max_retries: int = 3,
+    ):
         self.shop_url = shop_url.replace("https://", "").replace("/", "")
         self.access_token = access_token
         self.api_version = api_version
@@ -20,50 +126,131 @@ class ShopifyClient:
             "Content-Type": "application/json",
             "Accept": "application/json",
         }
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self.default_query_cost = default_query_cost
+        self.max_retries = max_retries
+        self.throttle = GraphQLCostThrottle()
+        # Last requested cost seen per query document, used as the next estimate
+        self._cost_estimates: Dict[str, float] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Lazily creates the shared connection pool (re-created if it was closed).
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                http2=self.http2,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """
+        Closes the underlying connection pool.
+        """
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def __aenter__(self) -> "ShopifyClient":
+        self._get_client()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.aclose()
 
-    async def _make_request(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    @classmethod
+    def from_credentials(cls, credentials: ShopCredentials, **kwargs) -> "ShopifyClient":
+        if not credentials.access_token:
+            raise ValueError(f"No Admin API access token configured for {credentials.shop_id}")
+        return cls(credentials.shop_id, credentials.access_token, api_version=credentials.api_version, **kwargs)
+
+    @classmethod
+    def for_shop(cls, shop_domain: str, **kwargs) -> "ShopifyClient":
+        """
+        Builds a client from the shop registry (shops file / SHOPIFY_* env).
+        Each shop gets its own connection pool and cost throttle, matching
+        Shopify's per-shop rate limits.
+        """
+        credentials = get_shop_registry().get(shop_domain)
+        if credentials is None:
+            raise ValueError(f"Unknown shop: {shop_domain}")
+        return cls.from_credentials(credentials, **kwargs)
+
+    async def _make_request(
+        self,
+        query: str,
+        variables: Optional[Dict[str, Any]] = None,
+        priority: int = PRIORITY_DEFAULT,
+    ) -> Dict[str, Any]:
         """
-        Internal method to execute GraphQL requests with 429 (Too Many Requests) handling.
+        Internal method to execute GraphQL requests, paced by the cost throttle.
+        Handles both HTTP 429 and GraphQL 'THROTTLED' errors by re-queuing.
         """
         payload = {"query": query, "variables": variables or {}}
-        
-        async with httpx.AsyncClient() as client:
-            retries = 3
-            for attempt in range(retries):
-                try:
-                    response = await client.post(self.base_url, headers=self.headers, json=payload, timeout=10.0)
-                    
-                    # Handle Rate Limiting
-                    if response.status_code == 429:
-                        retry_after = float(response.headers.get("Retry-After", 2.0))
-                        logger.warning(f"Rate limit hit. Retrying in {retry_after} seconds...")
-                        await asyncio.sleep(retry_after)
+        client = self._get_client()
+
+        for attempt in range(self.max_retries):
+            estimated_cost = self._cost_estimates.get(query, self.default_query_cost)
+            await self.throttle.acquire(estimated_cost, priority)
+            try:
+                response = await client.post(self.base_url, json=payload)
+                
+                # Handle Rate Limiting
+                if response.status_code == 429:
+                    retry_after = float(response.headers.get("Retry-After", 2.0))
+                    logger.warning(f"Rate limit hit. Retrying in {retry_after} seconds...")
+                    self.throttle.drain()
+                    await asyncio.sleep(retry_after)
+                    continue
+                
+                response.raise_for_status()
+                json_res = response.json()
+
+                cost_info = json_res.get("extensions", {}).get("cost")
+                if cost_info and cost_info.get("requestedQueryCost") is not None:
+                    self._cost_estimates[query] = float(cost_info["requestedQueryCost"])
+                self.throttle.update(cost_info, estimated_cost)
+                
+                # Check for GraphQL-level errors (which return 200 OK but contain 'errors' key)
+                if "errors" in json_res:
+                    if any(err.get("extensions", {}).get("code") == "THROTTLED" for err in json_res["errors"]):
+                        logger.warning("GraphQL query throttled. Re-queuing until the bucket refills...")
+                        if not cost_info:
+                            self.throttle.drain()
                         continue
+                    logger.error(f"GraphQL Errors: {json_res['errors']}")
+                    raise Exception(f"GraphQL Error: {json_res['errors'][0]['message']}")
                     
-                    response.raise_for_status()
-                    json_res = response.json()
-                    
-                    # Check for GraphQL-level errors (which return 200 OK but contain 'errors' key)
-                    if "errors" in json_res:
-                        logger.error(f"GraphQL Errors: {json_res['errors']}")
-                        raise Exception(f"GraphQL Error: {json_res['errors'][0]['message']}")
-                        
-                    return json_res
-
-                except httpx.HTTPStatusError as e:
-                    logger.error(f"HTTP Error: {e.response.text}")
-                    raise e
-                except httpx.RequestError as e:
-                    logger.error(f"Request Error: {e}")
-                    raise e
-            
-            raise Exception("Max retries exceeded for Shopify API request")
+                return json_res
 
-    async def execute_query(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        return await self._make_request(query, variables)
+            except httpx.HTTPStatusError as e:
+                logger.error(f"HTTP Error: {e.response.text}")
+                raise e
+            except httpx.RequestError as e:
+                logger.error(f"Request Error: {e}")
+                raise e
+        
+        raise Exception("Max retries exceeded for Shopify API request")
 
-    async def execute_mutation(self, mutation: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        return await self._make_request(mutation, variables)
+    async def execute_query(
+        self, query: str, variables: Optional[Dict[str, Any]] = None, priority: int = PRIORITY_DEFAULT
+    ) -> Dict[str, Any]:
+        return await self._make_request(query, variables, priority)
+
+    async def execute_mutation(
+        self, mutation: str, variables: Optional[Dict[str, Any]] = None, priority: int = PRIORITY_DEFAULT
+    ) -> Dict[str, Any]:
+        return await self._make_request(mutation, variables, priority)
 
     # ---------------------------------------------------------
     # SPECIFIC TOOLS
@@ -301,6 +488,33 @@ class ShopifyClient:
         """
         return await self._make_request(gql, {"ids": variant_ids})
 
+    async def get_inventory_item_quantities(self, inventory_item_ids: List[int]) -> Dict[int, int]:
+        """
+        {inventory item ID: its variant's inventoryQuantity (all locations)}.
+        Items that no longer exist are left out.
+        """
+        gql = """
+        query getInventoryItems($ids: [ID!]!) {
+          nodes(ids: $ids) {
+            ... on InventoryItem {
+              id
+              variant {
+                inventoryQuantity
+              }
+            }
+          }
+        }
+        """
+        quantities: Dict[int, int] = {}
+        # `nodes` accepts at most 250 IDs per query
+        for start in range(0, len(inventory_item_ids), 250):
+            ids = [f"gid://shopify/InventoryItem/{item_id}" for item_id in inventory_item_ids[start:start + 250]]
+            result = await self._make_request(gql, {"ids": ids})
+            for node in result.get("data", {}).get("nodes") or []:
+                if node and node.get("variant"):
+                    quantities[int(node["id"].rsplit("/", 1)[-1])] = int(node["variant"].get("inventoryQuantity") or 0)
+        return quantities
+
     async def get_shop_insights(self) -> Dict[str, Any]:
         gql = """
         query getShop {
@@ -313,4 +527,15 @@ class ShopifyClient:
           }
         }
         """
-        return await self._make_request(gql)
\ No newline at end of file
+        return await self._make_request(gql)
+
+
+# One long-lived client per shop, so connections and throttle state are reused
+_shop_clients: Dict[str, ShopifyClient] = {}
+
+
+def get_shop_client(shop_domain: str) -> ShopifyClient:
+    shop_id = normalize_shop_domain(shop_domain)
+    if shop_id not in _shop_clients:
+        _shop_clients[shop_id] = ShopifyClient.for_shop(shop_id)
+    return _shop_clients[shop_id]
@@ -4,29 +4,69 @@ import hashlib
 import base64
 import json
 import os
-from fastapi import FastAPI, Request, Header, HTTPException, BackgroundTasks
+import asyncio
+from fastapi import FastAPI, Request, Header, HTTPException
 from bs4 import BeautifulSoup
-from openai import OpenAI
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, PointIdsList
+from openai import OpenAI, AsyncOpenAI
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    FieldCondition, Filter, FilterSelector, HasIdCondition, MatchValue, PointStruct, PointIdsList
+)
 from dotenv import load_dotenv
+from embedding_batcher import EmbeddingBatcher, openai_embed_fn, async_openai_embed_fn
+from embedding_cache import get_default_cache
+from ingest_queue import IngestQueue, IngestWorkerPool, AsyncIngestWorkerPool, parse_event_time
+from product_payload import (
+    CONTENT_HASH_FIELD, SHOP_ID_FIELD, content_hash, split_unchanged, patch_payloads,
+    asplit_unchanged, apatch_payloads, build_product_payload, ensure_payload_indexes,
+    bump_catalog_version, abump_catalog_version, record_shops, patch_inventory_quantities,
+    apatch_inventory_quantities, parse_gid
+)
+from hybrid_search import require_sparse_vectors, product_vectors
+from collection_config import create_products_collection
+from shop_registry import default_shop_id, get_shop_registry, normalize_shop_domain
+from shopify_tools import ShopifyClient, get_shop_client
 load_dotenv()
 
 # --- CONFIGURATION ---
 # NOTE: Replace these with your actual environment variables or secure secrets management
+# App-wide webhook secret; shops with their own `webhook_secret` in the shop registry use that instead
 SHOPIFY_SECRET = os.getenv("SHOPIFY_SECRET", "your_shopify_secret_here")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your_openai_key_here")
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333") 
 COLLECTION_NAME = "shopify_products"
+# "async" drains the ingest queue on the event loop with AsyncOpenAI/AsyncQdrantClient,
+# "threads" uses the synchronous clients on worker threads
+INGEST_MODE = os.getenv("INGEST_MODE", "async")
+QDRANT_MAX_CONCURRENCY = int(os.getenv("QDRANT_MAX_CONCURRENCY", "8"))
 
 # --- INITIALIZE CLIENTS ---
 app = FastAPI()
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 qdrant_client = QdrantClient(url=QDRANT_URL)
+embedding_batcher = EmbeddingBatcher(openai_embed_fn(openai_client), cache=get_default_cache())
+
+async_openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+async_qdrant_client = AsyncQdrantClient(url=QDRANT_URL)
+# Embedding concurrency is bounded by the batcher; Qdrant calls by this semaphore
+async_embedding_batcher = EmbeddingBatcher(async_openai_embed_fn(async_openai_client), cache=get_default_cache())
+qdrant_semaphore = asyncio.Semaphore(QDRANT_MAX_CONCURRENCY)
 
 # --- UTILITIES ---
 
-async def verify_shopify_hmac(request: Request, x_shopify_hmac_sha256: str) -> bytes:
+def resolve_shop(x_shopify_shop_domain: str):
+    """
+    Returns (shop_id, webhook secret) for the shop a webhook came from.
+    Requests without the header are attributed to the default SHOPIFY_STORE_URL shop.
+    """
+    shop_id = normalize_shop_domain(x_shopify_shop_domain) or default_shop_id()
+    if not shop_id:
+        raise HTTPException(status_code=400, detail="Missing X-Shopify-Shop-Domain header")
+    credentials = get_shop_registry().get(shop_id)
+    secret = (credentials.webhook_secret if credentials else None) or SHOPIFY_SECRET
+    return shop_id, secret
+
+async def verify_shopify_hmac(request: Request, x_shopify_hmac_sha256: str, secret: str = SHOPIFY_SECRET) -> bytes:
     """
     Verifies the Shopify HMAC signature. 
     Returns the raw body bytes if valid, raises HTTPException if invalid.
@@ -34,7 +74,7 @@ async def verify_shopify_hmac(request: Request, x_shopify_hmac_sha256: str) -> b
     body_bytes = await request.body()
     try:
         digest = hmac.new(
-            SHOPIFY_SECRET.encode('utf-8'),
+            secret.encode('utf-8'),
             body_bytes,
             hashlib.sha256
         ).digest()
@@ -52,142 +92,367 @@ async def verify_shopify_hmac(request: Request, x_shopify_hmac_sha256: str) -> b
 def startup_event():
     """
     Ensure the Qdrant collection exists on startup.
+    Quantization, on-disk storage and HNSW settings come from the QDRANT_*
+    variables in collection_config; changing them later needs
+    `python collection_config.py --rebuild`.
     """
     if not qdrant_client.collection_exists(COLLECTION_NAME):
-        print(f"Creating Qdrant collection: {COLLECTION_NAME}")
-        qdrant_client.create_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=1536, distance=Distance.COSINE),
-        )
+        create_products_collection(qdrant_client, COLLECTION_NAME)
+    require_sparse_vectors(qdrant_client, COLLECTION_NAME)
+    ensure_payload_indexes(qdrant_client, COLLECTION_NAME)
 
 # --- BACKGROUND TASKS ---
 
+def build_product_point(product_data: dict):
+    """
+    Cleans a webhook product payload into (product_id, text_to_embed, payload).
+    """
+    product_id = product_data.get("id")
+    # Set by the webhook routes from the X-Shopify-Shop-Domain header
+    shop_id = product_data.get(SHOP_ID_FIELD) or default_shop_id()
+    title = product_data.get("title", "")
+    raw_html = product_data.get("body_html") or ""
+    vendor = product_data.get("vendor", "")
+    tags = product_data.get("tags", "")
+    handle = product_data.get("handle", "")
+    
+    # Some products might not have variants or price; the schema defaults to 0.0
+    variants = product_data.get("variants", [])
+    
+    # 1. Clean HTML
+    soup = BeautifulSoup(raw_html, "html.parser")
+    clean_description = soup.get_text(separator=" ")
+    
+    # 2. Prepare Text for Embedding
+    text_to_embed = f"Product: {title}. Vendor: {vendor}. Tags: {tags}. Description: {clean_description}"
+
+    payload = build_product_payload(
+        title=title,
+        vendor=vendor,
+        product_type=product_data.get("product_type", ""),
+        tags=tags,
+        handle=handle,
+        description=clean_description,
+        variants=variants,
+        options=product_data.get("options"),
+        shop_id=shop_id
+    )
+    payload[CONTENT_HASH_FIELD] = content_hash(text_to_embed)
+    return product_id, text_to_embed, payload
+
+def process_and_ingest_products(products: list):
+    """
+    Batched CREATE/UPDATE ingestion: one embeddings request per batch
+    and a single Qdrant upsert for all points.
+    Products whose embedded text is unchanged (e.g. inventory-only updates)
+    skip the embedding call and only get their payload patched.
+    Raises on failure so the ingest queue can retry the batch.
+    """
+    records = [build_product_point(p) for p in products]
+    records, unchanged = split_unchanged(qdrant_client, COLLECTION_NAME, records)
+
+    if unchanged:
+        patch_payloads(qdrant_client, COLLECTION_NAME, unchanged)
+        print(f"🩹 Patched payload only for unchanged Products {[r[0] for r in unchanged]}")
+        bump_catalog_version(qdrant_client, COLLECTION_NAME, record_shops(unchanged))
+    if not records:
+        return
+
+    print(f"🔄 Upserting (Create/Update) {len(records)} Products...")
+    
+    # 3. Generate Embeddings (the sparse BM25 vector is computed locally at upsert)
+    embeddings = embedding_batcher.embed([text for _, text, _ in records])
+
+    # 4. Upsert into Qdrant
+    qdrant_client.upsert(
+        collection_name=COLLECTION_NAME,
+        points=[
+            PointStruct(
+                id=product_id, 
+                vector=product_vectors(embedding_vector, text),
+                payload=payload
+            )
+            for (product_id, text, payload), embedding_vector in zip(records, embeddings)
+        ]
+    )
+    bump_catalog_version(qdrant_client, COLLECTION_NAME, record_shops(records))
+    print(f"✅ Successfully Upserted Products {[r[0] for r in records]}")
+
 def process_and_ingest_product(product_data: dict):
     """
     Used for both CREATE and UPDATE events.
     Qdrant 'upsert' will overwrite the existing point if the ID matches.
     """
     try:
-        product_id = product_data.get("id")
-        title = product_data.get("title", "")
-        raw_html = product_data.get("body_html") or ""
-        vendor = product_data.get("vendor", "")
-        tags = product_data.get("tags", "")
-        handle = product_data.get("handle", "")
-        
-        # Handle price safely (some products might not have variants or price)
-        variants = product_data.get("variants", [])
-        price = variants[0].get("price") if variants else "0.00"
-        
-        # 1. Clean HTML
-        soup = BeautifulSoup(raw_html, "html.parser")
-        clean_description = soup.get_text(separator=" ")
-        
-        # 2. Prepare Text for Embedding
-        text_to_embed = f"Product: {title}. Vendor: {vendor}. Tags: {tags}. Description: {clean_description}"
-        
-        print(f"🔄 Upserting (Create/Update) Product ID: {product_id}...")
-        
-        # 3. Generate Embedding
-        response = openai_client.embeddings.create(
-            input=text_to_embed,
-            model="text-embedding-3-small"
-        )
-        embedding_vector = response.data[0].embedding
-
-        # 4. Upsert into Qdrant
-        payload = {
-            "title": title,
-            "vendor": vendor,
-            "price": price,
-            "handle": handle,
-            "tags": tags,
-    "description": clean_description
-        }
-
-        qdrant_client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=[
-                PointStruct(
-                    id=product_id, 
-                    vector=embedding_vector,
-                    payload=payload
-                )
-            ]
-        )
-        print(f"✅ Successfully Upserted Product {product_id}")
-
+        process_and_ingest_products([product_data])
     except Exception as e:
         print(f"❌ Upsert Task Failed: {e}")
 
+def delete_shops(products: list) -> set:
+    """The shops a delete batch touches; untagged deletes belong to the default shop."""
+    return {
+        (item.get(SHOP_ID_FIELD) if isinstance(item, dict) else None) or default_shop_id()
+        for item in products
+    }
+
+def delete_selector(products: list):
+    """
+    Returns (points_selector, point_ids) for a delete batch. Items are product
+    IDs or {"id", "shop_id"} dicts from the ingest queue; a shop-tagged delete
+    only matches that shop's points.
+    """
+    ids_by_shop = {}
+    for item in products:
+        product_id, shop_id = (item["id"], item.get(SHOP_ID_FIELD)) if isinstance(item, dict) else (item, None)
+        # Queue IDs come back as strings; Qdrant point IDs are unsigned ints
+        ids_by_shop.setdefault(shop_id, []).append(int(product_id))
+    point_ids = [pid for ids in ids_by_shop.values() for pid in ids]
+
+    if list(ids_by_shop) == [None]:
+        return PointIdsList(points=point_ids), point_ids
+    per_shop = []
+    for shop_id, ids in ids_by_shop.items():
+        must = [HasIdCondition(has_id=ids)]
+        if shop_id:
+            must.append(FieldCondition(key=SHOP_ID_FIELD, match=MatchValue(value=shop_id)))
+        per_shop.append(Filter(must=must))
+    return FilterSelector(filter=Filter(should=per_shop)), point_ids
+
+def delete_products_from_qdrant(products: list):
+    """
+    Batched DELETE: removes all given products in one request.
+    Raises on failure so the ingest queue can retry the batch.
+    """
+    points_selector, point_ids = delete_selector(products)
+    print(f"🗑️ Deleting Product IDs: {point_ids} from Qdrant...")
+
+    qdrant_client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=points_selector
+    )
+    bump_catalog_version(qdrant_client, COLLECTION_NAME, delete_shops(products))
+    print(f"✅ Successfully Deleted Products {point_ids}")
+
+def inventory_items_by_shop(levels: list) -> dict:
+    """{shop_id: [inventory item IDs]} for a batch of inventory level events."""
+    items = {}
+    for level in levels:
+        shop_id = level.get(SHOP_ID_FIELD) or default_shop_id()
+        item_id = parse_gid(level.get("inventory_item_id"))
+        if item_id is not None and item_id not in items.setdefault(shop_id, []):
+            items[shop_id].append(item_id)
+    return items
+
+async def fetch_item_quantities(shop_id: str, item_ids: list) -> dict:
+    """
+    Current quantities from Shopify on a client of its own, for worker threads
+    (each runs its own event loop, which the shared get_shop_client pool can't span).
+    """
+    async with ShopifyClient.for_shop(shop_id) as shopify:
+        return await shopify.get_inventory_item_quantities(item_ids)
+
+def update_inventory_levels(levels: list):
+    """
+    Inventory-only events: looks up each variant's current inventoryQuantity
+    in Shopify (a level event only carries one location) and patches variant
+    inventory and `in_stock` in the payload, no embedding or vector write.
+    The catalog version is only bumped for shops where a product went in or
+    out of stock. Raises so the ingest queue can retry.
+    """
+    patched, flipped_shops = 0, set()
+    for shop_id, item_ids in inventory_items_by_shop(levels).items():
+        quantities = asyncio.run(fetch_item_quantities(shop_id, item_ids))
+        count, flipped = patch_inventory_quantities(qdrant_client, COLLECTION_NAME, quantities)
+        patched += count
+        flipped_shops |= flipped
+    bump_catalog_version(qdrant_client, COLLECTION_NAME, flipped_shops)
+    print(f"📦 Applied {len(levels)} inventory level updates to {patched} Products")
+
 def delete_product_from_qdrant(product_id: int):
     """
     Used for DELETE events.
     Removes the point from Qdrant based on the Product ID.
     """
     try:
-        print(f"🗑️ Deleting Product ID: {product_id} from Qdrant...")
-        
-        qdrant_client.delete(
-            collection_name=COLLECTION_NAME,
-            points_selector=PointIdsList(
-                points=[product_id]
-            )
-        )
-        print(f"✅ Successfully Deleted Product {product_id}")
-        
+        delete_products_from_qdrant([product_id])
     except Exception as e:
         print(f"❌ Delete Task Failed: {e}")
 
+# --- ASYNC INGESTION ---
+
+async def aprocess_and_ingest_products(products: list):
+    """
+    Non-blocking version of `process_and_ingest_products` using AsyncOpenAI
+    and AsyncQdrantClient, so bursts don't tie up threadpool workers.
+    """
+    records = [build_product_point(p) for p in products]
+    async with qdrant_semaphore:
+        records, unchanged = await asplit_unchanged(async_qdrant_client, COLLECTION_NAME, records)
+        if unchanged:
+            await apatch_payloads(async_qdrant_client, COLLECTION_NAME, unchanged)
+            print(f"🩹 Patched payload only for unchanged Products {[r[0] for r in unchanged]}")
+            await abump_catalog_version(async_qdrant_client, COLLECTION_NAME, record_shops(unchanged))
+    if not records:
+        return
+
+    print(f"🔄 Upserting (Create/Update) {len(records)} Products...")
+    embeddings = await async_embedding_batcher.aembed([text for _, text, _ in records])
+
+    async with qdrant_semaphore:
+        await async_qdrant_client.upsert(
+            collection_name=COLLECTION_NAME,
+            points=[
+                PointStruct(id=product_id, vector=product_vectors(embedding_vector, text), payload=payload)
+                for (product_id, text, payload), embedding_vector in zip(records, embeddings)
+            ]
+        )
+    await abump_catalog_version(async_qdrant_client, COLLECTION_NAME, record_shops(records))
+    print(f"✅ Successfully Upserted Products {[r[0] for r in records]}")
+
+async def adelete_products_from_qdrant(products: list):
+    """
+    Non-blocking version of `delete_products_from_qdrant`.
+    """
+    points_selector, point_ids = delete_selector(products)
+    print(f"🗑️ Deleting Product IDs: {point_ids} from Qdrant...")
+    async with qdrant_semaphore:
+        await async_qdrant_client.delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=points_selector
+        )
+    await abump_catalog_version(async_qdrant_client, COLLECTION_NAME, delete_shops(products))
+    print(f"✅ Successfully Deleted Products {point_ids}")
+
+async def aupdate_inventory_levels(levels: list):
+    """
+    Non-blocking version of `update_inventory_levels`.
+    """
+    patched, flipped_shops = 0, set()
+    for shop_id, item_ids in inventory_items_by_shop(levels).items():
+        quantities = await get_shop_client(shop_id).get_inventory_item_quantities(item_ids)
+        async with qdrant_semaphore:
+            count, flipped = await apatch_inventory_quantities(async_qdrant_client, COLLECTION_NAME, quantities)
+        patched += count
+        flipped_shops |= flipped
+    await abump_catalog_version(async_qdrant_client, COLLECTION_NAME, flipped_shops)
+    print(f"📦 Applied {len(levels)} inventory level updates to {patched} Products")
+
+# --- INGEST QUEUE ---
+# Webhooks are persisted and coalesced per product, then drained in batches
+ingest_queue = IngestQueue()
+if INGEST_MODE == "async":
+    ingest_workers = AsyncIngestWorkerPool(
+        ingest_queue, aprocess_and_ingest_products, adelete_products_from_qdrant, aupdate_inventory_levels
+    )
+else:
+    ingest_workers = IngestWorkerPool(
+        ingest_queue, process_and_ingest_products, delete_products_from_qdrant, update_inventory_levels
+    )
+
+@app.on_event("startup")
+async def start_ingest_workers():
+    ingest_workers.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_workers():
+    if isinstance(ingest_workers, AsyncIngestWorkerPool):
+        await ingest_workers.stop()
+    else:
+        await asyncio.to_thread(ingest_workers.stop)
+
 # --- ROUTES ---
 
 @app.get("/")
 async def health_check():
     return {"status": "active", "message": "Shopify Vector Sync is running"}
 
+@app.get("/metrics/queue")
+async def queue_metrics():
+    return ingest_queue.metrics()
+
 @app.post("/webhooks/shopify/products-create")
 async def handle_product_create(
     request: Request, 
-    background_tasks: BackgroundTasks,
-    x_shopify_hmac_sha256: str = Header(None)
+    x_shopify_hmac_sha256: str = Header(None),
+    x_shopify_shop_domain: str = Header(None),
+    x_shopify_triggered_at: str = Header(None)
 ):
-    body_bytes = await verify_shopify_hmac(request, x_shopify_hmac_sha256)
+    shop_id, secret = resolve_shop(x_shopify_shop_domain)
+    body_bytes = await verify_shopify_hmac(request, x_shopify_hmac_sha256, secret)
     product_data = json.loads(body_bytes)
+    product_data[SHOP_ID_FIELD] = shop_id
     
     # Ingest (Create)
-    background_tasks.add_task(process_and_ingest_product, product_data)
+    await asyncio.to_thread(ingest_queue.enqueue_upsert, product_data, parse_event_time(x_shopify_triggered_at))
     return {"status": "received"}
 
 @app.post("/webhooks/shopify/products-update")
 async def handle_product_update(
     request: Request, 
-    background_tasks: BackgroundTasks,
-    x_shopify_hmac_sha256: str = Header(None)
+    x_shopify_hmac_sha256: str = Header(None),
+    x_shopify_shop_domain: str = Header(None),
+    x_shopify_triggered_at: str = Header(None)
 ):
-    body_bytes = await verify_shopify_hmac(request, x_shopify_hmac_sha256)
+    shop_id, secret = resolve_shop(x_shopify_shop_domain)
+    body_bytes = await verify_shopify_hmac(request, x_shopify_hmac_sha256, secret)
     product_data = json.loads(body_bytes)
+    product_data[SHOP_ID_FIELD] = shop_id
     
-    # Ingest (Update - Overwrites existing ID)
-    background_tasks.add_task(process_and_ingest_product, product_data)
+    # Ingest (Update - supersedes any pending event for this product unless
+    # it is older than one already received)
+    queued = await asyncio.to_thread(
+        ingest_queue.enqueue_upsert, product_data, parse_event_time(x_shopify_triggered_at)
+    )
+    if not queued:
+        print(f"⏭️ Ignoring out-of-date update for Product {product_data.get('id')}")
     return {"status": "received"}
 
 @app.post("/webhooks/shopify/products-deletion")
 async def handle_product_delete(
     request: Request, 
-    background_tasks: BackgroundTasks,
-    x_shopify_hmac_sha256: str = Header(None)
+    x_shopify_hmac_sha256: str = Header(None),
+    x_shopify_shop_domain: str = Header(None),
+    x_shopify_triggered_at: str = Header(None)
 ):
-    body_bytes = await verify_shopify_hmac(request, x_shopify_hmac_sha256)
+    shop_id, secret = resolve_shop(x_shopify_shop_domain)
+    body_bytes = await verify_shopify_hmac(request, x_shopify_hmac_sha256, secret)
     data = json.loads(body_bytes)
     
     # The delete payload is smaller, usually just {"id": 12345...}
     product_id = data.get("id")
     
     if product_id:
-        background_tasks.add_task(delete_product_from_qdrant, product_id)
+        # Cancels any pending upsert for this product
+        await asyncio.to_thread(
+            ingest_queue.enqueue_delete, product_id, shop_id, parse_event_time(x_shopify_triggered_at)
+        )
         
     return {"status": "received"}
 
+@app.post("/webhooks/shopify/inventory-levels-update")
+async def handle_inventory_level_update(
+    request: Request, 
+    x_shopify_hmac_sha256: str = Header(None),
+    x_shopify_shop_domain: str = Header(None),
+    x_shopify_triggered_at: str = Header(None)
+):
+    shop_id, secret = resolve_shop(x_shopify_shop_domain)
+    body_bytes = await verify_shopify_hmac(request, x_shopify_hmac_sha256, secret)
+    data = json.loads(body_bytes)
+
+    # {"inventory_item_id": ..., "location_id": ..., "available": ...}
+    if data.get("inventory_item_id"):
+        level = {
+            "inventory_item_id": data["inventory_item_id"],
+            "location_id": data.get("location_id"),
+            "available": data.get("available"),
+            "updated_at": data.get("updated_at"),
+            SHOP_ID_FIELD: shop_id,
+        }
+        await asyncio.to_thread(ingest_queue.enqueue_inventory, level, parse_event_time(x_shopify_triggered_at))
+
+    return {"status": "received"}
+
 if __name__ == "__main__":
     print("🚀 Starting Webhook Listener...")
     uvicorn.run("shopify_webhook:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
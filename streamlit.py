@@ -1,9 +1,15 @@
+import uuid
 import streamlit as st
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 
 # Import your existing LangGraph agent
 # Make sure this matches your file name
-from langgraph_agent import agent  
+from langgraph_agent import end_conversation, stream_agent
+
+# Tool results longer than this are collapsed behind a toggle
+TOOL_PREVIEW_CHARS = 200
+# How many past messages to render before "Show earlier messages"
+HISTORY_PAGE_SIZE = 20
 
 st.set_page_config(page_title="🛍️ AI Shopping Agent", layout="centered")
 
@@ -13,23 +19,60 @@ st.caption("Chat with a LangGraph-powered shopping agent")
 # -------------------------------
 # Initialize Session State
 # -------------------------------
+# The conversation itself lives in the agent's checkpointer under this thread ID;
+# `messages` is only a reference to the last state, used for rendering.
+if "thread_id" not in st.session_state:
+    st.session_state.thread_id = str(uuid.uuid4())
+
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
 if "llm_calls" not in st.session_state:
     st.session_state.llm_calls = 0
 
+if "prompt_tokens" not in st.session_state:
+    st.session_state.prompt_tokens = []
+
+if "latency" not in st.session_state:
+    st.session_state.latency = None
+
+if "history_limit" not in st.session_state:
+    st.session_state.history_limit = HISTORY_PAGE_SIZE
+
 # -------------------------------
 # Display Chat History
 # -------------------------------
-for msg in st.session_state.messages:
+def render_tool_result(msg: ToolMessage, key: str):
+    content = str(msg.content)
+    if len(content) <= TOOL_PREVIEW_CHARS:
+        st.markdown("**🛠 Tool Result:**")
+        st.code(content, language="json")
+        return
+    with st.expander(f"🛠 Tool Result ({len(content):,} chars)"):
+        st.code(content[:TOOL_PREVIEW_CHARS] + "…", language="json")
+        # The full payload is only sent to the browser when asked for
+        if st.toggle("Show full result", key=key):
+            st.code(content, language="json")
+
+history = st.session_state.messages
+hidden = max(0, len(history) - st.session_state.history_limit)
+if hidden:
+    if st.button(f"⬆️ Show earlier messages ({hidden} hidden)"):
+        st.session_state.history_limit += HISTORY_PAGE_SIZE
+        st.rerun()
+
+for index in range(hidden, len(history)):
+    msg = history[index]
     if isinstance(msg, HumanMessage):
         with st.chat_message("user"):
             st.write(msg.content)
 
     elif isinstance(msg, AIMessage):
+        if not msg.content and not msg.tool_calls:
+            continue
         with st.chat_message("assistant"):
-            st.write(msg.content)
+            if msg.content:
+                st.write(msg.content)
 
             # Show tool calls (if any)
             if msg.tool_calls:
@@ -39,8 +82,7 @@ for msg in st.session_state.messages:
 
     elif isinstance(msg, ToolMessage):
         with st.chat_message("assistant"):
-            st.markdown("**🛠 Tool Result:**")
-            st.write(msg.content)
+            render_tool_result(msg, key=f"tool-{st.session_state.thread_id}-{index}")
 
 # -------------------------------
 # User Input
@@ -48,43 +90,55 @@ for msg in st.session_state.messages:
 user_input = st.chat_input("Ask me to find products, filter by price, color, or type...")
 
 if user_input:
-    # Add user message
-    human_msg = HumanMessage(content=user_input)
-    st.session_state.messages.append(human_msg)
-
     with st.chat_message("user"):
         st.write(user_input)
 
     # -------------------------------
-    # Invoke LangGraph Agent
+    # Stream LangGraph Agent
     # -------------------------------
-    with st.spinner("🤖 Thinking..."):
-        result = agent.invoke(
-            {
-                "messages": st.session_state.messages,
-                "llm_calls": st.session_state.llm_calls,
-            }
-        )
+    # Only the new message is sent; prior turns come from the checkpointer
+    result = None
+    error = None
+    with st.chat_message("assistant"):
+        status = st.status("🤖 Thinking...", expanded=False)
+        placeholder = st.empty()
+        text = ""
+
+        try:
+            for event, data in stream_agent(
+                {"messages": [HumanMessage(content=user_input)]},
+                thread_id=st.session_state.thread_id,
+            ):
+                if event == "token":
+                    text += data
+                    placeholder.markdown(text + "▌")
+                elif event == "tool_calls":
+                    status.update(label=f"🔧 Calling {', '.join(data)}...")
+                    status.write(f"🔧 Calling: {', '.join(data)}")
+                elif event == "tool_results":
+                    status.write(f"🛠 {len(data)} tool result(s) received")
+                elif event == "done":
+                    result = data
+        except Exception as e:
+            error = e
+
+        placeholder.markdown(text)
+        if result is None:
+            # The agent failed or the stream ended without a final state
+            status.update(label="❌ Failed", state="error")
+            st.error(f"Sorry, something went wrong: {error or 'the agent stopped without an answer'}")
+        elif result.get("cached"):
+            status.update(label="⚡ Answered from cache", state="complete")
+        else:
+            status.update(label="✅ Done", state="complete")
 
     # Update session state
-    st.session_state.messages = result["messages"]
-    st.session_state.llm_calls = result.get("llm_calls", st.session_state.llm_calls)
-
-    # Display new messages
-    for msg in result["messages"][-3:]:  # show only latest cycle
-        if isinstance(msg, AIMessage):
-            with st.chat_message("assistant"):
-                st.write(msg.content)
-
-                if msg.tool_calls:
-                    with st.expander("🔧 Tool Calls"):
-                        for tc in msg.tool_calls:
-                            st.json(tc)
-
-        elif isinstance(msg, ToolMessage):
-            with st.chat_message("assistant"):
-                st.markdown("**🛠 Tool Result:**")
-                st.write(msg.content)
+    if result is not None:
+        final_state = result["state"]
+        st.session_state.messages = final_state["messages"]
+        st.session_state.llm_calls = final_state.get("llm_calls", st.session_state.llm_calls)
+        st.session_state.prompt_tokens = final_state.get("prompt_tokens", [])
+        st.session_state.latency = {"ttft": result["ttft"], "total": result["total"]}
 
 # -------------------------------
 # Sidebar Debug Panel
@@ -93,8 +147,22 @@ with st.sidebar:
     st.header("🧠 Agent Debug Info")
     st.write(f"LLM Calls: {st.session_state.llm_calls}")
     st.write(f"Messages in State: {len(st.session_state.messages)}")
+    st.caption(f"Thread: {st.session_state.thread_id}")
+    if st.session_state.latency:
+        ttft = st.session_state.latency["ttft"]
+        st.write(f"Time to First Token: {ttft:.2f}s" if ttft is not None else "Time to First Token: n/a")
+        st.write(f"Total Response Time: {st.session_state.latency['total']:.2f}s")
+    if st.session_state.prompt_tokens:
+        st.write(f"Prompt Tokens (last call): ~{st.session_state.prompt_tokens[-1]}")
+        st.line_chart(st.session_state.prompt_tokens)
 
     if st.button("🧹 Clear Conversation"):
+        # Drop the old thread's checkpoints; a fresh thread ID starts a new conversation
+        end_conversation(st.session_state.thread_id)
+        st.session_state.thread_id = str(uuid.uuid4())
         st.session_state.messages = []
         st.session_state.llm_calls = 0
-        st.experimental_rerun()
+        st.session_state.prompt_tokens = []
+        st.session_state.latency = None
+        st.session_state.history_limit = HISTORY_PAGE_SIZE
+        st.rerun()
@@ -0,0 +1,114 @@
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# --- CONFIGURATION ---
+TOOL_DESCRIPTION_CHARS = int(os.getenv("TOOL_DESCRIPTION_CHARS", "160"))
+
+# Fields the LLM gets to see per tool (order = column order); other keys are dropped
+TOOL_FIELDS: Dict[str, List[str]] = {
+    "search_products_qdrant": ["product_id", "title", "price", "in_stock", "options", "vendor", "tags", "description", "url"],
+    "get_product_details": ["title", "price", "in_stock", "variants", "vendor", "tags", "description", "url"],
+}
+
+_PRODUCT_ID_RE = re.compile(r"""['"]?product_id['"]?\s*:\s*(\d+)""")
+# compare_products lists its columns as "product_ids":[1,2,...]
+_PRODUCT_IDS_RE = re.compile(r"""['"]?product_ids['"]?\s*:\s*\[([\d,\s]*)\]""")
+
+
+def _dumps(value: Any) -> str:
+    """Minified JSON."""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _truncate(text: str, max_chars: int = TOOL_DESCRIPTION_CHARS) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+
+def _clean(record: dict, fields: Optional[List[str]]) -> dict:
+    """Applies the field whitelist, drops empty values and truncates descriptions."""
+    keys = fields if fields is not None else list(record)
+    cleaned = {}
+    for key in keys:
+        value = record.get(key)
+        if value is None or value == "" or value == []:
+            continue
+        if key == "description" and isinstance(value, str):
+            value = _truncate(value)
+        cleaned[key] = value
+    return cleaned
+
+
+def _common_prefix(urls: List[str]) -> str:
+    if len(urls) < 2:
+        return ""
+    prefix = os.path.commonprefix(urls)
+    return prefix[: prefix.rfind("/") + 1]
+
+
+def products_to_table(products: List[dict], fields: Optional[List[str]], shown_ids: Set[str]) -> dict:
+    """
+    Renders a product list as {"columns": [...], "rows": [[...], ...]} so keys
+    aren't repeated per product. The shared store URL prefix is emitted once,
+    and products already shown in this turn are listed by ID only.
+    """
+    fresh, repeated = [], []
+    for product in products:
+        pid = product.get("product_id")
+        if pid is not None and str(pid) in shown_ids:
+            repeated.append(pid)
+        else:
+            fresh.append(_clean(product, fields))
+
+    columns = [f for f in (fields or sorted({k for p in fresh for k in p})) if any(f in p for p in fresh)]
+    table: Dict[str, Any] = {}
+    if "url" in columns:
+        prefix = _common_prefix([p["url"] for p in fresh if "url" in p])
+        if prefix:
+            table["url_prefix"] = prefix
+            for p in fresh:
+                if "url" in p:
+                    p["url"] = p["url"][len(prefix):]
+    table["columns"] = columns
+    table["rows"] = [[p.get(c) for c in columns] for p in fresh]
+    if repeated:
+        table["already_shown_product_ids"] = repeated
+    return table
+
+
+def serialize_tool_result(tool_name: str, observation: Any, shown_ids: Iterable[str] = ()) -> str:
+    """
+    Token-efficient ToolMessage content: minified JSON, per-tool field
+    whitelist, truncated descriptions, no null fields, and tabular product lists.
+    """
+    fields = TOOL_FIELDS.get(tool_name)
+    if isinstance(observation, list) and all(isinstance(p, dict) for p in observation):
+        return _dumps(products_to_table(observation, fields, set(shown_ids)))
+    if isinstance(observation, dict):
+        return _dumps(_clean(observation, fields))
+    if isinstance(observation, str):
+        return observation
+    return _dumps(observation)
+
+
+def extract_product_ids(content: str) -> List[str]:
+    """
+    Product IDs mentioned in a tool result, for both the tabular format
+    plain dict/repr dumps and compare_products results.
+    """
+    ids: List[str] = []
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        data = None
+    if isinstance(data, dict) and "columns" in data and "product_id" in data["columns"]:
+        index = data["columns"].index("product_id")
+        ids.extend(str(row[index]) for row in data.get("rows", []))
+        ids.extend(str(pid) for pid in data.get("already_shown_product_ids", []))
+    else:
+        ids.extend(_PRODUCT_ID_RE.findall(content))
+        for group in _PRODUCT_IDS_RE.findall(content):
+            ids.extend(pid.strip() for pid in group.split(",") if pid.strip())
+    return list(dict.fromkeys(ids))